@@ -26,12 +26,11 @@ for metric in "${METRICS[@]}"; do
         echo "Running test for OSS: $oss_name, Model: $model_name..."
         tmux kill-session -t oss-bench-dataset-gen 2>/dev/null
         tmux kill-session -t oss-bench-test 2>/dev/null
-        echo "Starting dataset generation. Wait 60 seconds for it to complete..."
-        tmux new-session -d -s oss-bench-dataset-gen
-        tmux send-keys -t oss-bench-dataset-gen "cd $current_dir && python3 main.py --OSS $oss_name --model $model_name --dataset-generation" C-m
-        sleep 60
+        # generation tests every accepted patch on the tree it just built; the
+        # follow-up --test only picks up iterations an interrupted run left untested
+        echo "Starting dataset generation and test..."
         tmux new-session -d -s oss-bench-test
-        tmux send-keys -t oss-bench-test "cd $current_dir && python3 main.py --OSS $oss_name --model $model_name --test; echo 'Press Enter to continue...'; read" C-m
+        tmux send-keys -t oss-bench-test "cd $current_dir && python3 main.py --OSS $oss_name --model $model_name --pipeline && python3 main.py --OSS $oss_name --model $model_name --test; echo 'Press Enter to continue...'; read" C-m
         echo "Test benchmark completed."
     else
         echo "Invalid metric specified: $metric. Please use 'compilability' or 'test'."
@@ -0,0 +1,93 @@
+import os
+import io
+import gzip
+import json
+import tarfile
+from sqlite3db import FunctionDB, CoverageDB
+from docker import OSSBenchDocker, LAYOUT
+
+# one-time index of which test units execute which function of the base commit,
+# used by `main.py --test --selective` to run only the tests covering a patch
+
+
+def function_lines(function_db):
+    """
+    Map the definition line of every function to its id.
+
+    :return: A dictionary {(path relative to the repository root, line): id}.
+    """
+    lines = {}
+    for fid, function_index in function_db.fetch_function_indexes():
+        filepath, line, column = function_index.rsplit(':', 2)
+        relpath = "/".join(os.path.normpath(filepath).split(os.sep)[1:])
+        lines[(relpath, int(line))] = fid
+    return lines
+
+
+def executed_functions(report, srcdir, builddir):
+    """
+    Yield (relpath, start line) of every function executed in one gcov JSON report.
+    """
+    cwd = report.get("current_working_directory", builddir)
+    for each in report.get("files", []):
+        path = os.path.normpath(os.path.join(cwd, each["file"]))
+        if not path.startswith(srcdir + "/"):
+            continue
+        relpath = path[len(srcdir) + 1:]
+        for function in each.get("functions", []):
+            if function.get("execution_count", 0) > 0:
+                yield relpath, function["start_line"]
+
+
+def read_coverage(archive_path, srcdir, builddir):
+    """
+    Stream the archive written by OSSBenchDocker.build_coverage.
+
+    :return: Generator of (test unit, set of (relpath, start line) it executed).
+    """
+    with tarfile.open(archive_path, "r:gz") as archive:
+        units = archive.extractfile("coverage-units.txt").read().decode().split('\n')
+        for n, unit in enumerate(filter(None, units), start=1):
+            try:
+                member = archive.extractfile(f"coverage/{n}.json.gz")
+            except KeyError:
+                continue
+            executed = set()
+            with gzip.open(io.BytesIO(member.read()), "rt", encoding="utf-8") as reports:
+                # gcov --stdout prints one JSON document per object file
+                for line in reports:
+                    line = line.strip()
+                    if line:
+                        executed.update(executed_functions(json.loads(line), srcdir, builddir))
+            yield unit, executed
+
+
+def build_coverage_index(OSS, jobs=16, archive_path=None):
+    """
+    Build ./data/{OSS}/coverage.db for the functions of the base ./data/{OSS}/function.db.
+
+    :param jobs: make -j value and test parallelism in the coverage container.
+    :param archive_path: Reuse an archive from a previous build_coverage run instead of running the suite.
+    """
+    image, srcdir, builddir, user = LAYOUT[OSS]
+    if archive_path is None:
+        archive_path = f"./data/{OSS}/coverage.tgz"
+        with OSSBenchDocker(OSS, f"coverage_{OSS}") as session:
+            if not session.build_coverage(archive_path, jobs=jobs):
+                exit("no coverage archive produced")
+
+    function_db = FunctionDB(f"./data/{OSS}/function.db")
+    lines = function_lines(function_db)
+    function_db.close()
+
+    rows = []
+    covered = set()
+    for unit, executed in read_coverage(archive_path, srcdir, builddir):
+        ids = {lines[each] for each in executed if each in lines}
+        covered |= ids
+        rows.extend((fid, unit) for fid in sorted(ids))
+        print(f"{unit}: {len(ids)} functions")
+
+    coverage_db = CoverageDB(f"./data/{OSS}/coverage.db")
+    coverage_db.replace_coverage(rows)
+    print(f"{len(covered)}/{len(lines)} functions are executed by at least one test unit")
@@ -0,0 +1,273 @@
+import os
+import time
+import shlex
+
+# container layout of the prebuilt OSS-Bench images
+# OSS -> (image, source dir, build dir, exec user)
+LAYOUT = {
+    "php-src": ("0599jiangyc/flowfusion4llm:latest", "/home/phpfuzz/WorkSpace/flowfusion/php-src", "/home/phpfuzz/WorkSpace/flowfusion/php-src", None),
+    "sqlite": ("0599jiangyc/sqlite4llm:latest", "/home/test/sqlite", "/home/test/sqlite/build", "test"),
+}
+
+FUZZ_IMAGE = "0599jiangyc/flowfusion4llm4fuzz:latest"
+
+FLOWFUSION_DIR = "/home/phpfuzz/WorkSpace/flowfusion"
+
+# the patch currently applied inside the container, kept next to the sources so
+# that the next build can undo it without any state on the host
+APPLIED_DIFF = ".oss-bench-applied.diff"
+
+
+def patched_files(diff_path):
+    """
+    Paths, relative to the repository root, of the files a unified diff modifies.
+    """
+    files = set()
+    with open(diff_path, "r", encoding="iso-8859-1") as f:
+        for line in f:
+            if line.startswith("+++ ") and not line.startswith("+++ /dev/null"):
+                path = line[4:].rstrip("\n").split("\t")[0]
+                files.add(path[2:] if path.startswith("b/") else path)
+    return files
+
+
+class OSSBenchDocker:
+    """
+    A long-lived build container for one worker.
+
+    Instead of `docker run` / `docker kill` / `docker rm` for every unit of work, the
+    container is started once and every build first reverts the previously applied
+    patch (`git apply -R`, falling back to `git checkout`) before applying the next
+    one. The object tree is kept, so `make` only rebuilds what the two patches touch.
+    """
+
+    def __init__(self, OSS, docker_label, image=None, cpuset=None):
+        """
+        :param OSS: "php-src" or "sqlite"
+        :param docker_label: The container name, unique per worker.
+        :param image: Override the default image (e.g. FUZZ_IMAGE).
+        :param cpuset: Host CPUs the container is pinned to (e.g. "0-7"), None for all.
+        """
+        if OSS not in LAYOUT:
+            print("unsupported OSS. abort...")
+            exit()
+        self.OSS = OSS
+        self.docker_label = docker_label
+        default_image, self.srcdir, self.builddir, self.user = LAYOUT[OSS]
+        self.image = image or default_image
+        self.cpuset = cpuset
+        self.running = False
+        # set when a build was killed by `timeout`, half-written objects are not trusted
+        self.stale = False
+        # files of the patch left applied by the last build, and of the one it reverted
+        self.applied = set()
+        self.reverted = set()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """
+        (Re)start the container from a clean image.
+        """
+        self.stop()
+        pinning = f"--cpuset-cpus {self.cpuset} " if self.cpuset else ""
+        os.system(f"docker run --name {self.docker_label} {pinning}-dit {self.image} bash > /dev/null")
+        self.running = True
+        self.stale = False
+        self.applied = set()
+        self.reverted = set()
+
+    def stop(self):
+        """
+        Kill and remove the container if it exists.
+        """
+        os.system(f"docker kill {self.docker_label} > /dev/null 2>&1")
+        os.system(f"docker rm {self.docker_label} > /dev/null 2>&1")
+        self.running = False
+
+    def exec(self, script, workdir=None):
+        """
+        Run a shell script inside the container.
+
+        :param script: The bash script to run.
+        :param workdir: Directory to run in, defaults to the source dir.
+        :return: The exit code of the script.
+        """
+        user = f"-u {self.user} " if self.user else ""
+        script = f"cd {workdir or self.srcdir} && {script}"
+        return os.waitstatus_to_exitcode(os.system(f"docker exec {user}{self.docker_label} bash -c {shlex.quote(script)}"))
+
+    def copy_in(self, host_path, container_dir=None):
+        os.system(f"docker cp {host_path} {self.docker_label}:{container_dir or self.srcdir}/ > /dev/null")
+
+    def copy_out(self, container_path, host_path):
+        """
+        Copy a file out of the container.
+
+        :return: True if the file exists on the host afterwards.
+        """
+        if os.path.exists(host_path):
+            os.remove(host_path)
+        os.system(f"docker cp {self.docker_label}:{container_path} {host_path} > /dev/null 2>&1")
+        return os.path.exists(host_path)
+
+    def revert_script(self):
+        """
+        Shell snippet undoing the patch left by the previous build.
+        """
+        return f"if [ -f {APPLIED_DIFF} ]; then git apply -R {APPLIED_DIFF} || git checkout -- . ; rm -f {APPLIED_DIFF}; fi"
+
+    def build(self, diff_path, log_path, jobs=None, timeout=600):
+        """
+        Swap the applied patch for `diff_path` and run an incremental `make`.
+
+        The make log also shows what reverting the previous patch rebuilds. It only shows
+        this patch alone (as a fresh container would) when `reverted` <= `applied`
+        afterwards; otherwise tell "make nothing" apart with make_nothing().
+
+        :param diff_path: Host path of the unified diff to apply.
+        :param log_path: Host path the make log is copied to.
+        :param jobs: make -j value, defaults to 16 for php-src and 24 for sqlite.
+        :param timeout: Seconds before make is killed.
+        :return: The exit code of `git apply && make`; the log is only present on the host
+                 when the patch applied.
+        """
+        if jobs is None:
+            jobs = 16 if self.OSS == "php-src" else 24
+        if not self.running or self.stale:
+            self.start()
+
+        diff_name = os.path.basename(diff_path)
+        self.copy_in(diff_path)
+        self.reverted = self.applied
+        # if the patch does not apply nothing is left applied, which these files over-approximate
+        self.applied = patched_files(diff_path)
+        code = self.exec(
+            f"rm -f {self.builddir}/make.log; {self.revert_script()}; "
+            f"git apply ./{diff_name} > /dev/null && cp ./{diff_name} {APPLIED_DIFF} && "
+            f"cd {self.builddir} && timeout {timeout} make -j{jobs} > ./make.log 2>&1"
+        )
+        if code == 124:
+            self.stale = True
+        self.copy_out(f"{self.builddir}/make.log", log_path)
+        return code
+
+    def test(self, log_path, jobs=32, timeout=150, tests=None):
+        """
+        Run the test suite on the tree left by the last successful build.
+
+        :param log_path: Host path the raw test log is copied to.
+        :param jobs: Parallel test workers.
+        :param timeout: Seconds before the test run is killed.
+        :param tests: Only run these test units (php-src test directories or sqlite test
+                      files, as listed in the coverage index); None runs the whole suite.
+        :return: True if a test log was produced.
+        """
+        if tests is not None and not tests:
+            # no test executes the patched code, an empty selection would run everything
+            return False
+        if self.OSS == "php-src":
+            selection = f" TESTS={shlex.quote(' '.join(tests))}" if tests is not None else ""
+            self.exec(f"rm -f ./test.log; git restore *.phpt && timeout {timeout} make test TEST_PHP_ARGS=\"-j{jobs} --set-timeout 5\"{selection} > ./test.log 2>&1")
+            return self.copy_out(f"{self.builddir}/test.log", log_path)
+        else:
+            # testrunner.tcl takes glob patterns over the test file names
+            selection = "".join(f" {os.path.basename(test)}" for test in tests) if tests is not None else ""
+            self.exec(f"rm -f ./testrunner.log; timeout {timeout} ./testfixture ../test/testrunner.tcl --jobs {jobs}{selection}", workdir=self.builddir)
+            return self.copy_out(f"{self.builddir}/testrunner.log", log_path)
+
+    def fuzz(self, iteration, bugs_path, fuzzsize, timeout=1800):
+        """
+        Run one flowfusion campaign on the current build (FUZZ_IMAGE only).
+
+        :param iteration: Dataset iteration, names the bugs folder inside the archive.
+        :param bugs_path: Host path the zipped bugs folder is copied to.
+        :param fuzzsize: Number of test cases flowfusion stops after.
+        :param timeout: Seconds before the campaign is killed.
+        :return: (True if the archive was produced, seconds the campaign ran, exit code:
+                  0 when flowfusion stopped at fuzzsize, 124 when the timeout killed it,
+                  anything else when it failed).
+        """
+        # the image ships -1, a warm container keeps the previous campaign's value
+        self.exec(f"sed -i \"s/self\\.stopping_test_num = -\\?[0-9]\\+/self.stopping_test_num = {fuzzsize}/g\" ./main.py", workdir=FLOWFUSION_DIR)
+        started = time.monotonic()
+        code = self.exec(f"rm -f ./bugs.zip; timeout {timeout} python3 main.py", workdir=FLOWFUSION_DIR)
+        elapsed = time.monotonic() - started
+        self.exec(f"mv ./bugs ./{iteration}_bugs && zip -qr bugs.zip ./{iteration}_bugs", workdir=FLOWFUSION_DIR)
+        produced = self.copy_out(f"{FLOWFUSION_DIR}/bugs.zip", bugs_path)
+        # leave flowfusion as the image shipped it for the next iteration
+        self.exec(f"rm -rf ./{iteration}_bugs ./bugs.zip && mkdir -p ./bugs", workdir=FLOWFUSION_DIR)
+        return produced, elapsed, code
+
+    def build_coverage(self, archive_path, jobs=16, timeout=600):
+        """
+        Rebuild the unpatched tree with gcov instrumentation, run every test unit on its
+        own and capture which functions it executed (one-time, see coverage_index.py).
+
+        Test units are the directories holding .phpt files for php-src and the test/*.test
+        files for sqlite. For each unit the `gcov --json-format` output of all objects is
+        stored, gzipped, as coverage/<n>.json.gz, n being the unit's line in coverage-units.txt.
+
+        :param archive_path: Host path the tar.gz of coverage/ and coverage-units.txt is copied to.
+        :param jobs: make -j value and test parallelism.
+        :param timeout: Seconds before the test run of one unit is killed.
+        :return: True if the archive was produced.
+        """
+        if not self.running or self.stale:
+            self.start()
+        if self.OSS == "php-src":
+            # PROF_FLAGS reaches both compile and link lines, as for `make prof-gen`
+            self.exec(f"{self.revert_script()}; make clean > /dev/null 2>&1; make -j{jobs} PROF_FLAGS=--coverage > /dev/null 2>&1")
+            self.exec("find . -name '*.phpt' -not -path './.git/*' -printf '%h\\n' | sed 's|^\\./||' | sort -u > coverage-units.txt")
+            run_unit = f"timeout {timeout} make test TESTS=\"$unit\" TEST_PHP_ARGS=\"-j{jobs} --set-timeout 5\" > /dev/null 2>&1; git restore *.phpt"
+        else:
+            # --linemacros keeps the amalgamation's line numbers pointing into src/
+            self.exec(f"{self.revert_script()}; make distclean > /dev/null 2>&1; "
+                      f"../configure --linemacros CFLAGS='-g -O0 --coverage' LDFLAGS=--coverage > /dev/null 2>&1 && make -j{jobs} testfixture > /dev/null 2>&1",
+                      workdir=self.builddir)
+            self.exec("ls test/*.test > coverage-units.txt")
+            run_unit = f"(cd {self.builddir} && timeout {timeout} ./testfixture ../$unit > /dev/null 2>&1)"
+        self.exec(
+            "rm -rf coverage && mkdir coverage && n=0 && while read unit; do n=$((n+1)); "
+            "find . -name '*.gcda' -delete; "
+            f"{run_unit}; "
+            "find . -name '*.gcda' -exec gcov --json-format --stdout {} + 2> /dev/null | gzip > coverage/$n.json.gz; "
+            "done < coverage-units.txt && tar czf coverage.tgz coverage coverage-units.txt"
+        )
+        produced = self.copy_out(f"{self.srcdir}/coverage.tgz", archive_path)
+        # the instrumented objects must not leak into later builds
+        self.stale = True
+        return produced
+
+    def make_nothing(self, relpaths):
+        """
+        Dry-run `make -W <file>` for each source file on the current, fully built tree.
+
+        Used when several functions were built together: it tells which of them would
+        have built nothing on their own, judged with the same strings linear_execution
+        applies to a real make log.
+
+        :param relpaths: Source paths relative to the repository root (e.g. "main/output.c").
+        :return: The subset of relpaths whose modification triggers nothing.
+        """
+        if self.OSS == "php-src":
+            quiet = "! make -n -W {rel} -W {abs} 2>&1 | grep -q libtool"
+        else:
+            quiet = "make -n -W {rel} -W {abs} 2>&1 | grep -q \"Nothing to be done for 'all'.\""
+        # make may know the prerequisite relative to the build dir or by absolute path
+        up = os.path.relpath(self.srcdir, self.builddir)
+        checks = "; ".join(
+            quiet.format(rel=os.path.normpath(os.path.join(up, relpath)), abs=f"{self.srcdir}/{relpath}") + f" && echo {relpath}"
+            for relpath in relpaths
+        )
+        self.exec(f"({checks}) > ./make-nothing.txt", workdir=self.builddir)
+        host_path = f"/tmp/{self.docker_label}_make_nothing.txt"
+        if not self.copy_out(f"{self.builddir}/make-nothing.txt", host_path):
+            return set()
+        with open(host_path, "r") as f:
+            return set(f.read().split())
@@ -2,6 +2,9 @@ import os
 import re
 import regex
 import sys
+import shutil
+import argparse
+from multiprocessing import Pool
 from clang import cindex
 from sqlite3db import FunctionDB
 
@@ -16,41 +19,130 @@ def find_all_c_files(phpsrc_path):
     os.system("rm ./allcfiles")
     return allcfiles
 
-def get_source_text(extent):
+def find_changed_c_files(phpsrc_path, old_commit):
     """
-    Read and return the text from the file corresponding to the given extent.
+    List the .c files changed between old_commit and the checked out commit.
+
+    :return: List of (old_path, new_path) prefixed with phpsrc_path; old_path is None
+             for added files and new_path is None for deleted ones.
+    """
+    cmd = f"cd {phpsrc_path} && git diff --name-status -M {old_commit} HEAD -- '*.c' > ../changedcfiles"
+    os.system(cmd)
+    f = open("./changedcfiles", "r")
+    lines = f.read().strip('\n').split('\n')
+    f.close()
+    os.system("rm ./changedcfiles")
+    changes = []
+    for line in filter(None, lines):
+        status, *paths = line.split('\t')
+        paths = [f"{phpsrc_path}/{path}" for path in paths]
+        if status.startswith('A'):
+            changes.append((None, paths[0]))
+        elif status.startswith('D'):
+            changes.append((paths[0], None))
+        elif status.startswith('R') or status.startswith('C'):
+            # a copy leaves its source untouched
+            changes.append((paths[0] if status.startswith('R') else None, paths[1]))
+        else:
+            changes.append((paths[0], paths[0]))
+    return changes
+
+def update_baseline(db, phpsrc_path, old_commit, mapper=map):
+    """
+    Bring a function.db extracted at old_commit up to the checked out commit,
+    re-parsing only the .c files that changed in between.
+
+    A function keeps its id when its file changed (or was renamed) but its text did
+    not; functions that changed or disappeared are dropped, new ones get fresh ids.
+    function_index_map records the old -> new function_index of every old function.
+
+    :param mapper: map, or the imap of a worker pool.
+    """
+    changes = find_changed_c_files(phpsrc_path, old_commit)
+    parsed = dict(mapper(extract_file, sorted(new_path for old_path, new_path in changes if new_path)))
+    records = []
+    mapping = []
+    for old_path, new_path in sorted(changes, key=lambda change: change[1] or ""):
+        old_rows = db.fetch_functions_by_filepath(old_path) if old_path else []
+        # old functions by text, duplicates matched in order
+        unmatched = {}
+        for row in old_rows:
+            unmatched.setdefault(row[4], []).append(row)
+        for idx, filepath, token_number, content in parsed.get(new_path, []):
+            if unmatched.get(content):
+                old_row = unmatched[content].pop(0)
+                records.append((old_row[0], idx, filepath, token_number, content, old_row[5]))
+                mapping.append((old_row[1], idx, old_row[0]))
+            else:
+                records.append((None, idx, filepath, token_number, content, "-"))
+        for rows in unmatched.values():
+            mapping.extend((row[1], None, row[0]) for row in rows)
+        print(f"Updated {old_path or new_path}: {len(old_rows)} -> {len(parsed.get(new_path, []))} functions")
+    db.replace_functions([old_path for old_path, new_path in changes if old_path], records, mapping)
+
+def read_source(file_name):
+    """
+    Read a C file once; extents of every function in it are sliced from this buffer.
     """
-    start = extent.start
-    end = extent.end
-    file_name = start.file.name
     # make sure you have the encoding for non-utf char, otherwise the func range can be wrong!
-    with open(file_name, 'r', encoding="iso-8859-1") as f:
-        text = f.read()
-    # Use the offsets provided by the extent to slice the source text.
-    return text[start.offset:end.offset]
-
-def extract_functions(node, functions, main_file):
-    # Only process nodes that come from the main file
-    if node.location.file and node.location.file.name != main_file:
-        return
-    # Check if the node is a function declaration and a definition (has a body)
-    if node.kind == cindex.CursorKind.FUNCTION_DECL and node.is_definition():
-        func_name = node.spelling
-        loc = node.location
-        try:
-            func_content = get_source_text(node.extent)
-        except Exception as e:
-            func_content = f"Error retrieving content: {e}"
-        functions.append({
-            'name': func_name,
-            'file': loc.file,
-            'line': loc.line,
-            'column': loc.column,
-            'content': func_content
-        })
-    # Recursively traverse child nodes
+    # newline='' keeps \r\n as two characters so libclang byte offsets index the text directly
+    with open(file_name, 'r', encoding="iso-8859-1", newline='') as f:
+        return f.read()
+
+def extract_functions(node, functions, main_file, text):
+    """
+    Collect the function definitions of main_file, slicing their source from text.
+
+    Only the top level of the translation unit is scanned: declarations coming from
+    included headers are skipped without walking their subtrees, and function bodies
+    are never descended into since C has no nested functions.
+    """
     for child in node.get_children():
-        extract_functions(child, functions, main_file)
+        # Only process nodes that come from the main file
+        if child.location.file is None or child.location.file.name != main_file:
+            continue
+        # Check if the node is a function declaration and a definition (has a body)
+        if child.kind == cindex.CursorKind.FUNCTION_DECL:
+            if child.is_definition():
+                loc = child.location
+                functions.append({
+                    'name': child.spelling,
+                    'file': loc.file,
+                    'line': loc.line,
+                    'column': loc.column,
+                    'offset': child.extent.start.offset,
+                    'content': text[child.extent.start.offset:child.extent.end.offset]
+                })
+        elif child.kind == cindex.CursorKind.LINKAGE_SPEC:
+            extract_functions(child, functions, main_file, text)
+
+index = None # one cindex.Index per process, created on first use
+
+def extract_file(c_file_path):
+    """
+    Parse one C file and return its function records ordered by source offset.
+    Runs in the worker processes of the extractor.
+
+    :return: (c_file_path, [(function_index, filepath, token_number, content), ...])
+    """
+    global index
+    if index is None:
+        index = cindex.Index.create()
+    # Parse the source file (adjust the arguments as needed, e.g., include paths)
+    translation_unit = index.parse(c_file_path, args=['-std=c99'])
+    text = read_source(c_file_path)
+
+    functions = []
+    extract_functions(translation_unit.cursor, functions, c_file_path, text)
+
+    rows = []
+    for func in sorted(functions, key=lambda func: func['offset']):
+        filepath = str(func['file'])
+        idx = f"{func['file']}:{func['line']}:{func['column']}"
+        token_number = get_token_number(func['content'])
+        if token_number>=10 and token_number<256:
+            rows.append((idx, filepath, token_number, func['content'])) # baseline test: func['content'].replace(';','; // test',1)
+    return c_file_path, rows
 
 def get_token_number(s):
     # Split the string on whitespace
@@ -60,7 +152,25 @@ def get_token_number(s):
 
 # Example usage:
 if __name__ == "__main__":
-    
+
+    parser = argparse.ArgumentParser(description="Extract C functions of php-src into function-baseline.db.")
+    parser.add_argument("--jobs",
+                        type=int,
+                        default=1,
+                        help="Number of processes parsing translation units at once.")
+    parser.add_argument("--since",
+                        type=str,
+                        help="Update ./function-baseline.db, extracted at this commit, to the checked out commit "
+                             "by re-parsing only the changed files.")
+    parser.add_argument("--carry-forward",
+                        type=str,
+                        nargs="*",
+                        default=[],
+                        help="Model function.db files from the previous baseline; their outputs for unchanged "
+                             "functions are copied into a function-baseline.db next to each of them.")
+    args = parser.parse_args()
+    args.carry_forward = [os.path.abspath(model_db) for model_db in args.carry_forward]
+
     # need to modify the following path to extract functions
     
     if not os.path.exists("./data/php-src/php-src"):
@@ -71,31 +181,31 @@ if __name__ == "__main__":
 
     db = FunctionDB("./function-baseline.db")
     phpsrc_path = "./php-src"
-    
-    allcfiles = find_all_c_files(phpsrc_path)
-    count = 0
-    for eachcfile in allcfiles:
-        c_file_path = eachcfile
+    pool = Pool(args.jobs) if args.jobs > 1 else None
 
-        # Create an index to manage the translation units
-        index = cindex.Index.create()
-        
-        # Parse the source file (adjust the arguments as needed, e.g., include paths)
-        translation_unit = index.parse(c_file_path, args=['-std=c99'])
-        
-        functions = []
-        extract_functions(translation_unit.cursor, functions, c_file_path)
-    
-        # Print out all the extracted functions with their content
-        print("Extracted Functions:")
-        for func in functions:
-            count += 1
-            print(count)
-            filepath = str(func['file'])
-            idx = f"{func['file']}:{func['line']}:{func['column']}"
-            token_number = get_token_number(func['content'])
-            if token_number>=10 and token_number<256:
-                db.insert_function(idx, filepath, token_number, func['content'], "-") # baseline test: func['content'].replace(';','; // test',1)
+    if args.since:
+        update_baseline(db, phpsrc_path, args.since, pool.imap if pool else map)
+    else:
+        # ids are assigned by file path, then by offset in the file, whatever the number of jobs
+        allcfiles = sorted(find_all_c_files(phpsrc_path))
+        results = pool.imap(extract_file, allcfiles, chunksize=4) if pool else map(extract_file, allcfiles)
+        records = []
+        for c_file_path, rows in results:
+            print(f"Extracted {len(rows)} functions from {c_file_path}")
+            records.extend((idx, filepath, token_number, content, "-") for idx, filepath, token_number, content in rows)
+            if len(records) >= 1000:
+                db.insert_functions(records)
+                records = []
+        db.insert_functions(records)
+    if pool:
+        pool.close()
+        pool.join()
     db.close()
 
-
+    # model outputs survive for every function whose id and text did not change
+    for model_db in args.carry_forward:
+        new_model_db = os.path.join(os.path.dirname(model_db), "function-baseline.db")
+        shutil.copy("./function-baseline.db", new_model_db)
+        db = FunctionDB(new_model_db)
+        db.carry_forward(model_db)
+        db.close()
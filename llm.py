@@ -1,19 +1,48 @@
 import os
+import time
+import random
+import hashlib
+import json
 import shutil
 import ollama
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from tqdm import tqdm
-from sqlite3db import FunctionDB
+from sqlite3db import FunctionDB, ResponseCache
 from prompt import Prompt
-import multiprocessing
 
 # nothink = '//nothink'
 
 class Backend:
-    def __init__(self, seed=0):
+    def __init__(self, seed=0, jobs=4, host=None, timeout=120, retries=3, backoff=2.0,
+                 cache="./data/llm_cache.db", cache_size=1 << 30):
+        """
+        :param seed: Sampling seed passed to the model.
+        :param jobs: Requests kept in flight at once; match it to OLLAMA_NUM_PARALLEL.
+        :param host: Ollama server, defaults to OLLAMA_HOST or http://localhost:11434.
+        :param timeout: Seconds before a single request is abandoned.
+        :param retries: Extra attempts for a request that timed out or failed.
+        :param backoff: Base delay in seconds, doubled after every failed attempt.
+        :param cache: Response cache shared across runs and OSS, None to disable.
+        :param cache_size: Bytes of responses kept before least recently used ones are evicted.
+        """
         prompt = Prompt()
         self.system_prompt = prompt.system_prompt # + nothink
         self.optimizing_prompt = prompt.optimizing_prompt
         self.seed = seed
+        self.jobs = jobs
+        self.retries = retries
+        self.backoff = backoff
+        # the timeout is enforced by the HTTP client, no process is forked per request
+        self.client = ollama.Client(host=host, timeout=timeout)
+        self.cache = ResponseCache(cache, cache_size) if cache else None
+
+    def cache_key(self, model, cfunction):
+        """
+        Content address of a request: the same model, seed, prompts and function text
+        always get the same answer from the cache.
+        """
+        request = [model, self.seed, self.system_prompt, self.optimizing_prompt, cfunction]
+        return hashlib.sha256(json.dumps(request).encode()).hexdigest()
 
     def parse_llm_output(self, output):
         if "```" in output:
@@ -25,85 +54,107 @@ class Backend:
         else:
             return output
 
-    def _ollama_chat_process(self, return_queue, model, messages, options):
+    def ollama_api(self, cfunction, model):
         """
-        Helper function to be run in a separate process.
-        Calls ollama.chat and places the result or exception into a queue.
-        """
-        try:
-            response = ollama.chat(model=model, messages=messages, options=options)
-            return_queue.put(("ok", response))
-        except Exception as e:
-            # Put the exception in the queue so we can handle it in the parent process
-            return_queue.put(("error", e))
+        Ask the model to optimize one function, retrying with exponential backoff.
+        Safe to call from several threads at once.
 
-    def ollama_api(self, cfunction, model, timeout=120):
-        """
-        Enforce a timeout on the ollama.chat call by running it in a separate process.
-        If it doesn’t finish within `timeout` seconds, it will be killed and a timeout
-        message will be returned.
+        :return: The parsed code, or an "Error: ..." string once every attempt failed.
         """
         messages = [
             {"role": "system", "content": self.system_prompt},
             {"role": "user", "content": self.optimizing_prompt.format(cfunction=cfunction)},
         ]
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            try:
+                response = self.client.chat(model=model, messages=messages, options={"seed": self.seed})
+            except ollama.ResponseError as e:
+                error = f"Error: Exception in ollama.chat: {e}"
+                if e.status_code == 404: # unknown model, retrying will not help
+                    break
+                continue
+            except Exception as e:
+                if "timed out" in str(e).lower() or "timeout" in type(e).__name__.lower():
+                    error = "Error: Timeout while waiting for ollama.chat response"
+                else:
+                    error = f"Error: Exception in ollama.chat: {e}"
+                continue
+            return self.parse_llm_output(response["message"]["content"])
+        return error
 
-        # Set up multiprocessing
-        manager = multiprocessing.Manager()
-        return_queue = manager.Queue()
-        proc = multiprocessing.Process(
-            target=self._ollama_chat_process,
-            args=(return_queue, model, messages, {"seed": self.seed})
-        )
-
-        # Start the process and wait for the result
-        proc.start()
-        proc.join(timeout)
-
-        # If it’s still alive after `timeout` seconds, kill it
-        if proc.is_alive():
-            proc.terminate()
-            proc.join()
-            return "Error: Timeout while waiting for ollama.chat response"
-
-        # Now retrieve the result from the queue
-        if not return_queue.empty():
-            status, result = return_queue.get()
-            if status == "error":
-                # If an exception occurred in the child process, handle accordingly
-                return f"Error: Exception in child process: {result}"
-            else:
-                # Parse the content from the response
-                optimized_code = result["message"]["content"]
-                return self.parse_llm_output(optimized_code)
-        else:
-            return "Error: No response received from ollama.chat"
+    def run(self, oss, model, seed, offline=False):
+        """
+        Fill optimized_function of ./data/{oss}/{model}-seed{seed}/function.db.
 
-    def run(self, oss, model, seed):
+        :param offline: Only take answers from the cache, never contact the server;
+                        functions without a cached answer are left as '-'.
+        """
         label = f"{model.replace(':','-')}-seed{seed}"
         if not os.path.exists(f"./data/{oss}/{label}"):
             os.mkdir(f"./data/{oss}/{label}")
         db_path = f"./data/{oss}/{label}/function.db"
         if not os.path.exists(db_path):
             shutil.copy(f"./data/{oss}/function.db", db_path)
+        if offline and self.cache is None:
+            exit("offline collection needs the response cache")
 
         db = FunctionDB(db_path)
         if oss=="php-src":
             maxx = 10534
         elif oss=="sqlite":
             maxx = 7321
-        for idd in tqdm(range(0,maxx)):
-            i, idx, filepath, token_number, function, todo_function = db.fetch_function_by_id(idd+1)
+        todo = []
+        hits = []
+        for i, idx, filepath, token_number, function, todo_function in db.iter_functions():
+            if i > maxx:
+                break
             if todo_function != '-':
                 continue
+            if self.cache is not None:
+                key = self.cache_key(model, function)
+                cached = self.cache.get(key)
+                if cached is not None:
+                    hits.append((idx, cached))
+                    continue
+            else:
+                key = None
+            if not offline:
+                todo.append((idx, key, function))
+        if hits:
+            db.update_many(hits)
 
-            new_function = self.ollama_api(function, model, timeout=120)
-            db.update_optimized_function(idx, new_function)
+        # keep `jobs` requests in flight so the server never idles between calls;
+        # results are written from this thread (the sqlite connections are not shared)
+        # in batched transactions, so an interrupted run resumes where the last commit stopped
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor, tqdm(total=len(todo)) as progress, db.batch():
+            pending = {}
+            todo = iter(todo)
+            while True:
+                for idx, key, function in todo:
+                    pending[executor.submit(self.ollama_api, function, model)] = idx, key
+                    if len(pending) >= 2 * self.jobs:
+                        break
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    idx, key = pending.pop(future)
+                    new_function = future.result()
+                    db.update_optimized_function(idx, new_function)
+                    # errors are not cached, a later run over a fresh function.db asks again
+                    if key is not None and not new_function.startswith("Error:"):
+                        self.cache.put(key, new_function)
+                    progress.update(1)
 
         db.close()
+        if self.cache is not None:
+            self.cache.flush()
+            print(f"\t > Response cache: {self.cache.hits} hits, {self.cache.misses} misses")
 
 # Example usage
 if __name__ == "__main__":
-    llm_backend = Backend()
+    llm_backend = Backend(jobs=4)
     # modify the following oss and model to collect LLMs output
     llm_backend.run(oss="sqlite", model="qwen2.5-coder:3b", seed=0)
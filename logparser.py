@@ -0,0 +1,101 @@
+import re
+
+# one-pass parsers for the test logs of php-src (run-tests.php) and sqlite (testrunner.log)
+
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+
+# "PASS Bug #12345 (title) [ext/standard/tests/foo.phpt]", optionally colored
+PHPT_RESULT = re.compile(r"^(PASS|FAIL|SKIP|BORK|XFAIL|XLEAK|LEAK|WARN|LEAK&FAIL)\s+(.*?)\s*\[([^\]]+\.phpt)\]")
+# the timing run-tests.php may append, "(123 ms)" / "(1.5 s)"
+PHPT_DURATION = re.compile(r"\((\d+(?:\.\d+)?) ?(ms|s)\)\s*$")
+
+# "### test/alter.test 123ms (done)"
+SQLITE_JOB = re.compile(r"^### (\S+)(.*)\((\w+)\)\s*$")
+SQLITE_DURATION = re.compile(r"(\d+)\s*ms")
+
+# statuses not stored per test, the pass counter covers them
+PASSED = ("PASS", "done")
+# statuses a patch is blamed for
+FAILED = ("FAIL", "LEAK&FAIL", "failed")
+
+
+class TestLogParser:
+    """
+    Stream one test log line by line, keeping only the five counters of TestResultDB
+    and yielding a (name, status, duration) record per test.
+
+    The counters follow the historical rules so results stay comparable across runs:
+    php-src counts every line ending a `.phpt]` reference and classifies it by the
+    colored status ("mPASS", "mFAIL", "mSKIP", anything else is borked); sqlite counts
+    the "### test/" lines and classifies "(done)" and "(failed)". Records are parsed
+    with the ANSI escapes removed, so they do not depend on the log being colored.
+    """
+
+    def __init__(self, OSS):
+        """
+        :param OSS: "php-src" or "sqlite"
+        """
+        self.OSS = OSS
+        self.total = 0
+        self.passed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.borked = 0
+
+    def feed(self, line):
+        """
+        Account for one log line.
+
+        :return: (name, status, duration in seconds or None) if the line reports a test, else None.
+        """
+        if self.OSS == "php-src":
+            if ".phpt]" not in line:
+                return None
+            self.total += 1
+            # add 'm' due to the color print
+            if "mPASS" in line:
+                self.passed += 1
+            elif "mFAIL" in line:
+                self.failed += 1
+            elif "mSKIP" in line:
+                self.skipped += 1
+            else:
+                self.borked += 1
+            line = ANSI_ESCAPE.sub("", line).strip()
+            match = PHPT_RESULT.match(line)
+            if match is None:
+                # e.g. the repeated names of the failed test summary
+                return None
+            duration = PHPT_DURATION.search(line)
+            if duration:
+                duration = float(duration.group(1)) / (1000 if duration.group(2) == "ms" else 1)
+            return match.group(3), match.group(1), duration
+        else:
+            if "### test/" not in line:
+                return None
+            self.total += 1
+            if "(done)" in line:
+                self.passed += 1
+            elif "(failed)" in line:
+                self.failed += 1
+            match = SQLITE_JOB.match(ANSI_ESCAPE.sub("", line).strip())
+            if match is None:
+                return None
+            duration = SQLITE_DURATION.search(match.group(2))
+            return match.group(1), match.group(3), int(duration.group(1)) / 1000 if duration else None
+
+    def parse(self, lines):
+        """
+        Feed every line of an iterable (an open file, a process' stdout, ...) and yield
+        the test records as they are found; the counters are final once it is exhausted.
+        """
+        for line in lines:
+            record = self.feed(line)
+            if record is not None:
+                yield record
+
+    def counts(self):
+        """
+        :return: (total, passed, failed, skipped, borked)
+        """
+        return self.total, self.passed, self.failed, self.skipped, self.borked
@@ -1,37 +1,302 @@
 #!/usr/bin/env python3
 
 import os
+import re
 import argparse
 import time
+import queue
+import shutil
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from tqdm import tqdm
-from sqlite3db import FunctionDB, DatasetDB, TestResultDB, FuzzResultDB
+from sqlite3db import FunctionDB, DatasetDB, TestResultDB, FuzzResultDB, CoverageDB
+from docker import OSSBenchDocker, FUZZ_IMAGE, LAYOUT
+from patch import FunctionSplicer, line_of
+from logparser import TestLogParser, PASSED, FAILED
+from coverage_index import build_coverage_index
+from sanitizer import ingest, ingest_model
 
 # demonstration code for OSS(php)-Bench and OSS(sqlite)-Bench
 
+# file:line of compiler errors and of sanitizer stack frames in a make log
+ERROR_LOCATION = re.compile(r"([\w./+-]+\.c):(\d+)(?::\d+)?(?=: (?:fatal )?error|\s|$)")
+
 class OSSBench:
     # OSS options = ["php-src", "sqlite"]
-    def __init__(self, model, OSS):
+    def __init__(self, model, OSS, jobs=1, batch=1, selective=False, store_patches=False, cpu_budget=None, failures_only=False):
         self.model = model
         self.OSS = OSS
+        self.jobs = jobs # number of isolated workers (one container each) running at once
+        self.batch = batch # functions built together by linear_execution before bisecting
+        self.selective = selective # test only the units covering the patched functions
+        self.store_patches = store_patches # also keep each patch in dataset.db
+        self.cpu_budget = cpu_budget # host CPUs the workers share, None for all
+        self.failures_only = failures_only # store per-test outcomes only for the tests that did not pass
         if self.OSS=="php-src":
             self.function_num = 10534 # functions in word count >=10 and <256
         elif self.OSS=="sqlite":
             self.function_num = 7321 # functions in word count >=10 and <256
         self.test_iteration_num = 1000 # how many iterations we need
         self.valid_functions = list(range(1, self.function_num+1))
+        self.sessions = {} # docker_label -> warm OSSBenchDocker
+
+    def _session(self, docker_label, image=None, cpuset=None):
+        """
+        Return the long-lived container for docker_label, created on first use.
+        """
+        if docker_label not in self.sessions:
+            self.sessions[docker_label] = OSSBenchDocker(self.OSS, docker_label, image, cpuset)
+        return self.sessions[docker_label]
+
+    def _worker_cpus(self, worker_id):
+        """
+        Split the host CPUs evenly between the workers so their builds and test runs
+        do not oversubscribe the machine.
+
+        :return: (cpuset for docker run, or None when jobs == 1 without a CPU budget, number of CPUs of the worker)
+        """
+        if self.jobs == 1 and self.cpu_budget is None:
+            return None, None
+        cpus = sorted(os.sched_getaffinity(0))[:self.cpu_budget]
+        share = max(1, len(cpus) // self.jobs)
+        start = (worker_id * share) % len(cpus)
+        mine = cpus[start:start + share]
+        return ",".join(str(cpu) for cpu in mine), len(mine)
+
+    def close_sessions(self):
+        """
+        Stop every container started by this run.
+        """
+        for session in self.sessions.values():
+            session.stop()
+        self.sessions = {}
+
+    def _load_splicer(self):
+        """
+        Attach a FunctionSplicer over the pinned checkout, seeded with the spans stored in function.db.
+        """
+        self.splicer = FunctionSplicer(f"./data/{self.OSS}", self.function_db.fetch_offsets())
+
+    def _store_offsets(self):
+        resolved = self.splicer.take_resolved()
+        if resolved:
+            self.function_db.insert_offsets(resolved)
+
+    def _write_patch(self, diff_path, edits):
+        """
+        Write the patch for {filepath: [(start, end, new)]} built from the cached original sources.
+        """
+        with open(diff_path, 'w', encoding='iso-8859-1', newline='') as f:
+            f.write(self.splicer.patch(edits))
+
+    def check_compilability(self, row, worker_id=0):
+        """
+        Build one function of the model in the worker's own container and classify the make log.
+
+        :param row: The function record as returned by FunctionDB.fetch_function_by_id.
+        :param worker_id: The worker slot; selects the container label.
+        :return: (status, compile_result) where status is one of
+                 "replace_failed", "no_log", "sanitizer", "make_nothing", "failed", "passed".
+        """
+        fid, function_index, filepath, token_number, old, new = row
+
+        span = self.splicer.locate(row)
+        if span is None:
+            return "replace_failed", None
+
+        docker_label = self._worker_label("linear", worker_id)
+        self._write_patch(f"/tmp/{docker_label}.diff", {filepath: [(span[0], span[1], new)]})
+
+        session = self._session(docker_label)
+        session.build(f"/tmp/{docker_label}.diff", f"/tmp/{docker_label}_make.log")
+
+        if not os.path.exists(f"/tmp/{docker_label}_make.log"):
+            return "no_log", None
+
+        f = open(f"/tmp/{docker_label}_make.log","r",encoding='iso-8859-1')
+        compile_result = f.read()
+        f.close()
+        status = self._classify_make_log(compile_result)
+        if status == "passed" and not session.reverted <= session.applied:
+            # the log also rebuilt the files of the previous patch, ask make about this one alone
+            relpath = filepath[len(f"./{self.OSS}/"):]
+            if relpath in session.make_nothing([relpath]):
+                status = "make_nothing"
+        return status, compile_result
+
+    def _worker_label(self, stage, worker_id):
+        """
+        Container label of a worker slot; the serial label is kept when jobs == 1.
+        """
+        return f"{stage}_{self.model}_{self.OSS}" if self.jobs == 1 else f"{stage}_{self.model}_{self.OSS}_{worker_id}"
+
+    def _classify_make_log(self, compile_result):
+        if "Sanitizer:" in compile_result:
+            return "sanitizer"
+        # excluding non-affect functions
+        elif (self.OSS=="php-src" and "libtool" not in compile_result) or (self.OSS=="sqlite" and "make: Nothing to be done for 'all'." in compile_result):
+            return "make_nothing"
+        elif (self.OSS=="php-src" and "Build complete." not in compile_result) or (self.OSS=="sqlite" and "error: " in compile_result):
+            return "failed"
+        else:
+            return "passed"
+
+    def make_batches(self, rows):
+        """
+        Group function records into batches of at most self.batch functions, never two
+        from the same file, so every function of a batch lives in its own translation unit.
+        Records keep their relative order inside and across batches.
+        """
+        open_batches = []
+        batches = []
+        for row in rows:
+            filepath = row[2]
+            for batch, files in open_batches:
+                if filepath not in files:
+                    break
+            else:
+                batch, files = [], set()
+                open_batches.append((batch, files))
+                batches.append(batch)
+            batch.append(row)
+            files.add(filepath)
+            if len(batch) == self.batch:
+                open_batches.remove((batch, files))
+        return batches
+
+    def screen_compilability(self, rows, worker_id=0):
+        """
+        Group testing over a batch of functions from distinct files.
+
+        The whole batch is built once. If it builds, every function passes (or is
+        "make nothing", decided by a make dry-run). If it does not, functions hit by an
+        error location in make.log are checked one at a time and the rest is bisected.
+        A function is only ever marked invalid by a one-function build, so the verdicts
+        match check_compilability exactly.
+
+        :return: {function_id: (status, compile_result)}
+        """
+        verdicts = {}
+        pending = []
+        for row in rows:
+            fid, function_index, filepath, token_number, old, new = row
+            if self.splicer.locate(row) is None:
+                verdicts[fid] = ("replace_failed", None)
+            # an unchanged file gives an empty diff, which `git apply` rejects
+            elif old == new:
+                verdicts[fid] = ("no_log", None)
+            else:
+                pending.append(row)
+        verdicts.update(self._bisect_compilability(pending, worker_id))
+        return verdicts
+
+    def _bisect_compilability(self, rows, worker_id):
+        if len(rows) == 0:
+            return {}
+        if len(rows) == 1:
+            return {rows[0][0]: self.check_compilability(rows[0], worker_id)}
+
+        edits = {}
+        spans = {}
+        for row in rows:
+            fid, function_index, filepath, token_number, old, new = row
+            start, end = self.splicer.locate(row)
+            edits[filepath] = [(start, end, new)]
+            first_line = line_of(self.splicer.line_starts(filepath), start)
+            spans[fid] = (filepath[len(f"./{self.OSS}/"):], first_line, first_line + new.count('\n'))
+
+        docker_label = self._worker_label("linear", worker_id)
+        self._write_patch(f"/tmp/{docker_label}.diff", edits)
+        session = self._session(docker_label)
+        session.build(f"/tmp/{docker_label}.diff", f"/tmp/{docker_label}_make.log")
+
+        compile_result = None
+        if os.path.exists(f"/tmp/{docker_label}_make.log"):
+            f = open(f"/tmp/{docker_label}_make.log","r",encoding='iso-8859-1')
+            compile_result = f.read()
+            f.close()
+            status = self._classify_make_log(compile_result)
+            if status == "make_nothing":
+                return {row[0]: ("make_nothing", compile_result) for row in rows}
+            if status == "passed":
+                quiet = session.make_nothing([relpath for relpath, first_line, last_line in spans.values()])
+                return {row[0]: ("make_nothing" if spans[row[0]][0] in quiet else "passed", compile_result) for row in rows}
+
+        # blame the functions whose spliced lines show up in compiler errors or sanitizer frames
+        suspects = []
+        if compile_result is not None:
+            locations = [(path, int(line)) for path, line in ERROR_LOCATION.findall(compile_result)]
+            for row in rows:
+                relpath, first_line, last_line = spans[row[0]]
+                if any(("/" + path).endswith("/" + relpath) and first_line <= line <= last_line for path, line in locations):
+                    suspects.append(row)
+
+        verdicts = {}
+        if suspects and len(suspects) < len(rows):
+            for row in suspects:
+                verdicts.update(self._bisect_compilability([row], worker_id))
+            verdicts.update(self._bisect_compilability([row for row in rows if row not in suspects], worker_id))
+        else:
+            half = len(rows) // 2
+            verdicts.update(self._bisect_compilability(rows[:half], worker_id))
+            verdicts.update(self._bisect_compilability(rows[half:], worker_id))
+        return verdicts
+
+    def record_compilability(self, function_id, status, compile_result, invalid_functions, make_nothing_functions):
+        """
+        Persist the verdict of check_compilability exactly as the serial loop always did.
+        Must be called in function-id order so the files match a serial run.
+        """
+        make_nothing_function_file = f"./data/{self.OSS}/{self.model}/make_nothing_functions"
 
-    def replace_function(self, file_path, old, new):
-        with open(file_path, 'r', encoding='iso-8859-1') as file:
-            file_contents = file.read()
-        updated_contents = file_contents.replace(old, new)
-        with open(file_path, 'w', encoding='iso-8859-1') as file:
-            file.write(updated_contents)
+        if status == "replace_failed":
+            print(f"replacing failed")
+            invalid_functions.append(function_id)
+            f = open(f"./data/{self.OSS}/{self.model}/invalid_functions", "w")
+            f.write(str(invalid_functions))
+            f.close()
+        elif status == "no_log":
+            print()
+            invalid_functions.append(function_id)
+            f = open(f"./data/{self.OSS}/{self.model}/invalid_functions", "w")
+            f.write(str(invalid_functions))
+            f.close()
+        elif status == "sanitizer":
+            print("Failed: Sanitizer Alert!")
+            invalid_functions.append(function_id)
+            if not os.path.exists(f"./data/{self.OSS}/{self.model}/fuzzresults"):
+                os.mkdir(f"./data/{self.OSS}/{self.model}/fuzzresults")
+                if not os.path.exists(f"./data/{self.OSS}/{self.model}/fuzzresults/compilefails"):
+                    os.mkdir(f"./data/{self.OSS}/{self.model}/fuzzresults/compilefails")
+            f = open(f"./data/{self.OSS}/{self.model}/fuzzresults/compilefails/{function_id}.log", 'w', encoding="iso-8859-1")
+            f.write(compile_result)
+            f.close()
+            f = open(f"./data/{self.OSS}/{self.model}/invalid_functions", "w")
+            f.write(str(invalid_functions))
+            f.close()
+        elif status == "make_nothing":
+            print("Excluded: make nothing")
+            make_nothing_functions.append(function_id)
+            f = open(make_nothing_function_file, "w")
+            f.write(str(make_nothing_functions))
+            f.close()
+        elif status == "failed":
+            if not os.path.exists(f"./data/{self.OSS}/{self.model}/linear_compile_fail_logs"):
+                os.mkdir(f"./data/{self.OSS}/{self.model}/linear_compile_fail_logs")
+            print("FAILED!")
+            invalid_functions.append(function_id)
+            f = open(f"./data/{self.OSS}/{self.model}/invalid_functions", "w")
+            f.write(str(invalid_functions))
+            f.close()
+            f = open(f"./data/{self.OSS}/{self.model}/linear_compile_fail_logs/{function_id}.log", 'w', encoding="iso-8859-1")
+            f.write(compile_result)
+            f.close()
+        else:
+            print("PASSED!")
 
     # this function evaluates the metric I - compilability
     def linear_execution(self):
 
         make_nothing_functions = []
-        make_nothing_function_file = f"./data/{self.OSS}/{self.model}/make_nothing_functions"
 
         if self.OSS=="php-src" and not os.path.exists(f"./data/php-src/php-src"):
             os.system("cd ./data/php-src/ && git clone https://github.com/php/php-src.git && cd php-src && git checkout 3786cff1f3f3d755f346ade78979976fee92bb48")
@@ -50,110 +315,64 @@ class OSSBench:
             f.close()
             self.valid_functions = list(set(self.valid_functions) - set(invalid_functions))
             start_index = invalid_functions[-1]
-        
-        for i in range(start_index, len(self.valid_functions)):
-            print(f" # check compilability of {i}/{len(self.valid_functions)} function", end=": ")
-            function_id = i+1
-            fid, function_index, filepath, token_number, old, new = self.function_db.fetch_function_by_id(function_id)
 
-            try:
-                self.replace_function(f"./data/{self.OSS}/{filepath}", old, new)
-            except:
-                invalid_functions.append(function_id)
-                f = open(f"./data/{self.OSS}/{self.model}/invalid_functions", "w")
-                f.write(str(invalid_functions))
-                f.close()
-                print(f"replacing failed")
-                continue
-            
-            os.system(f"cd ./data/{self.OSS}/{self.OSS} && git diff *.c > ./test.diff && git restore *.c")
-            f = open(f"./data/{self.OSS}/{self.OSS}/test.diff", 'r', encoding="iso-8859-1")
-            diff = f.read()
-            f.close()
+        # sqlite connections stay in this thread, workers only get the fetched rows
+        ids = range(start_index+1, len(self.valid_functions)+1)
+        found = self.function_db.fetch_many(ids)
+        rows = [found.get(i) for i in ids]
 
-            docker_label = f"linear_{self.model}_{self.OSS}"
+        # resolve every function span once, workers then splice from the cached sources
+        self._load_splicer()
+        for row in rows:
+            self.splicer.locate(row)
+        self._store_offsets()
 
-            try:
-                os.system(f"docker kill {docker_label} > /dev/null")
-            except:
-                pass
+        workers = queue.Queue()
+        for worker_id in range(self.jobs):
+            workers.put(worker_id)
 
+        def check(batch):
+            worker_id = workers.get()
             try:
-                os.system(f"docker rm {docker_label} > /dev/null")
-            except:
-                pass
-            
-            if os.path.exists(f"/tmp/{docker_label}_make.log"):
-                os.remove(f"/tmp/{docker_label}_make.log")
-
-            if self.OSS=="php-src":
-                os.system(f"docker run --name {docker_label} -dit 0599jiangyc/flowfusion4llm:latest bash > /dev/null")
-                os.system(f"docker cp ./data/php-src/php-src/test.diff {docker_label}:/home/phpfuzz/WorkSpace/flowfusion/php-src/ > /dev/null")
-                os.system(f"docker exec -it {docker_label} bash -c 'cd /home/phpfuzz/WorkSpace/flowfusion/php-src/ && git apply ./test.diff > /dev/null && timeout 600 make -j16 > ./make.log 2>&1'")
-                os.system(f"docker cp {docker_label}:/home/phpfuzz/WorkSpace/flowfusion/php-src/make.log /tmp/{docker_label}_make.log > /dev/null")
-            elif self.OSS=="sqlite":
-                os.system(f"docker run --name {docker_label} -dit 0599jiangyc/sqlite4llm:latest bash")
-                os.system(f"docker cp ./data/sqlite/sqlite/test.diff {docker_label}:/home/test/sqlite/")
-                os.system(f"docker exec -it {docker_label} bash -c 'su test -c \"cd /home/test/sqlite/ && git apply ./test.diff && cd build && timeout 600 make -j24 > ./make.log 2>&1\"'")
-                os.system(f"docker cp {docker_label}:/home/test/sqlite/build/make.log /tmp/{docker_label}_make.log")
-            else:
-                print("unsupported OSS. abort...")
-                exit()
-      
-            if not os.path.exists(f"/tmp/{docker_label}_make.log"):
-                invalid_functions.append(function_id)
-                f = open(f"./data/{self.OSS}/{self.model}/invalid_functions", "w")
-                f.write(str(invalid_functions))
-                f.close()
-                continue
-
-            f = open(f"/tmp/{docker_label}_make.log","r",encoding='iso-8859-1')
-            compile_result = f.read()
-            f.close()
-            if "Sanitizer:" in compile_result:
-                print("Failed: Sanitizer Alert!")
-                invalid_functions.append(function_id)
-                if not os.path.exists(f"./data/{self.OSS}/{self.model}/fuzzresults"):
-                    os.mkdir(f"./data/{self.OSS}/{self.model}/fuzzresults")
-                    if not os.path.exists(f"./data/{self.OSS}/{self.model}/fuzzresults/compilefails"):
-                        os.mkdir(f"./data/{self.OSS}/{self.model}/fuzzresults/compilefails")
-                f = open(f"./data/{self.OSS}/{self.model}/fuzzresults/compilefails/{function_id}.log", 'w', encoding="iso-8859-1")
-                f.write(compile_result)
-                f.close()
-                f = open(f"./data/{self.OSS}/{self.model}/invalid_functions", "w")
-                f.write(str(invalid_functions))
-                f.close()
-            # excluding non-affect functions
-            elif (self.OSS=="php-src" and "libtool" not in compile_result) or (self.OSS=="sqlite" and "make: Nothing to be done for 'all'." in compile_result):            
-                print("Excluded: make nothing")
-                make_nothing_functions.append(function_id)
-                f = open(make_nothing_function_file, "w")
-                f.write(str(make_nothing_functions))
-                f.close()
-            elif (self.OSS=="php-src" and "Build complete." not in compile_result) or (self.OSS=="sqlite" and "error: " in compile_result):
-                if not os.path.exists(f"./data/{self.OSS}/{self.model}/linear_compile_fail_logs"):
-                    os.mkdir(f"./data/{self.OSS}/{self.model}/linear_compile_fail_logs")
-                print("FAILED!")
-                invalid_functions.append(function_id)
-                f = open(f"./data/{self.OSS}/{self.model}/invalid_functions", "w")
-                f.write(str(invalid_functions))
-                f.close()
-                os.system(f"cp /tmp/{docker_label}_make.log ./data/{self.OSS}/{self.model}/linear_compile_fail_logs/{function_id}.log")
-            else:
-                print("PASSED!")
-                continue
-
-    def dataset_generation(self):
+                return self.screen_compilability(batch, worker_id)
+            finally:
+                workers.put(worker_id)
+
+        batches = [[row] for row in rows] if self.batch == 1 else self.make_batches(rows)
+
+        # verdicts are recorded in function-id order as soon as a contiguous prefix is known
+        verdicts = {}
+        next_row = 0
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for batch_verdicts in executor.map(check, batches):
+                verdicts.update(batch_verdicts)
+                while next_row < len(rows) and rows[next_row][0] in verdicts:
+                    i = start_index + next_row
+                    status, compile_result = verdicts.pop(rows[next_row][0])
+                    print(f" # check compilability of {i}/{len(self.valid_functions)} function", end=": ")
+                    self.record_compilability(i+1, status, compile_result, invalid_functions, make_nothing_functions)
+                    next_row += 1
+
+    def dataset_generation(self, test=False):
+        """
+        Build candidate patches until test_iteration_num of them compile, publishing each
+        accepted patch to dataset.db where start_test picks it up.
+
+        :param test: Pipeline mode: also run the test suite on the tree that accepted the
+                     patch, instead of leaving the build to start_test.
+        """
 
         one_percent = 73 if self.OSS=="sqlite" else 100
 
-        self.function_db = FunctionDB(f"./data/{self.OSS}/{self.model}/function.db")
+        # candidates draw each function many times over the shuffled ids, keep the records in memory
+        self.function_db = FunctionDB(f"./data/{self.OSS}/{self.model}/function.db", cache=True)
         import random
         random.seed(0)
         f = open(f"./data/{self.OSS}/{self.model}/invalid_functions", "r")
         invalid_functions = eval(f.read())
         f.close()
         self.valid_functions = list(set(self.valid_functions) - set(invalid_functions))
+        self.function_db.fetch_many(self.valid_functions)
 
         valid_function_len = len(self.valid_functions)
 
@@ -167,101 +386,173 @@ class OSSBench:
 
         self.dataset_db = DatasetDB(f"./data/{self.OSS}/{self.model}/dataset.db")
 
-        function_id_index = -1
-
-        current_iteration = 1
-
-        while function_id_index<1000000:
-            print(f"\n### generate dataset for {current_iteration}/1000 iteration ###")
-
-            function_patch_count = 0
-            
-            docker_label = f"datagen_{self.model}_{self.OSS}"
-            
-            patch_function_ids = []
-
-            while function_patch_count<one_percent:
-                function_id_index += 1
-                function_patch_count += 1
-                each_function_id = self.valid_functions[random_function_ids[function_id_index]]
-                function_id, function_index, filepath, token_number, old, new = self.function_db.fetch_function_by_id(each_function_id)
-                try:
-                    self.replace_function(f"./data/{self.OSS}/{filepath}", old, new)
-                except:
-                    print("MISSED")
-                    continue
-                patch_function_ids.append(function_id)
-            
-            os.system(f"cd ./data/{self.OSS}/{self.OSS} && git diff *.c > ./test.diff && git restore *.c")
-            f = open(f"./data/{self.OSS}/{self.OSS}/test.diff", 'r', encoding="iso-8859-1")
-            diff = f.read()
-            f.close()
-
-            # kill docker 
+        # resume after the last published patch
+        published, last_candidate = self.dataset_db.fetch_progress(self.model, one_percent)
+        if published >= self.test_iteration_num:
+            print("dataset already generated")
+            return
+        if published and last_candidate is None:
+            exit(f"./data/{self.OSS}/{self.model}/dataset.db has no candidate column to resume from, remove it to regenerate")
+        first_index = -1 if last_candidate is None else last_candidate
+        if published:
+            print(f"resuming after iteration {published}")
+
+        if test:
+            resultdb = TestResultDB(f"./data/{self.OSS}/{self.model}/test.db")
+            if not os.path.exists(f"./data/{self.OSS}/{self.model}/testlog"):
+                os.mkdir(f"./data/{self.OSS}/{self.model}/testlog")
+
+        self._load_splicer()
+        coverage_db = self._open_coverage() if test else None
+
+        def candidates():
+            """
+            Yield the candidate patches in the order a serial run tries them: consecutive
+            slices of one_percent shuffled ids, whether or not the previous one built.
+            """
+            function_id_index = first_index
+            while function_id_index<1000000:
+                function_patch_count = 0
+                patch_function_ids = []
+                edits = {} # filepath -> [(start, end, new)], spliced in one pass per file
+
+                while function_patch_count<one_percent:
+                    function_id_index += 1
+                    function_patch_count += 1
+                    each_function_id = self.valid_functions[random_function_ids[function_id_index]]
+                    row = self.function_db.fetch_function_by_id(each_function_id)
+                    function_id, function_index, filepath, token_number, old, new = row
+                    span = self.splicer.locate(row)
+                    if span is None:
+                        print("MISSED")
+                        continue
+                    # the shuffled ids may repeat a function across a reshuffle boundary
+                    if function_id not in patch_function_ids:
+                        edits.setdefault(filepath, []).append((span[0], span[1], new))
+                    patch_function_ids.append(function_id)
+
+                self._store_offsets()
+                yield function_id_index, function_id, patch_function_ids, self.splicer.patch(edits), self._selected_tests(coverage_db, patch_function_ids)
+
+        workers = queue.Queue()
+        for worker_id in range(self.jobs):
+            workers.put(worker_id)
+
+        def build(function_id_index, diff, tests):
+            """
+            Build one candidate patch in a free worker's container, and in pipeline mode
+            test the tree right away if it is accepted, before the container moves on.
+
+            :return: (make log or None if the patch did not apply,
+                      (test log path, make log path) kept for record_test_result, or (None, None))
+            """
+            worker_id = workers.get()
             try:
-                os.system(f"docker kill {docker_label} > /dev/null")
-            except:
-                pass
+                docker_label = self._worker_label("datagen", worker_id)
+                f = open(f"/tmp/{docker_label}.diff", 'w', encoding="iso-8859-1", newline='')
+                f.write(diff)
+                f.close()
 
-            try:
-                os.system(f"docker rm {docker_label} > /dev/null")
-            except:
-                pass
-            
-            if os.path.exists(f"/tmp/{docker_label}_make.log"):
-                os.remove(f"/tmp/{docker_label}_make.log")
-            
-            if self.OSS=="php-src":
-                os.system(f"docker run --name {docker_label} -dit 0599jiangyc/flowfusion4llm:latest bash")
-                os.system(f"docker cp ./data/php-src/php-src/test.diff {docker_label}:/home/phpfuzz/WorkSpace/flowfusion/php-src/ > /dev/null")
-                os.system(f"docker exec -it {docker_label} bash -c 'cd /home/phpfuzz/WorkSpace/flowfusion/php-src/ && git apply ./test.diff 2>&1 > /dev/null && timeout 600 make -j16 > ./make.log 2>&1'")
-                os.system(f"docker cp {docker_label}:/home/phpfuzz/WorkSpace/flowfusion/php-src/make.log /tmp/{docker_label}_make.log > /dev/null")
+                cpuset, cpus = self._worker_cpus(worker_id)
+                session = self._session(docker_label, cpuset=cpuset)
+                session.build(f"/tmp/{docker_label}.diff", f"/tmp/{docker_label}_make.log", jobs=cpus)
 
                 if not os.path.exists(f"/tmp/{docker_label}_make.log"):
-                    print("patch error.. sometimes it happens... fix me")
-                    continue
+                    return None, (None, None)
+                f = open(f"/tmp/{docker_label}_make.log","r",encoding='iso-8859-1')
+                compile_result = f.read()
+                f.close()
 
-            elif self.OSS=="sqlite":
-                os.system(f"docker run --name {docker_label} -dit 0599jiangyc/sqlite4llm:latest bash")
-                os.system(f"docker cp ./data/sqlite/sqlite/test.diff {docker_label}:/home/test/sqlite/")
-                os.system(f"docker exec -it {docker_label} bash -c 'su test -c \"cd /home/test/sqlite/ && git apply ./test.diff && cd build && timeout 600 make -j24 > ./make.log 2>&1\"'")
-                os.system(f"docker cp {docker_label}:/home/test/sqlite/build/make.log /tmp/{docker_label}_make.log")
+                logs = None, None
+                if test and self._dataset_verdict(compile_result) == "passed":
+                    if os.path.exists(f"/tmp/{docker_label}_test.log"):
+                        os.remove(f"/tmp/{docker_label}_test.log")
+                    session.test(f"/tmp/{docker_label}_test.log", jobs=2 * cpus if cpus else 32, tests=tests)
+                    logs = (self._keep_log(f"/tmp/{docker_label}_test.log", f"/tmp/{docker_label}_{function_id_index}_test.log"),
+                            self._keep_log(f"/tmp/{docker_label}_make.log", f"/tmp/{docker_label}_{function_id_index}_make.log"))
+                return compile_result, logs
+            finally:
+                workers.put(worker_id)
+
+        current_iteration = published + 1
+
+        # up to `jobs` candidates build at once, verdicts are consumed in candidate order
+        # so accepted patches get the iteration numbers of a serial run
+        pending = []
+        candidate_iter = candidates()
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while True:
+                for candidate in candidate_iter:
+                    pending.append((candidate, executor.submit(build, candidate[0], candidate[3], candidate[4])))
+                    if len(pending) >= self.jobs:
+                        break
+                if not pending:
+                    break
+                (function_id_index, function_id, patch_function_ids, diff, tests), future = pending.pop(0)
+                compile_result, logs = future.result()
+                print(f"\n### generate dataset for {current_iteration}/1000 iteration ###")
 
-                if not os.path.exists(f"/tmp/{docker_label}_make.log"):
+                if compile_result is None:
                     print("patch error.. sometimes it happens... fix me")
                     continue
-                
-            else:
-                print("error")
-                exit(0)
-
-            f = open(f"/tmp/{docker_label}_make.log","r",encoding='iso-8859-1')
-            compile_result = f.read()
-            f.close()
-            if "Sanitizer:" in compile_result:
-                invalid_functions.append(function_id)
-                if not os.path.exists(f"./data/{self.OSS}/{self.model}/fuzzresults"):
-                    os.mkdir(f"./data/{self.OSS}/{self.model}/fuzzresults")
-                    if not os.path.exists(f"./data/{self.OSS}/{self.model}/fuzzresults/compilefails"):
-                        os.mkdir(f"./data/{self.OSS}/{self.model}/fuzzresults/compilefails")
-                f = open(f"./data/{self.OSS}/{self.model}/fuzzresults/compilefails/datagen_{function_id_index}.log", 'w', encoding="iso-8859-1")
-                f.write(str(patch_function_ids)+"\n"+compile_result)
-                f.close()
-                print("## failed. need re-generation ##")
-            elif (self.OSS=="php-src" and "Build complete." not in compile_result) or (self.OSS=="sqlite" and "error: " in compile_result):
-                print("## failed. need re-generation ##")
-            else:
-                if not os.path.exists(f"./data/{self.OSS}/{self.model}/patches/"):
-                    os.mkdir(f"./data/{self.OSS}/{self.model}/patches/")
-                os.system(f"mv ./data/{self.OSS}/{self.OSS}/test.diff ./data/{self.OSS}/{self.model}/patches/{current_iteration}.diff")
-                self.dataset_db.insert_record(self.model, one_percent, f"{current_iteration},{str(patch_function_ids)}", f"./data/{self.OSS}/{self.model}/patches/{current_iteration}.diff")
-                current_iteration += 1
-                if current_iteration > self.test_iteration_num:
-                    break
 
+                verdict = self._dataset_verdict(compile_result)
+                if verdict == "sanitizer":
+                    invalid_functions.append(function_id)
+                    if not os.path.exists(f"./data/{self.OSS}/{self.model}/fuzzresults"):
+                        os.mkdir(f"./data/{self.OSS}/{self.model}/fuzzresults")
+                        if not os.path.exists(f"./data/{self.OSS}/{self.model}/fuzzresults/compilefails"):
+                            os.mkdir(f"./data/{self.OSS}/{self.model}/fuzzresults/compilefails")
+                    f = open(f"./data/{self.OSS}/{self.model}/fuzzresults/compilefails/datagen_{function_id_index}.log", 'w', encoding="iso-8859-1")
+                    f.write(str(patch_function_ids)+"\n"+compile_result)
+                    f.close()
+                    print("## failed. need re-generation ##")
+                elif verdict == "failed":
+                    print("## failed. need re-generation ##")
+                else:
+                    if not os.path.exists(f"./data/{self.OSS}/{self.model}/patches/"):
+                        os.mkdir(f"./data/{self.OSS}/{self.model}/patches/")
+                    f = open(f"./data/{self.OSS}/{self.model}/patches/{current_iteration}.diff", 'w', encoding="iso-8859-1", newline='')
+                    f.write(diff)
+                    f.close()
+                    record_id = self.dataset_db.insert_record(self.model, one_percent, f"{current_iteration},{str(patch_function_ids)}", f"./data/{self.OSS}/{self.model}/patches/{current_iteration}.diff", function_id_index, "claimed" if test else "ready",
+                                                              function_ids=patch_function_ids, patch=diff.encode("iso-8859-1") if self.store_patches else None)
+                    if test:
+                        self.record_test_result(resultdb, current_iteration, *logs)
+                        self.dataset_db.mark_tested(record_id)
+                    current_iteration += 1
+                    if current_iteration > self.test_iteration_num:
+                        # candidates past the last iteration are not needed
+                        for candidate, future in pending:
+                            if not future.cancel():
+                                for path in future.result()[1]:
+                                    if path is not None:
+                                        os.remove(path)
+                        break
+
+        if test:
+            self.build_test_blame()
+
+
+    def _dataset_verdict(self, compile_result):
+        """
+        Classify the make log of a whole candidate patch: "sanitizer", "failed" or "passed".
+        """
+        if "Sanitizer:" in compile_result:
+            return "sanitizer"
+        elif (self.OSS=="php-src" and "Build complete." not in compile_result) or (self.OSS=="sqlite" and "error: " in compile_result):
+            return "failed"
+        return "passed"
 
     # this function evaluates the metric II - Functional Test
-    def start_test(self, interval=100):
+    def start_test(self, interval=100, poll=10):
+        """
+        Test the published patches in iteration order, waiting for dataset_generation
+        to publish the ones it has not reached yet. Tested iterations are skipped, so an
+        interrupted run resumes where it stopped.
+
+        :param poll: Seconds between checks for a patch that is not published yet.
+        """
 
         one_percent = 73 if self.OSS=="sqlite" else 100
 
@@ -273,136 +564,400 @@ class OSSBench:
         if not os.path.exists(f"./data/{self.OSS}/{self.model}/testlog"):
             os.mkdir(f"./data/{self.OSS}/{self.model}/testlog")
 
+        # patches claimed by a run that was interrupted go back to the queue, and so do the
+        # patches marked tested whose result is not in this test.db
+        self.dataset_db.release_claims(iteration for iteration, total in resultdb.fetch_records())
+        coverage_db = self._open_coverage()
 
-        for i in tqdm(range(0,self.test_iteration_num)):
-            docker_label = f"test_{self.model}_{self.OSS}"
+        workers = queue.Queue()
+        for worker_id in range(self.jobs):
+            workers.put(worker_id)
 
-            try:
-                os.system(f"docker kill {docker_label}")
-            except:
-                pass
+        def run_test(iteration, diffpath, tests):
+            """
+            Build and test one patch in a free worker's container.
 
+            :return: (test log path or None, make log path or None), private to the iteration
+            """
+            worker_id = workers.get()
             try:
-                os.system(f"docker rm {docker_label}")
-            except:
-                pass
-            
-            if os.path.exists(f"/tmp/{docker_label}_test.log"):
-                os.remove(f"/tmp/{docker_label}_test.log")
-
-            if os.path.exists(f"/tmp/{docker_label}_make.log"):
-                os.remove(f"/tmp/{docker_label}_make.log")
-
-            iteration_total = 0
-            iteration_passed = 0
-            iteration_failed = 0
-            iteration_borked = 0
-            iteration_skiped = 0
-
-            if self.OSS=="php-src":
-
-                # for each iteration, we start a new docker 
-                os.system(f"docker run --name {docker_label} -dit 0599jiangyc/flowfusion4llm:latest bash")
-
-                record = self.dataset_db.fetch_record_by_model_interval_and_id(self.model, interval, i+1)
-                func_id, func_model, func_interval, func_label, diffpath = record[0], record[1], record[2], record[3], record[4]
-            
-                os.system(f"docker cp {diffpath} {docker_label}:/home/phpfuzz/WorkSpace/flowfusion/php-src/")
-                os.system(f"docker exec -it {docker_label} bash -c 'cd /home/phpfuzz/WorkSpace/flowfusion/php-src/ && git apply ./{i+1}.diff && timeout 600 make -j16 > ./make.log 2>&1 && git restore *.phpt && timeout 150 make test TEST_PHP_ARGS=\"-j32 --set-timeout 5\" > ./test.log 2>&1'")
-                os.system(f"docker cp {docker_label}:/home/phpfuzz/WorkSpace/flowfusion/php-src/make.log /tmp/{docker_label}_make.log")
-                os.system(f"docker cp {docker_label}:/home/phpfuzz/WorkSpace/flowfusion/php-src/test.log /tmp/{docker_label}_test.log")
+                docker_label = self._worker_label("test", worker_id)
+                cpuset, cpus = self._worker_cpus(worker_id)
 
                 if os.path.exists(f"/tmp/{docker_label}_test.log"):
-                    f = open(f"/tmp/{docker_label}_test.log", 'r' , encoding="iso-8859-1")
-                    test_results = f.read()
-                    f.close()
-                elif os.path.exists(f"/tmp/{docker_label}_make.log"):
-                    f = open(f"/tmp/{docker_label}_make.log", 'r' , encoding="iso-8859-1")
-                    test_results = f.read()
-                    f.close()
-                else:
-                    test_results = "patching error"
-
-                result_lines = test_results.splitlines()
-                for each in result_lines:
-                    each = str(each)
-                    if ".phpt]" in each:
-                        iteration_total += 1
-                        # add 'm' due to the color print
-                        if "mPASS" in each:
-                            iteration_passed += 1
-                        elif "mFAIL" in each:                            
-                            iteration_failed += 1
-                        elif "mSKIP" in each:
-                            iteration_skiped += 1
-                        else:
-                            iteration_borked += 1
-
-            elif self.OSS=="sqlite":
-                os.system(f"docker run --name {docker_label} -dit 0599jiangyc/sqlite4llm:latest bash")
+                    os.remove(f"/tmp/{docker_label}_test.log")
+
+                if os.path.exists(f"/tmp/{docker_label}_make.log"):
+                    os.remove(f"/tmp/{docker_label}_make.log")
+
+                # tests only run on a tree that built
+                session = self._session(docker_label, cpuset=cpuset)
+                if session.build(diffpath, f"/tmp/{docker_label}_make.log", jobs=cpus or 16) == 0:
+                    session.test(f"/tmp/{docker_label}_test.log", jobs=2 * cpus if cpus else 32, tests=tests)
+
+                return (self._keep_log(f"/tmp/{docker_label}_test.log", f"/tmp/{docker_label}_{iteration}_test.log"),
+                        self._keep_log(f"/tmp/{docker_label}_make.log", f"/tmp/{docker_label}_{iteration}_make.log"))
+            finally:
+                workers.put(worker_id)
+
+        def claimed():
+            """
+            Yield (iteration, record id, diff path, selected tests) of every untested patch in iteration order,
+            and None while waiting for one that is not generated yet.
+            """
+            for i in range(0,self.test_iteration_num):
                 record = self.dataset_db.fetch_record_by_model_interval_and_id(self.model, interval, i+1)
+                if record is None:
+                    print(f"waiting for iteration {i+1} to be generated...")
+                while record is None:
+                    # let the caller store finished iterations meanwhile
+                    yield None
+                    time.sleep(poll)
+                    record = self.dataset_db.fetch_record_by_model_interval_and_id(self.model, interval, i+1)
                 func_id, func_model, func_interval, func_label, diffpath = record[0], record[1], record[2], record[3], record[4]
-            
-                os.system(f"docker cp {diffpath} {docker_label}:/home/test/sqlite/")
-                os.system(f"docker exec -it {docker_label} bash -c 'su test -c \"cd /home/test/sqlite/ && git apply ./{i+1}.diff && cd build && timeout 600 make -j16 > ./make.log 2>&1 && timeout 150 ./testfixture ../test/testrunner.tcl --jobs 32\"'")
-                os.system(f"docker cp {docker_label}:/home/test/sqlite/build/make.log /tmp/{docker_label}_make.log")
-                
-                os.system(f'docker exec -it {docker_label} bash -c "su test -c \'cd /home/test/sqlite/build && cat ./testrunner.log | grep \\"### test/\\" > ./test.log\'"')
-
-                os.system(f"docker cp {docker_label}:/home/test/sqlite/build/testrunner.log /tmp/{docker_label}_test.log")
 
-                os.system(f"docker cp {docker_label}:/home/test/sqlite/build/test.log /tmp/{docker_label}_testcheck.log")
-
-                if os.path.exists(f"/tmp/{docker_label}_testcheck.log"):
-                    f = open(f"/tmp/{docker_label}_testcheck.log", 'r' , encoding="iso-8859-1")
-                    test_results = f.read()
-                    f.close()
-                elif os.path.exists(f"/tmp/{docker_label}_make.log"):
-                    f = open(f"/tmp/{docker_label}_make.log", 'r' , encoding="iso-8859-1")
-                    test_results = f.read()
-                    f.close()
-                else:
-                    test_results = "patching error"
-
-                result_lines = test_results.splitlines()
-                for each in result_lines:
-                    iteration_total += 1
-                    if "(done)" in each:
-                        iteration_passed += 1
-                    elif "(failed)" in each:
-                        iteration_failed += 1
-                    else:
+                if resultdb.fetch_record_by_iteration(i+1) is not None:
+                    self.dataset_db.mark_tested(func_id)
+                    continue
+                if self.dataset_db.claim_record(func_id):
+                    yield i+1, func_id, diffpath, self._selected_tests(coverage_db, self.dataset_db.fetch_function_ids(i+1))
+
+        # up to `jobs` iterations run at once, results are stored in iteration order
+        pending = []
+        tasks = claimed()
+        progress = tqdm(total=self.test_iteration_num)
+        progress.update(resultdb.count_records())
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while True:
+                for task in tasks:
+                    if task is None:
+                        if pending:
+                            break
                         continue
-            else:
-                print("error")
-                exit(0)
+                    iteration, func_id, diffpath, tests = task
+                    pending.append((iteration, func_id, executor.submit(run_test, iteration, diffpath, tests)))
+                    if len(pending) >= self.jobs:
+                        break
+                if not pending:
+                    break
+                iteration, func_id, future = pending.pop(0)
+                self.record_test_result(resultdb, iteration, *future.result())
+                self.dataset_db.mark_tested(func_id)
+                progress.update(1)
+        progress.close()
+
+        self.build_test_blame()
+
+    def build_test_blame(self):
+        """
+        Precompute which tests each function breaks: a test is blamed on a function when it
+        fails in every tested iteration whose patch contains the function and which ran the
+        test. Tests failing in every iteration that ran them are left out, they fail whatever
+        the patch. Iterations whose build failed (no test ran) are ignored.
+
+        Whether a test ran is read from the stored outcomes; an iteration recorded with
+        --failures-only (or before every outcome was stored) is assumed to have run every test.
+        """
+        one_percent = 73 if self.OSS=="sqlite" else 100
+        dataset_db = DatasetDB(f"./data/{self.OSS}/{self.model}/dataset.db")
+        resultdb = TestResultDB(f"./data/{self.OSS}/{self.model}/test.db")
 
-            print(iteration_failed, iteration_total)
+        tested = {iteration for iteration, total in resultdb.fetch_records() if total > 0}
+        failures = resultdb.fetch_failures(FAILED)
+        complete = resultdb.fetch_complete_iterations() & tested
+        # only the tests that ever failed can be blamed, so only their runs are loaded
+        runs = resultdb.fetch_runs(FAILED)
+
+        def ran(iteration, name):
+            return iteration not in complete or name in runs.get(iteration, ())
+
+        # test -> [iterations that ran it, iterations it failed in]
+        counts = {}
+        for iteration in tested:
+            for name in failures.get(iteration, ()):
+                counts.setdefault(name, [0, 0])[1] += 1
+        for name in counts:
+            counts[name][0] = len(tested - complete) + sum(1 for iteration in complete if name in runs.get(iteration, ()))
+        always = {name for name, (ran_count, fail_count) in counts.items() if ran_count == fail_count}
+
+        # function id -> tested iterations containing it
+        memberships = {}
+        for iteration, function_ids in dataset_db.fetch_memberships(self.model, one_percent).items():
+            if iteration not in tested:
+                continue
+            for function_id in function_ids:
+                memberships.setdefault(function_id, []).append(iteration)
+
+        # (function id, test, iterations containing the function that ran the test)
+        blame = []
+        for function_id, iterations in sorted(memberships.items()):
+            candidates = set().union(*(failures.get(iteration, set()) for iteration in iterations)) - always
+            for name in sorted(candidates):
+                ran_in = [iteration for iteration in iterations if ran(iteration, name)]
+                if all(name in failures.get(iteration, ()) for iteration in ran_in):
+                    blame.append((function_id, name, len(ran_in)))
+
+        resultdb.replace_blame(blame)
+        print(f"blamed {len(blame)} function/test pairs over {len(tested)} iterations")
+
+    def _open_coverage(self):
+        """
+        Open the coverage index when running in selective mode.
+        """
+        if not self.selective:
+            return None
+        if not os.path.exists(f"./data/{self.OSS}/coverage.db"):
+            exit(f"./data/{self.OSS}/coverage.db not found, build it first with --coverage-index")
+        return CoverageDB(f"./data/{self.OSS}/coverage.db")
+
+    def _selected_tests(self, coverage_db, function_ids):
+        """
+        The test units to run for a patch, None for the whole suite.
+        """
+        if coverage_db is None:
+            return None
+        return coverage_db.fetch_tests(set(function_ids))
+
+    def _keep_log(self, path, kept_path):
+        """
+        Move a log the next build of the worker would overwrite out of the way.
+
+        :return: kept_path, or None if there is no log.
+        """
+        if not os.path.exists(path):
+            return None
+        os.replace(path, kept_path)
+        return kept_path
+
+    def record_test_result(self, resultdb, iteration, test_log, make_log):
+        """
+        Count the test outcomes of one iteration in a single streaming pass, move its log
+        to testlog/ and store the counts and the per-test outcomes in test.db.
+
+        :param test_log: Path of the raw test log, None if the tests did not run.
+        :param make_log: Path of the make log of the iteration's build, None if the patch did not apply.
+        """
+        if resultdb.fetch_record_by_iteration(iteration) is not None:
+            for path in (test_log, make_log):
+                if path is not None:
+                    os.remove(path)
+            return
+
+        parser = TestLogParser(self.OSS)
+        outcomes = []
+        # a php-src build that failed is scanned like a test log, it simply counts nothing
+        source = test_log if test_log is not None or self.OSS != "php-src" else make_log
+        if source is not None:
+            with open(source, 'r', encoding="iso-8859-1") as f:
+                if self.failures_only:
+                    # passing tests are only counted, the rest is kept per test
+                    outcomes = [each for each in parser.parse(f) if each[1] not in PASSED]
+                else:
+                    outcomes = list(parser.parse(f))
+        iteration_total, iteration_passed, iteration_failed, iteration_skiped, iteration_borked = parser.counts()
+
+        print(iteration_failed, iteration_total)
+
+        kept = f"./data/{self.OSS}/{self.model}/testlog/{iteration}.log"
+        if test_log is not None:
+            shutil.move(test_log, kept)
+        elif make_log is not None:
+            shutil.move(make_log, kept)
+        else:
+            f = open(kept, "w", encoding="iso-8859-1")
+            f.write("patch error.. this should not happen..")
+            f.close()
+        if test_log is not None and make_log is not None:
+            os.remove(make_log)
+
+        resultdb.insert_record(
+            iteration = iteration,
+            total = iteration_total,
+            pass_count = iteration_passed,
+            fail_count = iteration_failed,
+            skip_count = iteration_skiped,
+            bork_count = iteration_borked,
+            testlog = kept,
+            outcomes = outcomes,
+            complete = not self.failures_only
+        )
+
+    def _fuzz_campaign(self, workers, iteration, diffpath, fuzzsize, timeout, archive):
+        """
+        Build one patch in a free worker's fuzzing container and fuzz it.
+
+        :param workers: Queue of free worker ids.
+        :param archive: Where the zipped bugs folder is kept.
+        :return: (archive or None if flowfusion produced none, seconds of the campaign, seconds
+                  of the build before it, exit code of flowfusion (see OSSBenchDocker.fuzz),
+                  CPUs of the worker)
+        """
+        worker_id = workers.get()
+        try:
+            docker_label = self._worker_label("fuzz", worker_id)
+            cpuset, cpus = self._worker_cpus(worker_id)
+            session = self._session(docker_label, image=FUZZ_IMAGE, cpuset=cpuset)
+            started = time.monotonic()
+            session.build(diffpath, f"/tmp/{docker_label}_make.log", jobs=cpus or 16)
+            build_seconds = time.monotonic() - started
+            produced, seconds, code = session.fuzz(iteration, f"/tmp/{docker_label}_bugs.zip", fuzzsize, timeout=timeout)
+            if produced:
+                shutil.move(f"/tmp/{docker_label}_bugs.zip", archive)
+            return archive if produced else None, seconds, build_seconds, code, cpus or len(os.sched_getaffinity(0))
+        finally:
+            workers.put(worker_id)
+
+    def _fuzz_targets(self, testdb, interval):
+        """
+        The iterations worth fuzzing: the ones whose tests ran.
+
+        :return: (dictionary {iteration: (diff path, pass rate)}, iterations not tested yet)
+        """
+        targets = {}
+        untested = 0
+        for i in range(0,1000):
+            test_record = testdb.fetch_record_by_iteration(i+1)
+            if test_record is None:
+                untested += 1
+                continue
+            testid, iteration, total, pass_count, fail_count, skip_count, bork_count, logpath = test_record
+            if total==0:
+                continue
+            record = self.dataset_db.fetch_record_by_model_interval_and_id(self.model, interval, i+1)
+            targets[i+1] = record[4], pass_count/(total-skip_count) if total>skip_count else 0
+        return targets, untested
+
+    def ingest_sanitizer_reports(self):
+        """
+        Store the sanitizer reports of every bugs.zip and log of the model in fuzz.db (only the
+        files not ingested yet), and print the distinct bugs.
+        """
+        resultdb = FuzzResultDB(f"./data/{self.OSS}/{self.model}/fuzz.db")
+        new_bugs = ingest_model(resultdb, f"./data/{self.OSS}/{self.model}", LAYOUT[self.OSS][1])
+        bugs = resultdb.fetch_bugs()
+        print(f"{new_bugs} new bugs, {len(bugs)} distinct bugs, {len(resultdb.fetch_summaries())} distinct sanitizer summaries in logs (scored), {len(resultdb.fetch_summaries(False))} with the fuzz archives")
+        for stack_hash, sanitizer, kind, crashsite, hits, iteration in bugs:
+            print(f"{stack_hash[:12]} {hits:6d} {sanitizer}: {crashsite}" + (f" (iteration {iteration})" if iteration else ""))
+
+    def adaptive_fuzzloop(self, budget, interval=100, fuzzsize=100000, timeout=1800, slice=300, patience=2, window=None):
+        """
+        Share a fixed CPU-hour budget between the iterations whose tests ran, fuzzing them
+        in slices of `slice` seconds (and the matching share of `fuzzsize` test cases):
+
+        * the next slice goes to the iteration with the highest
+          (1 + new crash sites of its last slice) / (1 + slices run) * (1 + pass rate) / 2:
+          iterations still finding new crash sites get most of the budget, untried ones
+          go before the ones whose last slice found nothing, and patches that broke most
+          of their tests rank lower, their crashes are mostly the breakage;
+        * an iteration is retired after `patience` slices in a row without a new crash site;
+        * the campaign stops when the budget is spent, every iteration is retired, or the
+          last `window` slices found no new crash site at all.
+
+        Crash sites are the distinct bugs (stack hashes) of the bugs.zip reports, see sanitizer.py.
+        Slices are recorded in fuzz.db's fuzz_slice table, so an interrupted campaign
+        resumes with the budget it has left.
+
+        :param budget: Total CPU hours, counting every CPU of a worker for the wall time of the
+                       slice and of the build before it.
+        :param slice: Seconds per slice.
+        :param patience: Slices without a new crash site before an iteration is retired.
+        :param window: Slices without any new crash site before the campaign stops, default 2 * jobs + 8.
+        """
+        if not os.path.exists(f"./data/{self.OSS}/{self.model}/fuzzresults/"):
+            os.mkdir(f"./data/{self.OSS}/{self.model}/fuzzresults/")
 
-            if os.path.exists(f"/tmp/{docker_label}_test.log"):
-                os.system(f"cp /tmp/{docker_label}_test.log ./data/{self.OSS}/{self.model}/testlog/{i+1}.log")
-            elif os.path.exists(f"/tmp/{docker_label}_make.log"):
-                os.system(f"cp /tmp/{docker_label}_make.log ./data/{self.OSS}/{self.model}/testlog/{i+1}.log")
-            else:
-                f = open(f"./data/{self.OSS}/{self.model}/testlog/{i+1}.log", "w", encoding="iso-8859-1")
-                f.write("patch error.. this should not happen..")
-                f.close()
+        self.dataset_db = DatasetDB(f"./data/{self.OSS}/{self.model}/dataset.db")
+        testdb = TestResultDB(f"./data/{self.OSS}/{self.model}/test.db")
+        resultdb = FuzzResultDB(f"./data/{self.OSS}/{self.model}/fuzz.db")
 
-            resultdb.insert_record(
-                iteration = i+1,
-                total = iteration_total,
-                pass_count = iteration_passed,
-                fail_count = iteration_failed,
-                skip_count = iteration_skiped,
-                bork_count = iteration_borked,
-                testlog = f"./data/{self.OSS}/{self.model}/testlog/{i+1}.log"
-            )
+        targets, untested = self._fuzz_targets(testdb, interval)
+        if untested:
+            print(f"{untested} iterations are not tested yet, they are left out of this campaign")
+        slices = resultdb.fetch_slices() # iteration -> new crash sites of each slice
+        budget_seconds = budget * 3600
+        spent = resultdb.fetch_cpu_seconds()
+        slice_size = max(1, fuzzsize * slice // timeout)
+        if window is None:
+            window = 2 * self.jobs + 8
+        recent = [] # new crash sites of the last slices, in completion order
+        build_seconds = 0 # wall time of the last build, reserved with every slice launched
+
+        def retired(iteration):
+            history = slices.get(iteration, [])
+            return len(history) >= patience and not any(history[-patience:])
+
+        def priority(iteration):
+            history = slices.get(iteration, [])
+            last = history[-1] if history else 0
+            return (1 + last) / (1 + len(history)) * (1 + targets[iteration][1]) / 2
+
+        workers = queue.Queue()
+        for worker_id in range(self.jobs):
+            workers.put(worker_id)
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            pending = {} # future -> iteration
+            cpus = self._worker_cpus(0)[1] or len(os.sched_getaffinity(0))
+            while True:
+                # slices in flight are charged at the current estimate until they end
+                reserved = len(pending) * (slice + build_seconds) * cpus
+                running = set(pending.values())
+                plateau = len(recent) >= window and not any(recent[-window:])
+                while len(pending) < self.jobs and not plateau:
+                    candidates = [i for i in targets if i not in running and not retired(i)]
+                    if not candidates or spent + reserved + (slice + build_seconds) * cpus > budget_seconds:
+                        break
+                    iteration = max(candidates, key=lambda i: (priority(i), -i))
+                    number = len(slices.get(iteration, [])) + 1
+                    archive = f"./data/{self.OSS}/{self.model}/fuzzresults/{iteration}_{number}.zip"
+                    future = executor.submit(self._fuzz_campaign, workers, iteration, targets[iteration][0], slice_size, slice, archive)
+                    pending[future] = iteration
+                    reserved += (slice + build_seconds) * cpus
+                    running.add(iteration)
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    iteration = pending.pop(future)
+                    archive, seconds, build_seconds, code, cpus = future.result()
+                    if code not in (0, 124):
+                        # the time is spent all the same, but a crashed flowfusion's archive is not trusted
+                        print(f"iteration {iteration}: flowfusion exited with {code}, slice failed")
+                        if archive is not None:
+                            os.remove(archive)
+                        archive = None
+                    new_sites = ingest(resultdb, archive, LAYOUT[self.OSS][1], iteration) if archive else 0
+                    slices.setdefault(iteration, []).append(new_sites)
+                    recent.append(new_sites)
+                    # the build before every slice runs on the same CPUs, it is part of the budget
+                    spent += (build_seconds + seconds) * cpus
+                    resultdb.record_slice(iteration, len(slices[iteration]), seconds, (build_seconds + seconds) * cpus, new_sites, archive)
+                    print(f"iteration {iteration}, slice {len(slices[iteration])}: {new_sites} new crash sites in {seconds:.0f}s, "
+                          f"{spent / 3600:.1f}/{budget} CPU hours spent")
+
+        elapsed = time.monotonic() - started
+        if len(recent) >= window and not any(recent[-window:]):
+            reason = f"no new crash site in the last {window} slices"
+        elif all(retired(i) for i in targets):
+            reason = "every iteration is retired"
+        else:
+            reason = "the budget is spent"
+        print(f"stopped after {elapsed:.0f}s: {reason}")
+        print(f"{sum(sum(each) for each in slices.values())} crash sites over {sum(len(each) for each in slices.values())} slices "
+              f"of {len(slices)}/{len(targets)} iterations, {spent / 3600:.1f} CPU hours")
 
     # this function is the extended evaluation for Metric III -- Memory Safety
-    def fuzzloop(self, interval=100):
+    def fuzzloop(self, interval=100, fuzzsize=100000, timeout=1800):
+        """
+        Fuzz every iteration whose tests ran with flowfusion, `jobs` campaigns at once, each
+        in its own FUZZ_IMAGE container pinned to its share of the CPU budget. Handled
+        iterations are recorded in fuzz.db's fuzz_progress, so an interrupted campaign
+        resumes where it stopped; iterations that produced no archive are retried.
 
-        # number of test cases to be executed for each iterations
-        fuzzsize = 100000
+        :param fuzzsize: Number of test cases flowfusion stops after.
+        :param timeout: Seconds before a campaign is killed.
+        """
 
         iterations = 1000
 
@@ -415,59 +970,78 @@ class OSSBench:
         testdb = TestResultDB(f"./data/{self.OSS}/{self.model}/test.db")
 
         resultdb = FuzzResultDB(f"./data/{self.OSS}/{self.model}/fuzz.db")
+        progress = resultdb.fetch_progress()
+
+        workers = queue.Queue()
+        for worker_id in range(self.jobs):
+            workers.put(worker_id)
+
+        def todo():
+            """
+            Yield (iteration, diff path) of every iteration left to fuzz.
+            """
+            untested = 0
+            for i in range(0,iterations):
+                if progress.get(i+1) in ("done", "skipped"):
+                    continue
+                if os.path.exists(f"./data/{self.OSS}/{self.model}/fuzzresults/{i+1}.zip"):
+                    # archive of a campaign run before fuzz_progress existed
+                    resultdb.record_progress(i+1, "done", archive=f"./data/{self.OSS}/{self.model}/fuzzresults/{i+1}.zip")
+                    continue
+                test_record = testdb.fetch_record_by_iteration(i+1)
+                if test_record is None:
+                    untested += 1
+                    continue
+                if test_record[2]==0:
+                    # we skip iterations if failed in tests
+                    resultdb.record_progress(i+1, "skipped")
+                    continue
+                record = self.dataset_db.fetch_record_by_model_interval_and_id(self.model, interval, i+1)
+                yield i+1, record[4]
+            if untested:
+                print(f"{untested} iterations are not tested yet, rerun --fuzz once they are")
+
+        # campaigns take minutes, record each one as soon as it ends whatever the order
+        started = time.monotonic()
+        executed = 0
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            pending = {}
+            tasks = todo()
+            while True:
+                for iteration, diffpath in tasks:
+                    archive = f"./data/{self.OSS}/{self.model}/fuzzresults/{iteration}.zip"
+                    pending[executor.submit(self._fuzz_campaign, workers, iteration, diffpath, fuzzsize, timeout, archive)] = iteration
+                    if len(pending) >= self.jobs:
+                        break
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    iteration = pending.pop(future)
+                    archive, seconds, build_seconds, code, cpus = future.result()
+                    if archive is None or code not in (0, 124):
+                        if archive is None:
+                            print(f"iteration {iteration}: flowfusion produced no bugs.zip, it will be retried on the next run")
+                        else:
+                            # a crash, a traceback or a failed build, not a finished campaign
+                            print(f"iteration {iteration}: flowfusion exited with {code}, it will be retried on the next run")
+                            os.remove(archive)
+                        resultdb.record_progress(iteration, "failed", fuzzsize, seconds, False)
+                        continue
+                    completed = code == 0
+                    resultdb.record_progress(iteration, "done", fuzzsize, seconds, completed, archive)
+                    print(f"iteration {iteration}: {ingest(resultdb, archive, LAYOUT[self.OSS][1], iteration)} new bugs")
+                    if completed:
+                        executed += fuzzsize
+                        print(f"iteration {iteration}: {fuzzsize} test cases in {seconds:.0f}s ({fuzzsize / max(seconds, 1):.1f} test cases/s)")
+                    else:
+                        print(f"iteration {iteration}: did not reach {fuzzsize} test cases within {timeout}s (< {fuzzsize / max(seconds, 1):.1f} test cases/s)")
 
-        # the test loop
-
-        for i in tqdm(range(0,iterations)):
-            
-            testid, iteration, total, pass_count, fail_count, skip_count, bork_count, logpath = testdb.fetch_record_by_id(i+1)
-            
-            if total==0:
-                # we skip iterations if failed in tests
-                continue
-
-            docker_label = f"fuzz_{self.model}_{self.OSS}"
-
-            try:
-                os.system(f"docker kill {docker_label}")
-            except:
-                pass
-
-            try:
-                os.system(f"docker rm {docker_label}")
-            except:
-                pass
-            
-            if os.path.exists(f"/tmp/{docker_label}_fuzz.log"):
-                os.remove(f"/tmp/{docker_label}_fuzz.log")
-
-            if os.path.exists(f"/tmp/{docker_label}_make.log"):
-                os.remove(f"/tmp/{docker_label}_make.log")
-
-            # for each iteration, we start a new docker 
-            os.system(f"docker run --name {docker_label} -dit 0599jiangyc/flowfusion4llm4fuzz:latest bash")
-
-            record = self.dataset_db.fetch_record_by_model_interval_and_id(self.model, interval, i+1)
-            func_id, func_model, func_interval, func_label, diffpath = record[0], record[1], record[2], record[3], record[4]
-        
-            os.system(f"docker cp {diffpath} {docker_label}:/home/phpfuzz/WorkSpace/flowfusion/php-src/")
-            
-            os.system(f"docker exec -it {docker_label} bash -c 'cd /home/phpfuzz/WorkSpace/flowfusion/php-src/ && git apply ./{i+1}.diff && timeout 600 make -j16 > ./make.log 2>&1'")
-            
-            os.system(f"docker exec -it {docker_label} bash -c 'cd /home/phpfuzz/WorkSpace/flowfusion/ && sed -i \"s/self\.stopping_test_num = -1/self.stopping_test_num = {fuzzsize}/g\" ./main.py'")
-            
-            os.system(f"docker exec -it {docker_label} bash -c 'cd /home/phpfuzz/WorkSpace/flowfusion/ && timeout 1800 python3 main.py'")
-            
-            os.system(f"docker exec -it {docker_label} bash -c 'cd /home/phpfuzz/WorkSpace/flowfusion/ && mv ./bugs ./{i+1}_bugs && zip -r bugs.zip ./{i+1}_bugs'")
-            
-            os.system(f"docker cp {docker_label}:/home/phpfuzz/WorkSpace/flowfusion/php-src/make.log /tmp/{docker_label}_make.log")
-            os.system(f"docker cp {docker_label}:/home/phpfuzz/WorkSpace/flowfusion/bugs.zip /tmp/{docker_label}_bugs.zip")
-
-            if not os.path.exists(f"/tmp/{docker_label}_bugs.zip"):
-                print("why?")
-                input()
-            else:
-                os.system(f"cp /tmp/{docker_label}_bugs.zip ./data/{self.OSS}/{self.model}/fuzzresults/{i+1}.zip")
+        elapsed = time.monotonic() - started
+        campaigns = resultdb.fetch_campaigns()
+        print(f"{len(campaigns)} iterations fuzzed, {sum(1 for each in campaigns if each[3])} reached fuzzsize")
+        if executed:
+            print(f"this run: at least {executed} test cases in {elapsed:.0f}s with {self.jobs} workers ({executed / elapsed:.1f} test cases/s)")
 
 def main():
     parser = argparse.ArgumentParser(description="Run OSSBench with various actions.")
@@ -488,25 +1062,75 @@ def main():
     parser.add_argument("--test",
                         action="store_true",
                         help="Call bench.start_test()")
+    parser.add_argument("--pipeline",
+                        action="store_true",
+                        help="Call bench.dataset_generation(test=True): test every accepted patch on the tree that built it")
+    parser.add_argument("--blame",
+                        action="store_true",
+                        help="Call bench.build_test_blame(): map functions to the tests they break")
+    parser.add_argument("--coverage-index",
+                        action="store_true",
+                        help="Call coverage_index.build_coverage_index(): map base functions to the tests executing them (one-time)")
+    parser.add_argument("--selective",
+                        action="store_true",
+                        help="With --test or --pipeline, run only the tests covering the patched functions")
+    parser.add_argument("--failures-only",
+                        action="store_true",
+                        help="With --test or --pipeline, store per-test outcomes only for the tests that did not pass, to keep test.db small")
     parser.add_argument("--fuzz",
                         action="store_true",
-                        help="Call bench.fuzzloop()")
+                        help="Call bench.fuzzloop(): fuzz every tested iteration, --jobs campaigns at once")
+    parser.add_argument("--ingest",
+                        action="store_true",
+                        help="Call bench.ingest_sanitizer_reports(): parse the sanitizer reports of the fuzz archives and logs into fuzz.db")
+    parser.add_argument("--fuzz-budget",
+                        type=float,
+                        default=None,
+                        help="With --fuzz, call bench.adaptive_fuzzloop(): share this many CPU hours between the iterations by crash-site discovery instead of 1800 s each")
+    parser.add_argument("--jobs",
+                        type=int,
+                        default=1,
+                        help="Number of parallel workers, each with its own container (pinned to an equal share of the CPUs for dataset generation and test)")
+    parser.add_argument("--batch",
+                        type=int,
+                        default=1,
+                        help="Check compilability of up to N functions (from distinct files) per build, bisecting failed builds")
+    parser.add_argument("--cpu-budget",
+                        type=int,
+                        default=None,
+                        help="Host CPUs the --jobs workers share (default: all); e.g. leave some to another stage running at the same time")
+    parser.add_argument("--store-patches",
+                        action="store_true",
+                        help="With --dataset-generation or --pipeline, also store each patch in dataset.db (the patches/ files are written either way)")
 
     args = parser.parse_args()
 
-    bench = OSSBench(model=args.model, OSS=args.OSS)
+    bench = OSSBench(model=args.model, OSS=args.OSS, jobs=args.jobs, batch=args.batch, selective=args.selective, store_patches=args.store_patches, cpu_budget=args.cpu_budget, failures_only=args.failures_only)
 
     # Decide which action to run based on the flags:
-    if args.linear_execution:
-        bench.linear_execution()
-    elif args.dataset_generation:
-        bench.dataset_generation()
-    elif args.test:
-        bench.start_test()
-    elif args.fuzz:
-        bench.fuzzloop()
-    else:
-        print("nothing to do")
+    try:
+        if args.linear_execution:
+            bench.linear_execution()
+        elif args.dataset_generation:
+            bench.dataset_generation()
+        elif args.pipeline:
+            bench.dataset_generation(test=True)
+        elif args.test:
+            bench.start_test()
+        elif args.coverage_index:
+            build_coverage_index(args.OSS)
+        elif args.blame:
+            bench.build_test_blame()
+        elif args.ingest:
+            bench.ingest_sanitizer_reports()
+        elif args.fuzz and args.fuzz_budget:
+            bench.adaptive_fuzzloop(args.fuzz_budget)
+        elif args.fuzz:
+            bench.fuzzloop()
+        else:
+            print("nothing to do")
+    finally:
+        bench.close_sessions()
         
 
 
@@ -0,0 +1,285 @@
+import os
+import bisect
+import difflib
+import threading
+
+# files are read as iso-8859-1 without newline translation, so string offsets are byte offsets
+
+
+def line_starts(text):
+    """
+    Return the offset of the first character of every line.
+    """
+    starts = [0]
+    index = text.find('\n')
+    while index != -1:
+        starts.append(index + 1)
+        index = text.find('\n', index + 1)
+    return starts
+
+
+def split_lines(text):
+    """
+    Split on '\n' only, keeping the line ends, as git does (str.splitlines also splits on \r, \f, ...).
+    """
+    lines = [each + '\n' for each in text.split('\n')]
+    lines[-1] = lines[-1][:-1]
+    if lines[-1] == "":
+        lines.pop()
+    return lines
+
+
+def line_of(starts, offset):
+    """
+    Return the 1-based line number containing `offset`.
+    """
+    return bisect.bisect_right(starts, offset)
+
+
+def resolve_offset(text, function_index, original_function, starts=None):
+    """
+    Resolve a libclang `path:line:col` function index to the span of its definition.
+
+    The index points at the function name, the stored text starts at the return type,
+    so the span is the occurrence of `original_function` that covers the name.
+
+    :return: (start, end) offsets, or None if the definition is not found.
+    """
+    try:
+        line, column = function_index.rsplit(':', 2)[1:]
+        line, column = int(line), int(column)
+    except ValueError:
+        return None
+    if starts is None:
+        starts = line_starts(text)
+    if line < 1 or line > len(starts):
+        return None
+    name_offset = starts[line - 1] + column - 1
+    start = text.rfind(original_function, 0, name_offset + len(original_function))
+    if start == -1 or start + len(original_function) <= name_offset:
+        return None
+    return start, start + len(original_function)
+
+
+class FunctionSplicer:
+    """
+    In-memory function replacement for one read-only source tree.
+
+    Original files are read once and cached, function spans are resolved once from
+    `function_index` and can be persisted in FunctionDB, and any number of
+    replacements is applied to a file in a single pass.
+    """
+
+    def __init__(self, root, offsets=None):
+        """
+        :param root: Directory the `filepath` column is relative to (e.g. ./data/php-src).
+        :param offsets: Previously stored {id: (start, end)}.
+        """
+        self.root = root
+        self.offsets = dict(offsets or {})
+        self.resolved = {} # spans found since the last take_resolved()
+        self.sources = {}
+        self.starts = {}
+        self.lock = threading.Lock()
+
+    def read(self, filepath):
+        """
+        Return the original contents of filepath, reading it at most once.
+        """
+        text = self.sources.get(filepath)
+        if text is None:
+            with open(os.path.join(self.root, filepath), 'r', encoding='iso-8859-1', newline='') as file:
+                text = file.read()
+            with self.lock:
+                self.sources[filepath] = text
+        return text
+
+    def line_starts(self, filepath):
+        """
+        Return the cached line_starts() of the original contents of filepath.
+        """
+        starts = self.starts.get(filepath)
+        if starts is None:
+            starts = line_starts(self.read(filepath))
+            with self.lock:
+                self.starts[filepath] = starts
+        return starts
+
+    def locate(self, row):
+        """
+        Return the (start, end) span of a function record, or None if it is not found.
+
+        :param row: The function record as returned by FunctionDB.fetch_function_by_id.
+        """
+        fid, function_index, filepath, token_number, old, new = row
+        try:
+            text = self.read(filepath)
+        except OSError:
+            return None
+        span = self.offsets.get(fid)
+        if span is not None and text[span[0]:span[1]] == old:
+            return span
+        span = resolve_offset(text, function_index, old)
+        if span is not None:
+            with self.lock:
+                self.offsets[fid] = span
+                self.resolved[fid] = span
+        return span
+
+    def take_resolved(self):
+        """
+        Return and forget the spans resolved since the last call, as rows for
+        FunctionDB.insert_offsets.
+        """
+        with self.lock:
+            resolved, self.resolved = self.resolved, {}
+        return [(fid, start, end) for fid, (start, end) in resolved.items()]
+
+    def splice(self, filepath, edits):
+        """
+        Apply many replacements to one file in a single pass, last offset first.
+
+        :param edits: List of (start, end, new_text) on the original contents.
+        :return: The patched contents.
+        """
+        text = self.read(filepath)
+        pieces = []
+        tail = len(text)
+        for start, end, new in sorted(edits, reverse=True):
+            if end > tail:
+                raise ValueError(f"overlapping replacements in {filepath}")
+            pieces.append(text[end:tail])
+            pieces.append(new)
+            tail = start
+        pieces.append(text[:tail])
+        return "".join(reversed(pieces))
+
+    def diff(self, filepath, edits, context=3):
+        """
+        Build the unified diff of one file straight from the cached original, the way
+        `git diff` would print it, without touching any checkout.
+
+        :param filepath: Path as stored in the `filepath` column (e.g. ./php-src/main/output.c).
+        :param edits: List of (start, end, new_text) on the original contents.
+        :param context: Lines of context around each change.
+        :return: The diff text, empty if the edits change nothing.
+        """
+        text = self.read(filepath)
+        starts = self.line_starts(filepath)
+        line_count = len(starts) - 1 if text.endswith('\n') or text == "" else len(starts)
+
+        def line(i):
+            return text[starts[i]:starts[i + 1]] if i + 1 < len(starts) else text[starts[i]:]
+
+        # widen every edit to whole lines and merge edits sharing a line into regions
+        regions = []
+        for start, end, new in sorted(edits):
+            first = line_of(starts, start) - 1
+            last = max(first + 1, line_of(starts, max(start, end - 1)))
+            if regions and first < regions[-1][1]:
+                regions[-1][1] = max(regions[-1][1], last)
+                regions[-1][2].append((start, end, new))
+            else:
+                regions.append([first, last, [(start, end, new)]])
+
+        # line opcodes over the whole file, diffing only inside the regions
+        opcodes = []
+
+        def add(tag, i1, i2, j1, j2):
+            # keep "equal" runs maximal, group_opcodes relies on it
+            if tag == "equal" and opcodes and opcodes[-1][0] == "equal":
+                opcodes[-1] = ("equal", opcodes[-1][1], i2, opcodes[-1][3], j2)
+            else:
+                opcodes.append((tag, i1, i2, j1, j2))
+
+        a_pos = b_pos = 0
+        b_lines = {}
+        for first, last, region_edits in regions:
+            if first > a_pos:
+                add("equal", a_pos, first, b_pos, b_pos + first - a_pos)
+                b_pos += first - a_pos
+            region_start = starts[first]
+            region_end = starts[last] if last < len(starts) else len(text)
+            pieces = []
+            tail = region_end
+            for start, end, new in sorted(region_edits, reverse=True):
+                pieces.append(text[end:tail])
+                pieces.append(new)
+                tail = start
+            pieces.append(text[region_start:tail])
+            a_seg = [line(i) for i in range(first, last)]
+            b_seg = split_lines("".join(reversed(pieces)))
+            for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a_seg, b_seg).get_opcodes():
+                add(tag, first + i1, first + i2, b_pos + j1, b_pos + j2)
+            for j, each in enumerate(b_seg):
+                b_lines[b_pos + j] = each
+            b_pos += len(b_seg)
+            a_pos = last
+        if a_pos < line_count:
+            add("equal", a_pos, line_count, b_pos, b_pos + line_count - a_pos)
+
+        if all(tag == "equal" for tag, i1, i2, j1, j2 in opcodes):
+            return ""
+
+        relpath = "/".join(os.path.normpath(filepath).split(os.sep)[1:])
+        out = [f"diff --git a/{relpath} b/{relpath}\n", f"--- a/{relpath}\n", f"+++ b/{relpath}\n"]
+        for group in group_opcodes(opcodes, context):
+            i1, i2, j1, j2 = group[0][1], group[-1][2], group[0][3], group[-1][4]
+            out.append(f"@@ -{format_range(i1, i2)} +{format_range(j1, j2)} @@\n")
+            for tag, i1, i2, j1, j2 in group:
+                if tag == "equal":
+                    out.extend(diff_line(" ", line(i)) for i in range(i1, i2))
+                    continue
+                out.extend(diff_line("-", line(i)) for i in range(i1, i2))
+                out.extend(diff_line("+", b_lines[j]) for j in range(j1, j2))
+        return "".join(out)
+
+    def patch(self, edits):
+        """
+        Build a multi-file patch in path order, as `git diff` lists it.
+
+        :param edits: A dictionary {filepath: [(start, end, new_text), ...]}.
+        """
+        return "".join(self.diff(filepath, edits[filepath]) for filepath in sorted(edits))
+
+
+def format_range(start, stop):
+    """
+    Hunk range in unified diff notation, as difflib and GNU diff print it.
+    """
+    length = stop - start
+    if length == 1:
+        return f"{start + 1}"
+    if length == 0:
+        return f"{start},0"
+    return f"{start + 1},{length}"
+
+
+def diff_line(tag, line):
+    if line.endswith('\n'):
+        return tag + line
+    return tag + line + "\n\\ No newline at end of file\n"
+
+
+def group_opcodes(opcodes, context):
+    """
+    Split file-wide opcodes into hunks with `context` lines around each change,
+    like difflib.SequenceMatcher.get_grouped_opcodes.
+    """
+    codes = list(opcodes)
+    if codes[0][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2
+    if codes[-1][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == "equal" and i2 - i1 > 2 * context:
+            group.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
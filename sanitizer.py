@@ -0,0 +1,227 @@
+import os
+import re
+import io
+import hashlib
+import zipfile
+
+# one-pass parser for the AddressSanitizer / LeakSanitizer / UndefinedBehaviorSanitizer reports
+# found in flowfusion's bugs.zip and in the make and test logs, and their ingestion into fuzz.db
+
+# "==1234==ERROR: AddressSanitizer: heap-use-after-free on address 0x..."
+ASAN_HEADER = re.compile(r"==\d+==(?:ERROR|WARNING): (\w+Sanitizer): (.*?)(?: on | at |$)")
+# "Zend/zend_hash.c:12:3: runtime error: signed integer overflow: ..."
+UBSAN_HEADER = re.compile(r"(\S+?):(\d+):(?:\d+:)? runtime error: (.*)")
+# "    #0 0x55d1c2 in zend_hash_find /path/Zend/zend_hash.c:12:3" or "#1 0x7f (/lib/libc.so.6+0x29d90)"
+FRAME = re.compile(r"^\s*#(\d+) 0x[0-9a-fA-F]+ (?:in (\S+)(?: (\S+))?|\((\S+)\))")
+SUMMARY = re.compile(r"SUMMARY: ([\w-]+): ([\w-]*)")
+
+# frames of the sanitizer runtime and the allocator say nothing about the bug
+RUNTIME_FRAMES = ("__asan", "__interceptor_", "__sanitizer", "__lsan", "__ubsan", "___interceptor_",
+                  "malloc", "calloc", "realloc", "free", "operator new", "operator delete")
+
+# fuzzresults/{iteration}.zip or fuzzresults/{iteration}_{slice}.zip
+ARCHIVE_NAME = re.compile(r"^(\d+)(?:_\d+)?\.zip$")
+
+# frames hashed into the stack key
+STACK_DEPTH = 3
+
+
+def normalize_summary(summary, srcdir):
+    """
+    The summary as marking_memsafe has always counted it: without the source dir prefix,
+    and with the varying part after a /dev/zero mapping cut off.
+
+    :return: The normalized "SUMMARY: ..." line, or None if it is not counted.
+    """
+    summary = summary.replace(srcdir + "/", "").strip(' ')
+    if "TEST" in summary:
+        return None
+    if "/dev/zero" in summary:
+        return summary.split('/dev/zero')[0] + '/dev/zero)'
+    return summary
+
+
+class SanitizerReport:
+    """
+    One sanitizer report: its kind, the frames of the first stack and the SUMMARY line.
+    """
+
+    def __init__(self, sanitizer, kind, location=None):
+        self.sanitizer = sanitizer
+        self.kind = kind
+        self.location = location # (function, file) of a UBSan report, used when it has no stack
+        self.frames = [] # (function, file) in stack order
+        self.stacks = 0
+        self.summary = None
+        self.lines = []
+
+    def project_frames(self, srcdir):
+        """
+        The frames in project code, sanitizer runtime and shared library frames left out,
+        with paths relative to srcdir and line numbers dropped.
+        """
+        frames = []
+        for function, path in self.frames or ([self.location] if self.location else []):
+            if function is None and self.frames:
+                # "(/lib/x86_64-linux-gnu/libc.so.6+0x29d90)", "(<unknown module>)"
+                continue
+            if function is not None and function.startswith(RUNTIME_FRAMES):
+                continue
+            path = path.split(':', 1)[0] if path else ""
+            if path.startswith(srcdir + "/"):
+                path = path[len(srcdir) + 1:]
+            elif path.startswith("/"):
+                continue
+            frames.append((function or "", path))
+        return frames
+
+    def stack_hash(self, srcdir):
+        """
+        Key of the bug: sanitizer, kind and the top project frames, so the same bug hit by
+        different test cases, patches or line offsets maps to one key.
+        """
+        key = "\n".join([self.sanitizer, self.kind] + [f"{function} {path}" for function, path in self.project_frames(srcdir)[:STACK_DEPTH]])
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def crashsite(self, srcdir):
+        """
+        Readable crash site, "<kind> in <function> <file>" of the top project frame.
+        """
+        frames = self.project_frames(srcdir)
+        if not frames:
+            return self.kind
+        return f"{self.kind} in " + " ".join(each for each in frames[0] if each)
+
+    def record(self, srcdir, poc=None, poc_env=None):
+        """
+        :return: (crashsite, details, poc, poc_env, stack_hash, sanitizer, kind, summary) for FuzzResultDB
+        """
+        summary = normalize_summary(self.summary, srcdir) if self.summary else None
+        return (self.crashsite(srcdir), "".join(self.lines), poc, poc_env,
+                self.stack_hash(srcdir), self.sanitizer, self.kind, summary)
+
+
+class SanitizerParser:
+    """
+    Stream a log or test output line by line and yield every sanitizer report in it.
+    A report ends at its SUMMARY line, at the next report or at the end of the input.
+    """
+
+    def parse(self, lines):
+        report = None
+        for line in lines:
+            header = ASAN_HEADER.search(line)
+            ubsan = None if header else UBSAN_HEADER.search(line)
+            if header or ubsan:
+                if report is not None:
+                    yield report
+                if header:
+                    # "attempting double-free", "detected memory leaks", "requested allocation size 0x... exceeds ..."
+                    kind = re.sub(r"0x[0-9a-fA-F]+|\d+", "N", header.group(2)).strip()
+                    report = SanitizerReport(header.group(1), kind)
+                else:
+                    path, message = ubsan.group(1), ubsan.group(3)
+                    # "signed integer overflow: 2147483647 + 1 ..." -> "signed integer overflow"
+                    kind = re.sub(r"0x[0-9a-fA-F]+|\d+", "N", message.split(':', 1)[0]).strip()
+                    report = SanitizerReport("UndefinedBehaviorSanitizer", kind, (None, path))
+            summary = SUMMARY.search(line)
+            if summary and report is None:
+                # the rest of the report did not make it into the log
+                report = SanitizerReport(summary.group(1), summary.group(2))
+            if report is None:
+                continue
+            report.lines.append(line)
+            frame = FRAME.match(line)
+            if frame:
+                if frame.group(1) == "0":
+                    report.stacks += 1
+                # the first stack is the faulting access, later ones are (de)allocation sites
+                if report.stacks == 1:
+                    report.frames.append((frame.group(2), frame.group(3) or frame.group(4)))
+                continue
+            if summary:
+                report.summary = line[summary.start():].rstrip('\n')
+                if report.location is not None:
+                    # UBSan names the function in the summary only: "... file.c:12:3 in func"
+                    function = report.summary.rsplit(" in ", 1)[1].strip() if " in " in report.summary else None
+                    report.location = (function, report.location[1])
+                yield report
+                report = None
+        if report is not None:
+            yield report
+
+
+def read_reports(path, srcdir):
+    """
+    Parse one plain log.
+
+    :return: List of FuzzResultDB records.
+    """
+    with open(path, 'r', encoding="iso-8859-1") as f:
+        return [report.record(srcdir) for report in SanitizerParser().parse(f)]
+
+
+def read_archive(path, srcdir):
+    """
+    Parse every test output of a flowfusion bugs.zip without extracting it. The .php test
+    and the .sh (environment and command line) run-tests.php leaves next to an output are
+    kept as the proof of concept.
+
+    :return: List of FuzzResultDB records.
+    """
+    records = []
+    with zipfile.ZipFile(path) as bugs:
+        names = set(bugs.namelist())
+        for member in sorted(names):
+            if not member.endswith((".out", ".log")):
+                continue
+            with bugs.open(member) as f:
+                reports = list(SanitizerParser().parse(io.TextIOWrapper(f, encoding="iso-8859-1")))
+            if not reports:
+                continue
+            stem = os.path.splitext(member)[0]
+            poc = bugs.read(stem + ".php").decode("iso-8859-1") if stem + ".php" in names else None
+            poc_env = bugs.read(stem + ".sh").decode("iso-8859-1") if stem + ".sh" in names else None
+            records.extend(report.record(srcdir, poc, poc_env) for report in reports)
+    return records
+
+
+def ingest(resultdb, path, srcdir, iteration=None):
+    """
+    Store the sanitizer reports of a bugs.zip or a log in fuzz.db, once per file.
+
+    :return: The number of bugs (stack hashes) not seen before, 0 if the file was already ingested.
+    """
+    if resultdb.is_ingested(path):
+        return 0
+    try:
+        records = read_archive(path, srcdir) if path.endswith(".zip") else read_reports(path, srcdir)
+    except (zipfile.BadZipFile, EOFError, OSError) as e:
+        # e.g. an archive still being copied or truncated by a killed campaign, retried next time
+        print(f"skipping {path}: {e}")
+        return 0
+    return resultdb.insert_reports(path, iteration, records)
+
+
+def ingest_model(resultdb, model_dir, srcdir):
+    """
+    Ingest every bugs.zip under fuzzresults/ and every log of a model directory (test logs,
+    compile failure logs, ...), skipping the files ingested before and the archives that
+    are not named after an iteration or cannot be read.
+
+    :return: The number of new bugs.
+    """
+    new_bugs = 0
+    for root, dirs, files in os.walk(model_dir):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if name.endswith(".log"):
+                new_bugs += ingest(resultdb, path, srcdir)
+            elif name.endswith(".zip") and os.path.basename(root) == "fuzzresults":
+                # {iteration}.zip, or {iteration}_{slice}.zip for adaptive campaigns
+                archive = ARCHIVE_NAME.match(name)
+                if archive is None:
+                    print(f"skipping {path}: not a campaign archive")
+                    continue
+                new_bugs += ingest(resultdb, path, srcdir, int(archive.group(1)))
+    return new_bugs
@@ -1,15 +1,22 @@
 #!/usr/bin/env python3
 
+import io
 import os
 import json
 import argparse
-import difflib
-from tqdm import tqdm
-from docker import OSSBenchDocker
-from sqlite3db import FunctionDB, DatasetDB, TestResultDB, FuzzResultDB
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from docker import LAYOUT
+from sanitizer import ingest_model
+from similarity import METRICS, self_test
+from sqlite3db import FunctionDB, TestResultDB, FuzzResultDB
 
 verbose = 0
 
+RESULTS_DIR = '/var/www/html/oss-bench'
+
+FUNCTION_COUNT = {"php-src": 10534, "sqlite": 7321}
+
 # note: now we score in pass@1
 # TODO: support pass@k
 
@@ -17,90 +24,44 @@ verbose = 0
 # make sure error less than 20
 # ad-hoc fixing prompt response errors, this will have trivial impact on results
 
-def calculating_error_count(model, oss):
-
-    print("\t0. error count: " + model)
-
-    if not os.path.exists(f"./data/{oss}/{model}/function.db"):
-        print("file does not exist")
-    db = FunctionDB(f"./data/{oss}/{model}/function.db")
-    total_number = 10534 if oss=="php-src" else 7321
-    error_count = 0 
-    for i in range(0, total_number):
-        i, idx, filepath, token_number, old, new = db.fetch_function_by_id(i+1)
-        # Count different lines between old and new
-        
-        if "Error:" in new:
-            error_count += 1
-    print("\t\terror count: ", error_count)
-    return error_count
-
-def calculating_similarity_score(model, oss):
-
-    print("\t0. calculating similarity score: " + model)
+def calculating_function_metrics(model, oss, metric="lines"):
+    """
+    Error count and similarity score in one pass over function.db.
 
-    filename = '/var/www/html/oss-bench/results.json'
+    :param metric: Line-diff metric of similarity.METRICS, all give the count of difflib.ndiff.
+    :return: (error count, average diff count per function)
+    """
 
-    # Open the file in read mode and load the JSON content into a dictionary
-    with open(filename, 'r') as json_file:
-        data = json.load(json_file)
+    print("\t0. error count and similarity score: " + model)
 
     if not os.path.exists(f"./data/{oss}/{model}/function.db"):
         print("file does not exist")
     db = FunctionDB(f"./data/{oss}/{model}/function.db")
-    total_number = 10534 if oss=="php-src" else 7321
+    total_number = FUNCTION_COUNT[oss]
+    error_count = 0
     total_diff_count = 0
-    for i in range(0, total_number):
-        i, idx, filepath, token_number, old, new = db.fetch_function_by_id(i+1)
+    count_changed_lines = METRICS[metric]
+    for i, idx, filepath, token_number, old, new in db.iter_functions():
+        if i > total_number:
+            break
+        if "Error:" in new:
+            error_count += 1
         # Count different lines between old and new
-        
-        # Split strings into lines for line-by-line comparison
-        old_lines = old.strip('\n').splitlines()
-        new_lines = new.strip('\n').splitlines()
-        
-        # Use difflib to get line differences
-        
-        diff = difflib.ndiff(old_lines, new_lines)
-
-        # Count lines that are different (start with '+ ', '- ')
-        diff_count = sum(1 for line in diff if line.startswith(('+ ', '- ')))
-        
-        total_diff_count += diff_count
-        
+        total_diff_count += count_changed_lines(old, new)
+    db.close()
+
     diff_score = round(total_diff_count/total_number, 2)
+    print("\t\terror count: ", error_count)
     print(f"\t\t{model} in {oss}: the average diff count per function is", diff_score)
-
-    mark = 0
-    oss_index = 0 if oss=="php-src" else 1
-
-    for x in data['benchmarks'][oss_index]["data"]:
-        if x["model_name"]==model.split('-seed')[0]:
-            x["dissimilarity"] = diff_score
-            mark = 1
-    
-    if mark==0:
-        data['benchmarks'][oss_index]["data"].append({
-            "model_name": model.split('-seed')[0],
-            "dissimilarity": diff_score,
-            "task1:compilation_score": 0,
-            "task2:test_score": 0,
-            "task3:sanitizer_score": 0,
-            "size": 30
-        })
-    
-    with open("/var/www/html/oss-bench/results.json", 'w') as json_file:
-        json.dump(data, json_file, indent=4)
+    return error_count, diff_score
 
 def marking_linear_compilation(model, oss):
+    """
+    :return: (compile.json entry of the model, compilation score)
+    """
 
     print("\t1. marking linear compilation: " + model)
 
-    filename = '/var/www/html/oss-bench/results.json'
-
-    # Open the file in read mode and load the JSON content into a dictionary
-    with open(filename, 'r') as json_file:
-        resultdata = json.load(json_file)    
-
     if not os.path.exists(f"./data/{oss}/{model}/function.db"):
         print("\t\t!!file does not exist")
     db = FunctionDB(f"./data/{oss}/{model}/function.db")
@@ -112,20 +73,17 @@ def marking_linear_compilation(model, oss):
     if not os.path.exists(f"./data/{oss}/{model}/fuzzresults/compilefails"):
         print("\t\t!!file does not exist")
 
-    filename = '/var/www/html/oss-bench/compile.json'
-
-    # Open the file in read mode and load the JSON content into a dictionary
-    with open(filename, 'r') as json_file:
-        data = json.load(json_file)
-
-    total_number = 10534 if oss=="php-src" else 7321
+    total_number = FUNCTION_COUNT[oss]
     fails = []
     sanitizer_alerts = []
     json_array = []
     faillogs = os.listdir(f"./data/{oss}/{model}/linear_compile_fail_logs")
+    fuzzlogs = os.listdir(f"./data/{oss}/{model}/fuzzresults/compilefails")
+    # one query for the records of every log below
+    functions = db.fetch_many(int(each.split('.')[0]) for each in faillogs + fuzzlogs if "datagen" not in each)
     for each in faillogs:
         fid = int(each.split('.')[0])
-        i, idx, filepath, token_number, old, new = db.fetch_function_by_id(fid)
+        i, idx, filepath, token_number, old, new = functions[fid]
         fails.append(fid)
         f = open(f"./data/{oss}/{model}/linear_compile_fail_logs/{each}","r",encoding="iso-8859-1")
         info = f.read()
@@ -141,12 +99,11 @@ def marking_linear_compilation(model, oss):
             "function_name": idx,
             "compile_alerts": "***compilation failed***\n<br>"+"\n<br>".join(infolines) if verbose==1 else "***compilation failed***"
         })
-    fuzzlogs = os.listdir(f"./data/{oss}/{model}/fuzzresults/compilefails")
     for each in fuzzlogs:
         if "datagen" in each:
             continue
         fid = int(each.split('.')[0])
-        i, idx, filepath, token_number, old, new = db.fetch_function_by_id(fid)
+        i, idx, filepath, token_number, old, new = functions[fid]
         sanitizer_alerts.append(int(each.split('.')[0]))
         f = open(f"./data/{oss}/{model}/fuzzresults/compilefails/{each}","r",encoding="iso-8859-1")
         info = f.read()
@@ -166,60 +123,33 @@ def marking_linear_compilation(model, oss):
     passnum = total_number - len(fails) - len(sanitizer_alerts)
     compilation_score = round((passnum/total_number)*100, 2)
     print(f"\t\tthe compilation score is {compilation_score}")
-
-    oss_string = 'php' if oss=="php-src" else 'sqlite'
-
-    data[oss_string][model.split('-seed')[0]] = json_array
-    
-    with open("/var/www/html/oss-bench/compile.json", 'w') as json_file:
-        json.dump(data, json_file, indent=4)
-
-    oss_index = 0 if oss=="php-src" else 1
-
-    for x in resultdata['benchmarks'][oss_index]["data"]:
-        if x["model_name"]==model.split('-seed')[0]:
-            x["task1:compilation_score"] = compilation_score
-
-    with open("/var/www/html/oss-bench/results.json", 'w') as json_file:
-        json.dump(resultdata, json_file, indent=4)
+    db.close()
+    return json_array, compilation_score
 
 def marking_tests(model, oss):
+    """
+    :return: (test.json entry of the model, test score), or None if no test passed
+    """
 
     print("\t2. marking tests: " + model)
 
     if not os.path.exists(f"./data/{oss}/{model}/function.db"):
         print("\t\tfunction.db does not exist")
-        exit()
+        return None
     
     if not os.path.exists(f"./data/{oss}/{model}/test.db"):
         print("\t\ttest.db does not exist")
-        exit()
+        return None
 
     testdb = TestResultDB(f"./data/{oss}/{model}/test.db")
 
-    filename = '/var/www/html/oss-bench/results.json'
-
-    # Open the file in read mode and load the JSON content into a dictionary
-    with open(filename, 'r') as json_file:
-        resultdata = json.load(json_file)
-
-    filename = '/var/www/html/oss-bench/test.json'
-    # Open the file in read mode and load the JSON content into a dictionary
-    with open(filename, 'r') as json_file:
-        data = json.load(json_file)
-
     valid_count = 0
     total_pass_count = 0
     total_total = 0
 
     testjsondata = []
 
-    for i in range(0,1000):
-        testid = i+1
-        try:
-            testid, iteration, total, pass_count, fail_count, skip_count, bork_count, logpath = testdb.fetch_record_by_id(i+1)
-        except:
-            break
+    for testid, iteration, total, pass_count, fail_count, skip_count, bork_count, logpath in testdb.fetch_records_by_id(1000):
         if total-skip_count==0:
             passrate = -1
         else:
@@ -233,18 +163,9 @@ def marking_tests(model, oss):
             'passrate': passrate
         })
 
-        # data['php'][model.split('-seed')[0]][i] = {
-        #     'testid': testid,
-        #     'passrate': passrate
-        # }
-
     if total_total==0:
         print("0 lah")
-        return
-
-    oss_string = 'php' if oss=="php-src" else 'sqlite'
-
-    data[oss_string][model.split('-seed')[0]] = testjsondata
+        return None
 
     average_score = total_pass_count/total_total*100
 
@@ -253,92 +174,125 @@ def marking_tests(model, oss):
     print(f"\t\tthe average score is {average_score}")
     print(f"\t\tthe test score is {final_score}")
 
-    with open("/var/www/html/oss-bench/test.json", 'w') as json_file:
-        json.dump(data, json_file, indent=4)
-
-    oss_index = 0 if oss=="php-src" else 1
-
-    for x in resultdata['benchmarks'][oss_index]["data"]:
-        if x["model_name"]==model.split('-seed')[0]:
-            x["task2:test_score"] = final_score
-
-    with open("/var/www/html/oss-bench/results.json", 'w') as json_file:
-        json.dump(resultdata, json_file, indent=4)
+    return testjsondata, final_score
 
 def marking_memsafe(model, oss):
+    """
+    :return: (fuzz.json entry of the model, sanitizer score)
+    """
 
     print("\t3. marking memsafe: " + model)
 
-    filename = '/var/www/html/oss-bench/results.json'
-
-    # Open the file in read mode and load the JSON content into a dictionary
-    with open(filename, 'r') as json_file:
-        resultdata = json.load(json_file)
+    # distinct sanitizer summaries of every log and fuzz archive, new files are ingested first
+    resultdb = FuzzResultDB(f"./data/{oss}/{model}/fuzz.db")
+    ingest_model(resultdb, f"./data/{oss}/{model}", LAYOUT[oss][1])
+    sanitizer_alerts = list(resultdb.fetch_summaries())
 
-    filename = '/var/www/html/oss-bench/fuzz.json'
-    # Open the file in read mode and load the JSON content into a dictionary
-    with open(filename, 'r') as json_file:
-        data = json.load(json_file)
+    final_score = round(100 - len(sanitizer_alerts)*0.88, 2)
+    if final_score< 0:
+        final_score = 0.01
 
-    sanitizer_alerts = set()
-    os.system(f"cd ./data/{oss}/{model}/ && find ./ -name '*.log' -type f | xargs egrep -a 'SUMMARY:' | cut -d: -f2- | sort -u > ./summary.txt")        
-    
-    f = open(f"./data/{oss}/{model}/summary.txt","r")
-    info = f.read()
-    f.close()
-    
-    infolines = info.splitlines()
-    for eachinfo in infolines:
-        eachinfo = eachinfo.replace('/home/phpfuzz/WorkSpace/flowfusion/php-src/', '')
-        eachinfo = eachinfo.strip(' ')
-        if "TEST" in eachinfo:
-            continue
-        if "/dev/zero" in eachinfo:
-            sanitizer_alerts.add(eachinfo.split('/dev/zero')[0]+'/dev/zero)')
-        else:
-            sanitizer_alerts.add(eachinfo)
-    
-    oss_string = 'php' if oss=="php-src" else 'sqlite'
+    return sanitizer_alerts, final_score
 
-    data[oss_string][model.split('-seed')[0]] = list(sanitizer_alerts)
+def score_model(model, oss, metric="lines"):
+    """
+    Compute every metric of one model, in a worker process. Nothing is written here, the
+    caller merges the scores of all models into the JSON files once.
 
-    with open("/var/www/html/oss-bench/fuzz.json", 'w') as json_file:
-        json.dump(data, json_file, indent=4)
-    
-    final_score = round(100 - len(list(sanitizer_alerts))*0.88, 2)
-    if final_score< 0:
-        final_score = 0.01
+    :return: (scores, printed output); scores only has the metrics computed before an error,
+             as the steps used to stop at the first failing one.
+    """
+    scores = {}
+    output = io.StringIO()
+    with redirect_stdout(output):
+        print(f"======scoring {model}======")
+        try:
+            scores["error_count"], scores["dissimilarity"] = calculating_function_metrics(model, oss, metric)
+            scores["compile"] = marking_linear_compilation(model, oss)
+            scores["test"] = marking_tests(model, oss)
+            scores["fuzz"] = marking_memsafe(model, oss)
+        except Exception as e:
+            print(str(e))
+            print(model)
+    return scores, output.getvalue()
 
-    oss_index = 0 if oss=="php-src" else 1
+def write_scores(oss, scores):
+    """
+    Merge the scores of every model into results.json, compile.json, test.json and fuzz.json,
+    reading and writing each file once.
 
-    for x in resultdata['benchmarks'][oss_index]["data"]:
-        if x["model_name"]==model.split('-seed')[0]:
-            x["task3:sanitizer_score"] = final_score
+    :param scores: List of (model, scores of score_model), later seeds of a model overwrite earlier ones.
+    """
+    data = {}
+    for name in ("results", "compile", "test", "fuzz"):
+        with open(f"{RESULTS_DIR}/{name}.json", 'r') as json_file:
+            data[name] = json.load(json_file)
 
-    with open("/var/www/html/oss-bench/results.json", 'w') as json_file:
-        json.dump(resultdata, json_file, indent=4)
-    
+    oss_index = 0 if oss=="php-src" else 1
+    oss_string = 'php' if oss=="php-src" else 'sqlite'
+    benchmarks = data["results"]['benchmarks'][oss_index]["data"]
+
+    for model, score in scores:
+        model_name = model.split('-seed')[0]
+        entries = [x for x in benchmarks if x["model_name"]==model_name]
+        if "dissimilarity" in score and not entries:
+            entries = [{
+                "model_name": model_name,
+                "dissimilarity": 0,
+                "task1:compilation_score": 0,
+                "task2:test_score": 0,
+                "task3:sanitizer_score": 0,
+                "size": 30
+            }]
+            benchmarks.append(entries[0])
+        for metric, column, name in (("compile", "task1:compilation_score", "compile"),
+                                     ("test", "task2:test_score", "test"),
+                                     ("fuzz", "task3:sanitizer_score", "fuzz")):
+            if score.get(metric) is None:
+                continue
+            detail, value = score[metric]
+            data[name][oss_string][model_name] = detail
+            for x in entries:
+                x[column] = value
+        for x in entries:
+            if "dissimilarity" in score:
+                x["dissimilarity"] = score["dissimilarity"]
+
+    for name in ("results", "compile", "test", "fuzz"):
+        with open(f"{RESULTS_DIR}/{name}.json", 'w') as json_file:
+            json.dump(data[name], json_file, indent=4)
 
 def main():
 
-    oss = "php-src"
-    oss = "sqlite"
-
-    models = os.listdir(f"./data/{oss}/")
-    for each in models:
+    parser = argparse.ArgumentParser(description="Score every model of an OSS into the leaderboard JSON files")
+    parser.add_argument("--oss", default="sqlite", choices=sorted(FUNCTION_COUNT), help="php-src or sqlite")
+    parser.add_argument("--model", help="Only score this model (e.g. gpt-o1-seed0)")
+    parser.add_argument("--metric", default="lines", choices=sorted(METRICS), help="Line-diff metric of the similarity score")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Models scored in parallel")
+    args = parser.parse_args()
+    oss = args.oss
+    if args.metric != "ndiff":
+        # the fast metric relies on difflib internals, make sure it still matches ndiff
+        self_test()
+
+    models = []
+    for each in os.listdir(f"./data/{oss}/"):
         if ".db" in each or each==oss:
             continue
-        # if each!="qwen3-30b-a3b-fp16-seed0":
-        #     continue
-        print(f"======scoring {each}======")
-        try:
-            calculating_error_count(each, oss)
-            calculating_similarity_score(each, oss)
-            marking_linear_compilation(each, oss)
-            marking_tests(each, oss)
-            marking_memsafe(each, oss)
-        except Exception as e:
-            print(str(e))
-            print(each)
+        if args.model and each!=args.model:
+            continue
+        models.append(each)
+
+    # one process per model, function.db scans and log parsing are CPU bound
+    with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(models) or 1))) as executor:
+        futures = [executor.submit(score_model, each, oss, args.metric) for each in models]
+        scores = []
+        for each, future in zip(models, futures):
+            score, output = future.result()
+            print(output, end="")
+            scores.append((each, score))
+
+    write_scores(oss, scores)
 
-main()
+if __name__ == "__main__":
+    main()
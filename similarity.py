@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+import time
+import random
+import difflib
+import argparse
+from sqlite3db import FunctionDB
+
+# line-diff metrics for the similarity score: the number of lines removed or added between
+# the original and the optimized version of a function
+#
+# line_diff_count reuses CPython's difflib internals: the SequenceMatcher matching Differ.compare
+# does and the private Differ._fancy_replace. Neither is guaranteed to stay the same across
+# CPython versions, so self_test() checks the two metrics agree on fixed inputs; the CLI and
+# score.py run it before using the "lines" metric.
+
+# as difflib.ndiff builds it
+DIFFER = difflib.Differ(None, difflib.IS_CHARACTER_JUNK)
+
+def split_lines(text):
+    return text.strip('\n').splitlines()
+
+def ndiff_count(old, new):
+    """
+    Reference metric: lines ndiff marks with '+ ' or '- '.
+    """
+    diff = difflib.ndiff(split_lines(old), split_lines(new))
+    return sum(1 for line in diff if line.startswith(('+ ', '- ')))
+
+def line_diff_count(old, new):
+    """
+    Same count as ndiff_count without ndiff's intraline work.
+
+    ndiff (Differ.compare) matches the lines with a SequenceMatcher and, for every replace
+    block, looks for similar line pairs to mark characters of. A similar pair is still one
+    '- ' and one '+ ' line, so only identical lines lower the count: the equal blocks, and
+    an identical pair _fancy_replace syncs on inside a replace block. The latter needs a
+    line present on both sides of a replace block, which SequenceMatcher only leaves when
+    autojunk drops popular lines (functions of 200+ lines); only those blocks get ndiff's
+    similar-pair search.
+
+    :return: The number of lines only in old plus the number of lines only in new.
+    """
+    old_lines, new_lines = split_lines(old), split_lines(new)
+    # hashed line ids, so the matcher compares ints instead of strings
+    ids = {}
+    a = [ids.setdefault(line, len(ids)) for line in old_lines]
+    b = [ids.setdefault(line, len(ids)) for line in new_lines]
+
+    changed = 0
+    i = j = 0
+    # the blocks between two matches are the delete/insert/replace opcodes Differ.compare walks
+    for block in difflib.SequenceMatcher(None, a, b).get_matching_blocks():
+        if block.a > i and block.b > j and not set(a[i:block.a]).isdisjoint(b[j:block.b]):
+            delta = DIFFER._fancy_replace(old_lines, i, block.a, new_lines, j, block.b)
+            changed += sum(1 for line in delta if line.startswith(('+ ', '- ')))
+        else:
+            changed += (block.a - i) + (block.b - j)
+        i, j = block.a + block.size, block.b + block.size
+    return changed
+
+# name -> metric(old, new), selected with `score.py --metric`
+METRICS = {
+    "ndiff": ndiff_count,
+    "lines": line_diff_count,
+}
+
+class CountingDiffer(difflib.Differ):
+    """
+    Differ counting the replace blocks line_diff_count hands to it, see self_test.
+    """
+    calls = 0
+
+    def _fancy_replace(self, a, alo, ahi, b, blo, bhi):
+        self.calls += 1
+        return super()._fancy_replace(a, alo, ahi, b, blo, bhi)
+
+def self_test_cases():
+    """
+    Fixed (old, new) pairs: small edits, similar and identical lines in replace blocks, and
+    functions of 200+ lines whose popular lines ("}", blank lines, ...) SequenceMatcher's
+    autojunk drops, which is what sends replace blocks through Differ._fancy_replace.
+    """
+    cases = [
+        ("", ""),
+        ("int a;", ""),
+        ("", "int a;"),
+        ("int a;\nint b;\nreturn a;", "int a;\nint b;\nreturn a;"),
+        ("int a = 1;\nint b = 2;\nreturn a + b;", "int a = 1;\nlong b = 2;\nreturn a + b;"),
+        ("if (x) {\n\treturn 1;\n}\nreturn 0;", "if (!x) {\n    return 0;\n}\nreturn 1;"),
+        ("a\nb\nc\nd", "d\nc\nb\na"),
+    ]
+    # a rewritten region where only the popular "}" lines are left in common: a replace block
+    # that _fancy_replace syncs on the identical "}" pairs, ndiff counts them as unchanged
+    body = [f"    ctx->field{k} = value{k};" for k in range(200)]
+    cases.append(("\n".join(body[:100] + [f"foo_{k}(ctx);\n}}" for k in range(6)] + body[100:]),
+                  "\n".join(body[:100] + [f"Q{k};\n}}" for k in range(6)] + body[100:])))
+    cases.append(("\n".join(body[:50] + [f"if (v{k}) goto fail;\n\n}}" for k in range(5)] + body[50:]),
+                  "\n".join(body[:50] + [f"R;\n\n}}" for k in range(5)] + body[50:])))
+    # a fixed seed, so the inputs are the same on every run and Python version
+    generator = random.Random(2024)
+    vocabulary = ["", "}", "{", "    }", "   }", "\treturn 0;", "\treturn 1;", "    break;", "  break;"] + \
+                 [f"    x{k} = y{k} + {k};" for k in range(60)]
+    for size in (30, 150, 220, 260, 400, 400):
+        for edits in range(4):
+            old = [generator.choice(vocabulary) for _ in range(size)]
+            new = []
+            for line in old:
+                roll = generator.random()
+                if roll < 0.08:
+                    continue
+                if roll < 0.16:
+                    new.append(line.replace("x", "z") + " ")
+                    continue
+                if roll < 0.22:
+                    new.append(generator.choice(vocabulary))
+                new.append(line)
+            cases.append(("\n".join(old), "\n".join(new) if edits else "\n".join(old)))
+    return cases
+
+def self_test():
+    """
+    Check that line_diff_count still gives ndiff_count's count on the fixed inputs, including
+    the replace blocks it hands to Differ._fancy_replace.
+
+    :return: The number of cases checked.
+    """
+    global DIFFER
+    assert hasattr(difflib.Differ, "_fancy_replace"), "difflib.Differ._fancy_replace is gone, use --metric ndiff"
+    cases = self_test_cases()
+    previous, DIFFER = DIFFER, CountingDiffer(None, difflib.IS_CHARACTER_JUNK)
+    try:
+        for old, new in cases:
+            expected, got = ndiff_count(old, new), line_diff_count(old, new)
+            assert expected == got, f"line_diff_count gives {got} where ndiff counts {expected}, use --metric ndiff"
+        assert DIFFER.calls > 0, "no self-test case reached Differ._fancy_replace"
+    finally:
+        DIFFER = previous
+    return len(cases)
+
+def benchmark(db_path, metrics=("ndiff", "lines"), limit=None):
+    """
+    Time every metric over the function pairs of a function.db and check they agree.
+
+    :param limit: Only use the first `limit` functions.
+    :return: {metric: (seconds, total count)}
+    """
+    db = FunctionDB(db_path)
+    pairs = []
+    for i, idx, filepath, token_number, old, new in db.iter_functions():
+        if limit is not None and i > limit:
+            break
+        pairs.append((old, new))
+    db.close()
+
+    counts = {}
+    results = {}
+    for name in metrics:
+        metric = METRICS[name]
+        started = time.perf_counter()
+        counts[name] = [metric(old, new) for old, new in pairs]
+        results[name] = (time.perf_counter() - started, sum(counts[name]))
+        print(f"{name}: {results[name][0]:.2f}s over {len(pairs)} functions, {results[name][1]} changed lines")
+
+    reference = counts[metrics[0]]
+    for name in metrics[1:]:
+        mismatches = sum(1 for x, y in zip(reference, counts[name]) if x != y)
+        speedup = results[metrics[0]][0] / max(results[name][0], 1e-9)
+        print(f"{name}: {speedup:.1f}x faster than {metrics[0]}, {mismatches} functions with a different count")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the line-diff metrics agree, and benchmark them over a function.db")
+    parser.add_argument("db", nargs="?", help="e.g. ./data/php-src/gpt-o1-seed0/function.db, only the self-test runs without it")
+    parser.add_argument("--metrics", nargs="+", default=["ndiff", "lines"], choices=sorted(METRICS), help="The first one is the reference")
+    parser.add_argument("--limit", type=int, help="Only the first N functions")
+    args = parser.parse_args()
+    print(f"self-test: line_diff_count agrees with ndiff_count on {self_test()} cases")
+    if args.db:
+        benchmark(args.db, args.metrics, args.limit)
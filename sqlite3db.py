@@ -1,18 +1,102 @@
+import json
 import sqlite3
+import time
+import threading
+from contextlib import contextmanager
+
+def connect(db_name, timeout=60):
+    """
+    Open a connection the way every database of a run is opened: WAL, so readers never
+    block the writer, and a busy timeout, so writers from other threads or processes
+    wait for the lock instead of failing with "database is locked".
+
+    :param timeout: Seconds to wait for another writer.
+    """
+    connection = sqlite3.connect(db_name, timeout=timeout, check_same_thread=False)
+    # a commit no longer waits for an fsync of the database file, only the WAL is
+    # synced at checkpoints; a crash still leaves a consistent database
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute(f"PRAGMA busy_timeout={int(timeout * 1000)}")
+    return connection
+
+
+class SQLiteStore:
+    """
+    Shared storage of the result databases (dataset.db, test.db, fuzz.db, coverage.db).
+
+    One connection per object, usable from several threads: statements run under a
+    lock and every write is a `BEGIN IMMEDIATE` transaction, so writers of the same
+    process go one at a time and writers of other processes queue on the busy timeout
+    instead of failing when a read transaction is upgraded.
+    """
+
+    def __init__(self, db_name, timeout=60):
+        """
+        :param db_name: The SQLite database file.
+        :param timeout: Seconds a writer waits for another process' transaction.
+        """
+        self.connection = connect(db_name, timeout)
+        self.lock = threading.RLock()
+        self.create_table()
+
+    def create_table(self):
+        pass
+
+    def fetchone(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchone()
+
+    def fetchall(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    @contextmanager
+    def write(self):
+        """
+        One write transaction, committed on exit and rolled back on an exception.
+
+            with self.write() as cursor:
+                cursor.execute(...)
+        """
+        with self.lock:
+            cursor = self.connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except BaseException:
+                self.connection.rollback()
+                raise
+            self.connection.commit()
+
+    def __del__(self):
+        """
+        Ensures the database connection is closed when the object is deleted.
+        """
+        if hasattr(self, 'connection') and self.connection:
+            self.connection.close()
+
 
 class FunctionDB:
     """
     A class to manage a SQLite database that stores function information.
     """
 
-    def __init__(self, db_file):
+    def __init__(self, db_file, cache=False):
         """
         Initialize the FunctionDB instance.
 
         :param db_file: The SQLite database file.
+        :param cache: Keep every fetched record in memory and answer repeated fetches from it.
         """
         self.db_file = db_file
         self.conn = None
+        # id -> record, read-through; kept in sync by the update methods of this instance
+        self.cache = {} if cache else None
+        # function_index -> id of the cached records, so an update touches only its record
+        self.cached_ids = {}
+        # open write batch, see batch()
+        self.pending = None
         self._create_connection()
         self._create_table()
 
@@ -21,7 +105,7 @@ class FunctionDB:
         Create a database connection to the SQLite database.
         """
         try:
-            self.conn = sqlite3.connect(self.db_file)
+            self.conn = connect(self.db_file)
             print(f"\t > Connected to database: {self.db_file}")
         except sqlite3.Error as e:
             exit(f"\t > Error connecting to database: {e}")
@@ -40,9 +124,27 @@ class FunctionDB:
             optimized_function TEXT
         );
         """
+        # byte span of each definition in its source file, resolved once from function_index
+        create_offset_table_sql = """
+        CREATE TABLE IF NOT EXISTS function_offset (
+            id INTEGER PRIMARY KEY,
+            start_offset INT NOT NULL,
+            end_offset INT NOT NULL
+        );
+        """
+        # old -> new function_index of the last incremental re-extraction (None: function removed)
+        create_map_table_sql = """
+        CREATE TABLE IF NOT EXISTS function_index_map (
+            old_function_index TEXT PRIMARY KEY,
+            new_function_index TEXT,
+            id INTEGER
+        );
+        """
         try:
             cursor = self.conn.cursor()
             cursor.execute(create_table_sql)
+            cursor.execute(create_offset_table_sql)
+            cursor.execute(create_map_table_sql)
             print("\t > Table 'function' created or already exists.")
         except sqlite3.Error as e:
             exit(f"\t > Error creating table: {e}")
@@ -65,13 +167,32 @@ class FunctionDB:
         try:
             cursor = self.conn.cursor()
             cursor.execute(sql, (function_index, filepath, token_number, original_function, optimized_function))
-            self.conn.commit()
             inserted_id = cursor.lastrowid
-            print(f"\t > Inserted function record with id {inserted_id}")
+            if self._written():
+                print(f"\t > Inserted function record with id {inserted_id}")
             return inserted_id
         except sqlite3.Error as e:
             exit(f"\t > Error inserting record: {e}")
 
+    def insert_functions(self, records):
+        """
+        Insert many function records in one transaction.
+
+        :param records: Iterable of (function_index, filepath, token_number, original_function, optimized_function).
+        :return: The number of inserted rows.
+        """
+        sql = '''
+        INSERT INTO function(function_index, filepath, token_number, original_function, optimized_function)
+        VALUES(?, ?, ?, ?, ?)
+        '''
+        try:
+            with self.conn:
+                cursor = self.conn.executemany(sql, records)
+            print(f"\t > Inserted {cursor.rowcount} function records")
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            exit(f"\t > Error inserting records: {e}")
+
     def update_optimized_function(self, function_index, new_optimized_function):
         """
         Update the optimized_function column for the specified function record.
@@ -88,16 +209,101 @@ class FunctionDB:
         try:
             cursor = self.conn.cursor()
             cursor.execute(sql, (new_optimized_function, function_index))
-            self.conn.commit()
+            self._update_cached({function_index: new_optimized_function})
+            committed = self._written()
             if cursor.rowcount == 0:
                 print(f"\t > No record found with function index: {function_index}")
                 return False
-            print(f"\t > Updated optimized function for '{function_index}'.")
+            if committed:
+                print(f"\t > Updated optimized function for '{function_index}'.")
             return True
         except sqlite3.Error as e:
             exit(f"\t > Error updating record: {e}")
             return False
 
+    @contextmanager
+    def batch(self, rows=500, seconds=5):
+        """
+        Group the writes of insert_function and update_optimized_function into transactions
+        committed every `rows` writes or `seconds` seconds, whichever comes first, and once
+        more on exit. A crash loses at most the writes of the open transaction.
+
+            with db.batch():
+                for ...:
+                    db.update_optimized_function(idx, new)
+
+        :param rows: Writes per transaction.
+        :param seconds: Longest time a write stays uncommitted, checked on the next write.
+        """
+        self.pending = {"rows": rows, "seconds": seconds, "count": 0, "total": 0, "since": time.monotonic()}
+        try:
+            yield self
+        finally:
+            total = self.pending["total"]
+            self.pending = None
+            self.conn.commit()
+            print(f"\t > Committed {total} batched writes")
+
+    def _written(self):
+        """
+        Account for one write: commit it right away outside batch(), or when the open batch is full.
+
+        :return: True outside batch(), so callers only report single writes.
+        """
+        if self.pending is None:
+            self.conn.commit()
+            return True
+        self.pending["count"] += 1
+        self.pending["total"] += 1
+        if self.pending["count"] >= self.pending["rows"] or time.monotonic() - self.pending["since"] >= self.pending["seconds"]:
+            self.conn.commit()
+            self.pending["count"] = 0
+            self.pending["since"] = time.monotonic()
+        return False
+
+    def update_many(self, updates):
+        """
+        Update optimized_function of many records in one transaction.
+
+        :param updates: Iterable of (function_index, optimized_function).
+        :return: The number of updated rows.
+        """
+        updates = list(updates)
+        sql = '''
+        UPDATE function
+        SET optimized_function = ?
+        WHERE function_index = ?
+        '''
+        try:
+            with self.conn:
+                cursor = self.conn.executemany(sql, [(new, function_index) for function_index, new in updates])
+            self._update_cached(dict(updates))
+            print(f"\t > Updated {cursor.rowcount} optimized functions")
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            exit(f"\t > Error updating records: {e}")
+
+    def _update_cached(self, updates):
+        """
+        Apply {function_index: optimized_function} to the cached records.
+        """
+        if not self.cache:
+            return
+        for function_index, optimized_function in updates.items():
+            id = self.cached_ids.get(function_index)
+            if id is not None:
+                self.cache[id] = self.cache[id][:5] + (optimized_function,)
+
+    def _cache_rows(self, rows):
+        """
+        Keep fetched records in the cache, if enabled.
+        """
+        if self.cache is None:
+            return
+        for row in rows:
+            self.cache[row[0]] = row
+            self.cached_ids[row[1]] = row[0]
+
     def fetch_function_by_id(self, id):
         """
         Fetch a function record from the database by its id.
@@ -107,6 +313,8 @@ class FunctionDB:
                  (id, function_index, filepath, token_number, original_function, optimized_function) 
                  or None if not found.
         """
+        if self.cache is not None and id in self.cache:
+            return self.cache[id]
         sql = "SELECT * FROM function WHERE id = ?"
         try:
             cursor = self.conn.cursor()
@@ -114,11 +322,181 @@ class FunctionDB:
             row = cursor.fetchone()
             if row is None:
                 print(f"\t > No function found with id: {id}")
+            else:
+                self._cache_rows((row,))
             return row
         except sqlite3.Error as e:
             input(f"\t > Error fetching record: {e}")
             return None
 
+    def iter_functions(self, batch_size=1000):
+        """
+        Walk the whole table in id order, `batch_size` records per query.
+
+        :return: Generator of (id, function_index, filepath, token_number, original_function, optimized_function).
+        """
+        sql = "SELECT * FROM function WHERE id > ? ORDER BY id LIMIT ?"
+        last_id = 0
+        while True:
+            try:
+                rows = self.conn.execute(sql, (last_id, batch_size)).fetchall()
+            except sqlite3.Error as e:
+                input(f"\t > Error fetching records: {e}")
+                return
+            self._cache_rows(rows)
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    def fetch_many(self, ids):
+        """
+        Fetch many function records with a few `IN` queries.
+
+        :param ids: Iterable of function ids.
+        :return: A dictionary {id: record} of the ids that exist.
+        """
+        found = {}
+        missing = []
+        for id in ids:
+            if self.cache is not None and id in self.cache:
+                found[id] = self.cache[id]
+            else:
+                missing.append(id)
+        # stay below SQLite's bound parameter limit
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            sql = f"SELECT * FROM function WHERE id IN ({','.join('?' * len(chunk))})"
+            try:
+                rows = self.conn.execute(sql, chunk).fetchall()
+            except sqlite3.Error as e:
+                input(f"\t > Error fetching records: {e}")
+                return found
+            found.update((row[0], row) for row in rows)
+            self._cache_rows(rows)
+        return found
+
+    def fetch_function_indexes(self):
+        """
+        Fetch the function_index of every function.
+
+        :return: List of (id, function_index).
+        """
+        sql = "SELECT id, function_index FROM function ORDER BY id"
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(sql)
+            return cursor.fetchall()
+        except sqlite3.Error as e:
+            input(f"\t > Error fetching records: {e}")
+            return []
+
+    def fetch_offsets(self):
+        """
+        Fetch all resolved function spans.
+
+        :return: A dictionary {id: (start_offset, end_offset)}.
+        """
+        sql = "SELECT id, start_offset, end_offset FROM function_offset"
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(sql)
+            return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+        except sqlite3.Error as e:
+            input(f"\t > Error fetching offsets: {e}")
+            return {}
+
+    def insert_offsets(self, offsets):
+        """
+        Store resolved function spans, replacing stale ones.
+
+        :param offsets: Iterable of (id, start_offset, end_offset).
+        """
+        sql = '''
+        INSERT OR REPLACE INTO function_offset(id, start_offset, end_offset)
+        VALUES(?, ?, ?)
+        '''
+        try:
+            cursor = self.conn.cursor()
+            cursor.executemany(sql, offsets)
+            self.conn.commit()
+        except sqlite3.Error as e:
+            exit(f"\t > Error inserting offsets: {e}")
+
+    def fetch_functions_by_filepath(self, filepath):
+        """
+        Fetch the function records of one source file in id order.
+
+        :param filepath: The filepath column value (e.g. ./php-src/main/output.c).
+        :return: List of (id, function_index, filepath, token_number, original_function, optimized_function).
+        """
+        sql = "SELECT * FROM function WHERE filepath = ? ORDER BY id"
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(sql, (filepath,))
+            return cursor.fetchall()
+        except sqlite3.Error as e:
+            input(f"\t > Error fetching records: {e}")
+            return []
+
+    def replace_functions(self, filepaths, records, mapping):
+        """
+        Replace the functions of changed files in one transaction.
+
+        Every function of `filepaths` is dropped along with its stored offset, then `records`
+        are inserted: the ones carrying an id keep it, the others (id None) get fresh ids.
+        The function_index_map table is rewritten: identity for untouched files, `mapping`
+        for the functions of `filepaths`.
+
+        :param filepaths: Old filepath values of changed, renamed or deleted files.
+        :param records: List of (id, function_index, filepath, token_number, original_function, optimized_function).
+        :param mapping: List of (old_function_index, new_function_index, id).
+        """
+        try:
+            with self.conn:
+                # functions of untouched files keep their index
+                self.conn.execute("DELETE FROM function_index_map")
+                self.conn.execute("INSERT INTO function_index_map SELECT function_index, function_index, id FROM function")
+                for filepath in filepaths:
+                    self.conn.execute("DELETE FROM function_offset WHERE id IN (SELECT id FROM function WHERE filepath = ?)", (filepath,))
+                    self.conn.execute("DELETE FROM function WHERE filepath = ?", (filepath,))
+                self.conn.executemany('''
+                INSERT INTO function(id, function_index, filepath, token_number, original_function, optimized_function)
+                VALUES(?, ?, ?, ?, ?, ?)
+                ''', records)
+                self.conn.executemany("INSERT OR REPLACE INTO function_index_map VALUES(?, ?, ?)", mapping)
+            print(f"\t > Replaced the functions of {len(filepaths)} files with {len(records)} records")
+        except sqlite3.Error as e:
+            exit(f"\t > Error replacing records: {e}")
+
+    def carry_forward(self, old_db_file):
+        """
+        Copy optimized_function from another function.db for every function whose id and
+        original text are unchanged, so its LLM output does not have to be collected again.
+
+        :param old_db_file: A model's function.db built on the previous baseline.
+        :return: The number of functions carried forward.
+        """
+        sql = '''
+        UPDATE function SET optimized_function = (
+            SELECT o.optimized_function FROM old.function AS o
+            WHERE o.id = main.function.id AND o.original_function = main.function.original_function
+        )
+        WHERE EXISTS (
+            SELECT 1 FROM old.function AS o
+            WHERE o.id = main.function.id AND o.original_function = main.function.original_function
+        )
+        '''
+        try:
+            self.conn.execute("ATTACH DATABASE ? AS old", (old_db_file,))
+            with self.conn:
+                count = self.conn.execute(sql).rowcount
+            self.conn.execute("DETACH DATABASE old")
+            print(f"\t > Carried forward {count} functions from {old_db_file}")
+            return count
+        except sqlite3.Error as e:
+            exit(f"\t > Error carrying forward records: {e}")
+
     def close(self):
         """
         Close the database connection.
@@ -128,15 +506,14 @@ class FunctionDB:
             print("\t > Database connection closed.")
 
 
-class DatasetDB:
+class DatasetDB(SQLiteStore):
     def __init__(self, db_name='dataset.db'):
         """
         Initializes the DatasetDatabase class by creating (or connecting to) 
         the specified SQLite database and ensuring the `dataset` table exists.
         """
-        self.connection = sqlite3.connect(db_name)
-        self.cursor = self.connection.cursor()
-        self.create_table()
+        # generation and test run in separate processes and wait for the other's writes
+        super().__init__(db_name)
 
     def create_table(self):
         """
@@ -147,32 +524,95 @@ class DatasetDB:
         - interval: INTEGER NOT NULL
         - label: TEXT
         - diff: TEXT
+        - status: TEXT, 'ready' once published, 'claimed' by a test worker, then 'tested'
+        - candidate: INTEGER, last shuffled-id index of the patch, to resume generation
+        - patch: BLOB, the patch itself when generation was asked to store it
+        and the `dataset_function` table (iteration, function_id), the functions of each patch.
         """
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS dataset (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                model TEXT NOT NULL,
-                interval INTEGER NOT NULL,
-                label TEXT,
-                diff TEXT
-            )
-        ''')
-        self.connection.commit()
+        with self.write() as cursor:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS dataset (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    model TEXT NOT NULL,
+                    interval INTEGER NOT NULL,
+                    label TEXT,
+                    diff TEXT,
+                    status TEXT NOT NULL DEFAULT 'ready',
+                    candidate INTEGER
+                )
+            ''')
+            # databases generated before the work queue existed
+            cursor.execute("PRAGMA table_info(dataset)")
+            columns = [row[1] for row in cursor.fetchall()]
+            if "status" not in columns:
+                cursor.execute("ALTER TABLE dataset ADD COLUMN status TEXT NOT NULL DEFAULT 'ready'")
+            if "candidate" not in columns:
+                cursor.execute("ALTER TABLE dataset ADD COLUMN candidate INTEGER")
+            if "patch" not in columns:
+                cursor.execute("ALTER TABLE dataset ADD COLUMN patch BLOB")
+            cursor.execute('CREATE INDEX IF NOT EXISTS dataset_model_interval ON dataset(model, interval)')
+            # the ids of `label` as rows, so "which iterations contain function X" is an index lookup
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS dataset_function (
+                    iteration INTEGER NOT NULL,
+                    function_id INTEGER NOT NULL,
+                    PRIMARY KEY (iteration, function_id)
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS dataset_function_id ON dataset_function(function_id)')
+            # databases generated before the table existed
+            cursor.execute('SELECT EXISTS (SELECT 1 FROM dataset_function)')
+            if not cursor.fetchone()[0]:
+                cursor.execute('SELECT label FROM dataset WHERE label IS NOT NULL')
+                for (label,) in cursor.fetchall():
+                    self._insert_functions(cursor, label)
 
-    def insert_record(self, model, interval, label, diff):
+    def _insert_functions(self, cursor, label, function_ids=None):
         """
-        Inserts a new record into the `dataset` table.
+        Store the membership rows of one patch.
+
+        :param label: "{iteration},[id, id, ...]" as stored in the `label` column
+        :param function_ids: The ids of the patch, parsed from label if None
+        """
+        iteration, ids = label.split(",", 1)
+        if function_ids is None:
+            function_ids = json.loads(ids)
+        cursor.executemany('''
+            INSERT OR IGNORE INTO dataset_function (iteration, function_id) VALUES (?, ?)
+        ''', [(int(iteration), function_id) for function_id in set(function_ids)])
+
+    def insert_record(self, model, interval, label, diff, candidate=None, status='ready', function_ids=None, patch=None):
+        """
+        Inserts a new record into the `dataset` table, publishing it to the test workers,
+        along with its `dataset_function` rows.
+        Publishing the same candidate of a (model, interval) again is a no-op, so a
+        generation that is restarted after a crash cannot create a second iteration.
         
         :param model: The model name or identifier (TEXT)
         :param interval: The interval value (INTEGER)
-        :param label: The label (TEXT)
+        :param label: The label, "{iteration},[id, id, ...]" (TEXT)
         :param diff: The difference information (TEXT)
+        :param candidate: The last shuffled-id index the patch was drawn from (INTEGER)
+        :param status: 'claimed' when the producer tests the patch itself
+        :param function_ids: The function ids of the patch, parsed from label if None
+        :param patch: The patch text to keep in the database (BLOB), None to only keep `diff`
+        :return: The id of the record, which is also its iteration number
         """
-        self.cursor.execute('''
-            INSERT INTO dataset (model, interval, label, diff)
-            VALUES (?, ?, ?, ?)
-        ''', (model, interval, label, diff))
-        self.connection.commit()
+        with self.write() as cursor:
+            if candidate is not None:
+                cursor.execute('''
+                    SELECT id FROM dataset WHERE model = ? AND interval = ? AND candidate = ?
+                ''', (model, interval, candidate))
+                row = cursor.fetchone()
+                if row is not None:
+                    return row[0]
+            cursor.execute('''
+                INSERT INTO dataset (model, interval, label, diff, candidate, status, patch)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (model, interval, label, diff, candidate, status, patch))
+            record_id = cursor.lastrowid
+            self._insert_functions(cursor, label, function_ids)
+            return record_id
 
     def fetch_record_by_model_and_interval(self, model, interval):
         """
@@ -182,10 +622,9 @@ class DatasetDB:
         :param interval: The interval value to filter (INTEGER)
         :return: List of matching records
         """
-        self.cursor.execute('''
+        return self.fetchall('''
             SELECT * FROM dataset WHERE model = ? AND interval = ?
         ''', (model, interval))
-        return self.cursor.fetchall()
 
     def fetch_record_by_model_interval_and_id(self, model, interval, id):
         """
@@ -196,27 +635,100 @@ class DatasetDB:
         :param id: The primary key id to filter (INTEGER)
         :return: The matching record, or None if not found
         """
-        self.cursor.execute('''
+        return self.fetchone('''
             SELECT * FROM dataset WHERE model = ? AND interval = ? AND id = ?
         ''', (model, interval, id))
-        return self.cursor.fetchone()
 
-    def __del__(self):
+    def fetch_function_ids(self, iteration):
         """
-        Ensures the database connection is closed when the DatasetDatabase object is deleted.
+        Fetches the sorted function ids patched in one iteration.
         """
-        if hasattr(self, 'connection') and self.connection:
-            self.connection.close()
+        return [row[0] for row in self.fetchall('''
+            SELECT function_id FROM dataset_function WHERE iteration = ? ORDER BY function_id
+        ''', (iteration,))]
+
+    def fetch_iterations(self, function_id):
+        """
+        Fetches the sorted iterations whose patch contains a function.
+        """
+        return [row[0] for row in self.fetchall('''
+            SELECT iteration FROM dataset_function WHERE function_id = ? ORDER BY iteration
+        ''', (function_id,))]
+
+    def fetch_memberships(self, model, interval):
+        """
+        Fetches the functions of every iteration of a (model, interval).
+
+        :return: A dictionary {iteration: set of function ids}
+        """
+        rows = self.fetchall('''
+            SELECT f.iteration, f.function_id FROM dataset_function AS f
+            JOIN dataset AS d ON d.id = f.iteration
+            WHERE d.model = ? AND d.interval = ?
+        ''', (model, interval))
+        memberships = {}
+        for iteration, function_id in rows:
+            memberships.setdefault(iteration, set()).add(function_id)
+        return memberships
+
+    def fetch_patch(self, id):
+        """
+        Fetches the patch stored with a record, or None if only its path was kept.
+        """
+        row = self.fetchone('SELECT patch FROM dataset WHERE id = ?', (id,))
+        return row[0] if row else None
+
+    def fetch_progress(self, model, interval):
+        """
+        Where an interrupted generation stopped.
+
+        :return: (number of published records, candidate index of the last one or None)
+        """
+        return self.fetchone('''
+            SELECT COUNT(*), MAX(candidate) FROM dataset WHERE model = ? AND interval = ?
+        ''', (model, interval))
+
+    def claim_record(self, id):
+        """
+        Atomically move a record from 'ready' to 'claimed'.
+
+        :return: True if this caller claimed it.
+        """
+        with self.write() as cursor:
+            cursor.execute("UPDATE dataset SET status = 'claimed' WHERE id = ? AND status = 'ready'", (id,))
+            return cursor.rowcount == 1
+
+    def mark_tested(self, id):
+        with self.write() as cursor:
+            cursor.execute("UPDATE dataset SET status = 'tested' WHERE id = ?", (id,))
+
+    def release_claims(self, tested=()):
+        """
+        Hand records claimed by a test run that did not finish back to the queue, and the
+        records marked 'tested' whose result is not in the test.db being written (deleted,
+        or written elsewhere, e.g. by a --selective run).
+
+        :param tested: The iterations recorded in that test.db.
+        """
+        tested = set(tested)
+        with self.write() as cursor:
+            cursor.execute("UPDATE dataset SET status = 'ready' WHERE status = 'claimed'")
+            cursor.execute("SELECT id FROM dataset WHERE status = 'tested'")
+            # the record id is the iteration
+            stale = [(id,) for id, in cursor.fetchall() if id not in tested]
+            cursor.executemany("UPDATE dataset SET status = 'ready' WHERE id = ?", stale)
+
+class TestResultDB(SQLiteStore):
+    # the shape of a fetched record, (id, iteration, total, pass, fail, skip, bork, testlog),
+    # whatever columns are added to `dataset` later
+    RECORD_COLUMNS = "id, iteration, total, pass, fail, skip, bork, testlog"
 
-class TestResultDB:
     def __init__(self, db_name):
         """
         Initializes the TestResultDB_PHPSRC class by creating (or connecting to)
         the specified SQLite database and ensuring the `dataset` table exists.
         """
-        self.connection = sqlite3.connect(db_name)
-        self.cursor = self.connection.cursor()
-        self.create_table()
+        super().__init__(db_name)
 
     def create_table(self):
         """
@@ -230,24 +742,56 @@ class TestResultDB:
         - skip: INTEGER
         - bork: INTEGER
         - testlog: TEXT
+        - complete: INTEGER, 1 if test_outcome has every test that ran, 0 (or NULL for
+          older records) if it only has the tests that did not pass
+        and the `test_outcome` table (iteration, name, status, duration)
+        and the `test_blame` table (function_id, name, iterations).
         """
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS dataset (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                iteration INTEGER,
-                total INTEGER,
-                pass INTEGER,
-                fail INTEGER,
-                skip INTEGER,
-                bork INTEGER,
-                testlog TEXT
-            )
-        ''')
-        self.connection.commit()
+        with self.write() as cursor:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS dataset (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    iteration INTEGER,
+                    total INTEGER,
+                    pass INTEGER,
+                    fail INTEGER,
+                    skip INTEGER,
+                    bork INTEGER,
+                    testlog TEXT,
+                    complete INTEGER
+                )
+            ''')
+            cursor.execute("PRAGMA table_info(dataset)")
+            if "complete" not in [row[1] for row in cursor.fetchall()]:
+                # older records only kept the tests that did not pass
+                cursor.execute("ALTER TABLE dataset ADD COLUMN complete INTEGER")
+            cursor.execute('CREATE INDEX IF NOT EXISTS dataset_iteration ON dataset(iteration)')
+            # every test that ran, or only those that did not pass (see dataset.complete)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS test_outcome (
+                    iteration INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    duration REAL
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS test_outcome_iteration ON test_outcome(iteration)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS test_outcome_name ON test_outcome(name, status)')
+            # tests failing in every tested iteration that contains the function, see OSSBench.build_test_blame
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS test_blame (
+                    function_id INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    iterations INTEGER NOT NULL
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS test_blame_function ON test_blame(function_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS test_blame_name ON test_blame(name)')
 
-    def insert_record(self, iteration, total, pass_count, fail_count, skip_count, bork_count, testlog):
+    def insert_record(self, iteration, total, pass_count, fail_count, skip_count, bork_count, testlog, outcomes=None, complete=True):
         """
-        Inserts a new record into the `dataset` table.
+        Stores the result of one iteration, replacing a previous result of the same
+        iteration, so a test worker that records an iteration twice leaves one row.
         
         :param iteration: The iteration number (INTEGER)
         :param total:     The total number of tests (INTEGER)
@@ -256,80 +800,578 @@ class TestResultDB:
         :param skip_count: The number of skipped tests (INTEGER)
         :param bork_count: The number of borked tests (INTEGER)
         :param testlog:    Additional test log or notes (TEXT)
+        :param outcomes:   Per-test (name, status, duration) stored in the same transaction
+        :param complete:   True if outcomes has every test that ran, False if only those that did not pass
         """
-        self.cursor.execute('''
-            INSERT INTO dataset (iteration, total, pass, fail, skip, bork, testlog)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (iteration, total, pass_count, fail_count, skip_count, bork_count, testlog))
-        self.connection.commit()
+        complete = int(bool(complete)) if outcomes is not None else None
+        with self.write() as cursor:
+            cursor.execute('''
+                UPDATE dataset SET total = ?, pass = ?, fail = ?, skip = ?, bork = ?, testlog = ?, complete = COALESCE(?, complete)
+                WHERE iteration = ?
+            ''', (total, pass_count, fail_count, skip_count, bork_count, testlog, complete, iteration))
+            if cursor.rowcount == 0:
+                cursor.execute('''
+                    INSERT INTO dataset (iteration, total, pass, fail, skip, bork, testlog, complete)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (iteration, total, pass_count, fail_count, skip_count, bork_count, testlog, complete))
+            if outcomes is not None:
+                self._replace_outcomes(cursor, iteration, outcomes)
+
+    def insert_outcomes(self, iteration, outcomes):
+        """
+        Stores the per-test outcomes of one iteration, replacing previous ones.
+
+        :param iteration: The iteration number (INTEGER)
+        :param outcomes: Iterable of (name, status, duration), as yielded by TestLogParser
+        """
+        with self.write() as cursor:
+            self._replace_outcomes(cursor, iteration, outcomes)
+
+    def _replace_outcomes(self, cursor, iteration, outcomes):
+        cursor.execute('DELETE FROM test_outcome WHERE iteration = ?', (iteration,))
+        cursor.executemany('''
+            INSERT INTO test_outcome (iteration, name, status, duration)
+            VALUES (?, ?, ?, ?)
+        ''', [(iteration, name, status, duration) for name, status, duration in outcomes])
+
+    def fetch_outcomes_by_iteration(self, iteration):
+        """
+        Fetches the stored (name, status, duration) of an iteration's tests.
+        """
+        return self.fetchall('''
+            SELECT name, status, duration FROM test_outcome WHERE iteration = ?
+        ''', (iteration,))
+
+    def fetch_failures(self, statuses):
+        """
+        Fetches the tests of every iteration whose status is one of `statuses`.
+
+        :return: A dictionary {iteration: set of test names}
+        """
+        rows = self.fetchall(f'''
+            SELECT iteration, name FROM test_outcome WHERE status IN ({",".join("?" * len(statuses))})
+        ''', tuple(statuses))
+        failures = {}
+        for iteration, name in rows:
+            failures.setdefault(iteration, set()).add(name)
+        return failures
+
+    def fetch_runs(self, statuses):
+        """
+        Which of the tests ever having one of `statuses` ran in each iteration whose outcomes
+        are complete.
+
+        :return: A dictionary {iteration: set of test names}
+        """
+        rows = self.fetchall(f'''
+            SELECT test_outcome.iteration, test_outcome.name FROM test_outcome
+            JOIN dataset ON dataset.iteration = test_outcome.iteration
+            WHERE dataset.complete = 1 AND test_outcome.name IN (
+                SELECT name FROM test_outcome WHERE status IN ({",".join("?" * len(statuses))})
+            )
+        ''', tuple(statuses))
+        runs = {}
+        for iteration, name in rows:
+            runs.setdefault(iteration, set()).add(name)
+        return runs
+
+    def fetch_complete_iterations(self):
+        """
+        Fetches the iterations whose test_outcome rows have every test that ran.
+        """
+        return {row[0] for row in self.fetchall('SELECT iteration FROM dataset WHERE complete = 1')}
+
+    def replace_blame(self, blame):
+        """
+        Replaces the `test_blame` table.
+
+        :param blame: Iterable of (function_id, name, iterations)
+        """
+        with self.write() as cursor:
+            cursor.execute('DELETE FROM test_blame')
+            cursor.executemany('''
+                INSERT INTO test_blame (function_id, name, iterations)
+                VALUES (?, ?, ?)
+            ''', blame)
+
+    def fetch_blamed_tests(self, function_id):
+        """
+        Which tests does a function break.
+
+        :return: List of (name, iterations), iterations being how many tested patches containing the function ran the test
+        """
+        return self.fetchall('''
+            SELECT name, iterations FROM test_blame WHERE function_id = ? ORDER BY name
+        ''', (function_id,))
+
+    def fetch_blamed_functions(self, name):
+        """
+        Which functions are blamed for a test.
+
+        :return: List of (function_id, iterations)
+        """
+        return self.fetchall('''
+            SELECT function_id, iterations FROM test_blame WHERE name = ? ORDER BY iterations DESC, function_id
+        ''', (name,))
+
+    def fetch_records(self):
+        """
+        Fetches every tested iteration as (iteration, total).
+        """
+        return self.fetchall('SELECT iteration, total FROM dataset')
+
+    def fetch_records_by_id(self, limit):
+        """
+        Fetches the records with IDs 1..limit in one query, stopping at the first missing ID.
+
+        :param limit: The highest ID to fetch (INTEGER)
+        :return: List of records ordered by ID, as fetch_record_by_id returns them.
+        """
+        records = []
+        for record in self.fetchall(f'SELECT {self.RECORD_COLUMNS} FROM dataset WHERE id <= ? ORDER BY id', (limit,)):
+            if record[0] != len(records) + 1:
+                break
+            records.append(record)
+        return records
+
+    def count_records(self):
+        """
+        Number of tested iterations.
+        """
+        return self.fetchone('SELECT COUNT(*) FROM dataset')[0]
+
+    def fetch_record_by_iteration(self, iteration):
+        """
+        Fetches the result of one iteration, or None if it has not been tested.
+
+        :param iteration: The iteration number (INTEGER)
+        :return: (id, iteration, total, pass, fail, skip, bork, testlog)
+        """
+        return self.fetchone(f'''
+            SELECT {self.RECORD_COLUMNS} FROM dataset WHERE iteration = ?
+        ''', (iteration,))
 
     def fetch_record_by_id(self, record_id):
         """
         Fetches a record from the `dataset` table by its ID.
         
         :param record_id: The ID of the record to fetch (INTEGER)
-        :return: A dictionary containing the record data or None if not found.
+        :return: (id, iteration, total, pass, fail, skip, bork, testlog) or None if not found.
         """
-        self.cursor.execute('''
-            SELECT * FROM dataset WHERE id = ?
+        return self.fetchone(f'''
+            SELECT {self.RECORD_COLUMNS} FROM dataset WHERE id = ?
         ''', (record_id,))
-        return self.cursor.fetchone()
 
-    def __del__(self):
-        """
-        Ensures the database connection is closed when the TestResultDB_PHPSRC object is deleted.
-        """
-        if hasattr(self, 'connection') and self.connection:
-            self.connection.close()
-
-class FuzzResultDB:
+class FuzzResultDB(SQLiteStore):
     def __init__(self, db_name):
         """
         Initializes the FuzzResultDB class by creating (or connecting to)
         the specified SQLite database and ensuring the `fuzz` table exists.
         """
-        self.connection = sqlite3.connect(db_name)
-        self.cursor = self.connection.cursor()
-        self._create_table()  # Make sure to call the correct table creation method
+        super().__init__(db_name)
 
-    def _create_table(self) -> None:
+    def create_table(self):
         """
-        Create the `fuzz` table with columns:
+        Create the `fuzz` table with columns, one row per distinct bug:
             - id: primary key (auto-incrementing integer)
-            - crashsite: text (unique)
-            - details: text
+            - crashsite: text, "<kind> in <function> <file>"
+            - details: text, the first report of the bug
             - poc: text
             - poc_env: text
+            - stack_hash: text (unique), sanitizer, kind and top frames, see sanitizer.py
+            - sanitizer: text
+            - kind: text
+            - iteration: integer, first iteration the bug was found in (NULL outside fuzzing)
+            - source: text, file the first report was read from
+            - hits: integer, reports of the bug ingested so far
+        the `fuzz_summary` table, every distinct normalized SUMMARY line, the bug it was
+        first seen with and whether a log (not a fuzz archive) had it; the lines found in
+        logs are the memory safety score,
+        the `fuzz_source` table, the files already ingested,
+        and the `fuzz_progress` table:
+            - iteration: dataset iteration (primary key)
+            - status: 'done', 'skipped' (its tests did not run) or 'failed' (no archive, or flowfusion exited with an error; retried on resume)
+            - fuzzsize: test cases flowfusion was asked to run
+            - seconds: wall time of the campaign
+            - completed: 1 if flowfusion exited normally at fuzzsize, 0 otherwise
+            - archive: path of the zipped bugs folder
+        and the `fuzz_slice` table, one row per slice of an adaptive campaign:
+            - iteration, slice: dataset iteration and slice number (primary key)
+            - seconds: wall time of the slice
+            - cpu_seconds: wall time of the slice and of the build before it, times the CPUs
+              of its worker, charged to the budget
+            - new_sites: crash sites first seen in this slice
+            - archive: path of the zipped bugs folder
         """
-        self.cursor.execute('''
+        create_fuzz_sql = '''
             CREATE TABLE IF NOT EXISTS fuzz (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
-                crashsite TEXT UNIQUE,
+                crashsite TEXT,
                 details TEXT,
                 poc TEXT,
-                poc_env TEXT
+                poc_env TEXT,
+                stack_hash TEXT,
+                sanitizer TEXT,
+                kind TEXT,
+                iteration INTEGER,
+                source TEXT,
+                hits INTEGER NOT NULL DEFAULT 1
             )
-        ''')
-        self.connection.commit()
+        '''
+        with self.write() as cursor:
+            cursor.execute("PRAGMA table_info(fuzz)")
+            columns = [row[1] for row in cursor.fetchall()]
+            if columns and "stack_hash" not in columns:
+                # crashsite used to be unique and held the SUMMARY line, rebuild without the constraint
+                cursor.execute("ALTER TABLE fuzz RENAME TO fuzz_unhashed")
+                cursor.execute(create_fuzz_sql)
+                cursor.execute("INSERT INTO fuzz (id, crashsite, details, poc, poc_env) SELECT id, crashsite, details, poc, poc_env FROM fuzz_unhashed")
+                cursor.execute("DROP TABLE fuzz_unhashed")
+                cursor.execute("CREATE TABLE IF NOT EXISTS fuzz_summary (summary TEXT PRIMARY KEY, fuzz_id INTEGER, in_log INTEGER NOT NULL DEFAULT 0)")
+                cursor.execute("INSERT OR IGNORE INTO fuzz_summary (summary, fuzz_id) SELECT crashsite, id FROM fuzz")
+            cursor.execute(create_fuzz_sql)
+            cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS fuzz_stack_hash ON fuzz(stack_hash)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS fuzz_iteration ON fuzz(iteration)')
+            cursor.execute("CREATE TABLE IF NOT EXISTS fuzz_summary (summary TEXT PRIMARY KEY, fuzz_id INTEGER, in_log INTEGER NOT NULL DEFAULT 0)")
+            cursor.execute("PRAGMA table_info(fuzz_summary)")
+            if "in_log" not in [row[1] for row in cursor.fetchall()]:
+                # summaries used to be counted whatever their source, keep those of bugs first read from a log
+                cursor.execute("ALTER TABLE fuzz_summary ADD COLUMN in_log INTEGER NOT NULL DEFAULT 0")
+                cursor.execute("UPDATE fuzz_summary SET in_log = 1 WHERE fuzz_id IN (SELECT id FROM fuzz WHERE source NOT LIKE '%.zip')")
+            cursor.execute("CREATE TABLE IF NOT EXISTS fuzz_source (path TEXT PRIMARY KEY, reports INTEGER)")
+            # one row per dataset iteration the fuzz scheduler has handled, to resume a campaign
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS fuzz_progress (
+                    iteration INTEGER PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    fuzzsize INTEGER,
+                    seconds REAL,
+                    completed INTEGER,
+                    archive TEXT
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS fuzz_slice (
+                    iteration INTEGER NOT NULL,
+                    slice INTEGER NOT NULL,
+                    seconds REAL,
+                    cpu_seconds REAL NOT NULL,
+                    new_sites INTEGER NOT NULL,
+                    archive TEXT,
+                    PRIMARY KEY (iteration, slice)
+                )
+            ''')
 
-    def insert_record(self, crashsite, details, poc, poc_env):
+    def insert_record(self, crashsite, details, poc, poc_env, stack_hash=None, sanitizer=None, kind=None, summary=None, iteration=None, source=None):
         """
-        Inserts a new record into the `fuzz` table.
+        Inserts a new record into the `fuzz` table; a bug whose stack hash is already
+        recorded keeps its first record and only counts one more hit.
         
-        :param crashsite: A unique string identifying the crash site (TEXT)
+        :param crashsite: A string identifying the crash site (TEXT)
         :param details:   Additional details about the crash (TEXT)
         :param poc:       Proof of concept data (TEXT)
         :param poc_env:   Environment or configuration info for the POC (TEXT)
+        :param stack_hash: Key of the bug (TEXT), see sanitizer.SanitizerReport.stack_hash
+        :param summary:   The normalized SUMMARY line, None if the report has none (TEXT)
+        :return: True if the bug is new
+        """
+        with self.write() as cursor:
+            return self._insert_record(cursor, (crashsite, details, poc, poc_env, stack_hash, sanitizer, kind, summary), iteration, source)
+
+    def _insert_record(self, cursor, record, iteration, source):
+        crashsite, details, poc, poc_env, stack_hash, sanitizer, kind, summary = record
+        cursor.execute('''
+            INSERT OR IGNORE INTO fuzz (crashsite, details, poc, poc_env, stack_hash, sanitizer, kind, iteration, source)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (crashsite, details, poc, poc_env, stack_hash, sanitizer, kind, iteration, source))
+        new = cursor.rowcount == 1
+        if new:
+            fuzz_id = cursor.lastrowid
+        else:
+            cursor.execute('UPDATE fuzz SET hits = hits + 1 WHERE stack_hash = ?', (stack_hash,))
+            cursor.execute('SELECT id FROM fuzz WHERE stack_hash = ?', (stack_hash,))
+            fuzz_id = cursor.fetchone()[0]
+        if summary is not None:
+            in_log = int(source is not None and not source.endswith(".zip"))
+            cursor.execute('''
+                INSERT INTO fuzz_summary (summary, fuzz_id, in_log) VALUES (?, ?, ?)
+                ON CONFLICT(summary) DO UPDATE SET in_log = MAX(in_log, excluded.in_log)
+            ''', (summary, fuzz_id, in_log))
+        return new
+
+    def insert_reports(self, source, iteration, records):
+        """
+        Stores the reports of one ingested file in a single transaction and marks the file
+        as ingested; a file ingested before is left alone.
+
+        :param records: Iterable of (crashsite, details, poc, poc_env, stack_hash, sanitizer, kind, summary)
+        :return: The number of new bugs
+        """
+        with self.write() as cursor:
+            cursor.execute('INSERT OR IGNORE INTO fuzz_source (path, reports) VALUES (?, 0)', (source,))
+            if cursor.rowcount == 0:
+                return 0
+            new_bugs = 0
+            count = 0
+            for record in records:
+                new_bugs += self._insert_record(cursor, record, iteration, source)
+                count += 1
+            cursor.execute('UPDATE fuzz_source SET reports = ? WHERE path = ?', (count, source))
+            return new_bugs
+
+    def is_ingested(self, source):
+        return self.fetchone('SELECT 1 FROM fuzz_source WHERE path = ?', (source,)) is not None
+
+    def fetch_summaries(self, logs_only=True):
+        """
+        Fetches every distinct normalized SUMMARY line, in order.
+
+        :param logs_only: Only the lines found in logs, as the memory safety score has always
+                          counted them; False adds those only seen in fuzz archives.
+        """
+        where = ' WHERE in_log = 1' if logs_only else ''
+        return [row[0] for row in self.fetchall(f'SELECT summary FROM fuzz_summary{where} ORDER BY summary')]
+
+    def fetch_bugs(self):
+        """
+        Fetches the distinct bugs for triage, most hit first.
+
+        :return: List of (stack_hash, sanitizer, kind, crashsite, hits, iteration)
+        """
+        return self.fetchall('''
+            SELECT stack_hash, sanitizer, kind, crashsite, hits, iteration FROM fuzz ORDER BY hits DESC, id
+        ''')
+
+    def fetch_bugs_by_iteration(self, iteration):
+        """
+        Fetches (stack_hash, crashsite) of the bugs first found in one iteration.
+        """
+        return self.fetchall('SELECT stack_hash, crashsite FROM fuzz WHERE iteration = ? ORDER BY id', (iteration,))
+
+    def record_progress(self, iteration, status, fuzzsize=None, seconds=None, completed=None, archive=None):
+        """
+        Stores the outcome of one iteration's campaign, replacing a previous one.
+        """
+        with self.write() as cursor:
+            cursor.execute('''
+                INSERT OR REPLACE INTO fuzz_progress (iteration, status, fuzzsize, seconds, completed, archive)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (iteration, status, fuzzsize, seconds, None if completed is None else int(completed), archive))
+
+    def fetch_progress(self):
+        """
+        Fetches the status of every handled iteration.
+
+        :return: A dictionary {iteration: status}
+        """
+        return dict(self.fetchall('SELECT iteration, status FROM fuzz_progress'))
+
+    def fetch_campaigns(self):
+        """
+        Fetches (iteration, fuzzsize, seconds, completed) of every finished campaign.
+        """
+        return self.fetchall('''
+            SELECT iteration, fuzzsize, seconds, completed FROM fuzz_progress WHERE status = 'done' ORDER BY iteration
+        ''')
+
+    def record_slice(self, iteration, slice, seconds, cpu_seconds, new_sites, archive):
+        """
+        Stores one slice of an adaptive campaign, replacing a previous one.
+        """
+        with self.write() as cursor:
+            cursor.execute('''
+                INSERT OR REPLACE INTO fuzz_slice (iteration, slice, seconds, cpu_seconds, new_sites, archive)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (iteration, slice, seconds, cpu_seconds, new_sites, archive))
+
+    def fetch_slices(self):
+        """
+        Fetches the new crash sites of every slice run so far.
+
+        :return: A dictionary {iteration: [new_sites of slice 1, slice 2, ...]}
+        """
+        slices = {}
+        for iteration, new_sites in self.fetchall('SELECT iteration, new_sites FROM fuzz_slice ORDER BY iteration, slice'):
+            slices.setdefault(iteration, []).append(new_sites)
+        return slices
+
+    def fetch_cpu_seconds(self):
+        """
+        CPU seconds spent by all slices so far.
+        """
+        return self.fetchone('SELECT COALESCE(SUM(cpu_seconds), 0) FROM fuzz_slice')[0]
+
+class CoverageDB(SQLiteStore):
+    def __init__(self, db_name):
+        """
+        Initializes the CoverageDB class by creating (or connecting to)
+        the specified SQLite database and ensuring the `coverage` table exists.
+        """
+        super().__init__(db_name)
+
+    def create_table(self):
+        """
+        Creates the `coverage` table if it doesn't already exist.
+        - function_id: INTEGER, id in the base function.db
+        - test: TEXT, test unit executing the function (php-src test directory or sqlite test file)
+        """
+        with self.write() as cursor:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS coverage (
+                    function_id INTEGER NOT NULL,
+                    test TEXT NOT NULL
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS coverage_function ON coverage(function_id)')
+
+    def replace_coverage(self, rows):
+        """
+        Replaces the whole index.
+
+        :param rows: Iterable of (function_id, test)
+        """
+        with self.write() as cursor:
+            cursor.execute('DELETE FROM coverage')
+            cursor.executemany('INSERT INTO coverage (function_id, test) VALUES (?, ?)', rows)
+
+    def fetch_tests(self, function_ids):
+        """
+        Fetches the test units executing any of the given functions.
+
+        :param function_ids: Iterable of function ids (INTEGER)
+        :return: Sorted list of test units
+        """
+        function_ids = list(function_ids)
+        tests = set()
+        # stay below SQLite's bound parameter limit
+        for start in range(0, len(function_ids), 500):
+            chunk = function_ids[start:start + 500]
+            tests.update(row[0] for row in self.fetchall(f'''
+                SELECT DISTINCT test FROM coverage WHERE function_id IN ({",".join("?" * len(chunk))})
+            ''', chunk))
+        return sorted(tests)
+
+    def count_records(self):
+        return self.fetchone('SELECT COUNT(*) FROM coverage')[0]
+
+class ResponseCache:
+    """
+    A size-bounded, content-addressed store of LLM answers shared by every run.
+    Keys are computed by the caller (see Backend.cache_key); the least recently
+    used answers are evicted once the stored text exceeds max_bytes.
+    """
+
+    def __init__(self, db_name, max_bytes=1 << 30):
+        """
+        :param db_name: The SQLite database file.
+        :param max_bytes: Upper bound on the stored response text.
+        """
+        self.connection = connect(db_name)
+        self.cursor = self.connection.cursor()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.touched = {} # key -> last_used of hits not yet written
+        self.create_table()
+
+    def create_table(self):
+        """
+        Creates the `response` table if it doesn't already exist.
+        - key: TEXT PRIMARY KEY, hex digest of the request
+        - response: TEXT
+        - size: INTEGER, length of response
+        - last_used: REAL, unix time of the last get or put
         """
         self.cursor.execute('''
-            INSERT INTO fuzz (crashsite, details, poc, poc_env)
+            CREATE TABLE IF NOT EXISTS response (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        ''')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS response_last_used ON response(last_used)')
+        self.connection.commit()
+
+    def get(self, key):
+        """
+        Return the cached response for key, or None, and count the hit or miss.
+        """
+        self.cursor.execute('SELECT response FROM response WHERE key = ?', (key,))
+        row = self.cursor.fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # recency is written with the next put() or close(), keeping reads lock-free
+        # for other runs sharing the cache
+        self.touched[key] = time.time()
+        return row[0]
+
+    def write_touched(self):
+        """
+        Write the recency of the hits since the last flush, in the current transaction.
+        """
+        self.cursor.executemany('UPDATE response SET last_used = ? WHERE key = ?',
+                                [(last_used, key) for key, last_used in self.touched.items()])
+        self.touched = {}
+
+    def flush(self):
+        """
+        Write the recency of the hits since the last flush and commit.
+        """
+        self.write_touched()
+        self.connection.commit()
+
+    def put(self, key, response):
+        """
+        Store a response and evict the least recently used ones beyond max_bytes.
+        The insert, the size check and the eviction are one transaction, so runs sharing
+        the cache see each other's responses in the size.
+        """
+        # hits not written yet would otherwise look as old as their previous use
+        self.write_touched()
+        self.cursor.execute('''
+            INSERT OR REPLACE INTO response (key, response, size, last_used)
             VALUES (?, ?, ?, ?)
-        ''', (crashsite, details, poc, poc_env))
+        ''', (key, response, len(response), time.time()))
+        self.evict()
         self.connection.commit()
 
+    def total_bytes(self):
+        """
+        :return: The length of every stored response, as the database has it now.
+        """
+        self.cursor.execute('SELECT COALESCE(SUM(length(response)), 0) FROM response')
+        return self.cursor.fetchone()[0]
+
+    def evict(self):
+        """
+        Drop the oldest responses until the cache is back under 90% of max_bytes, if it
+        is above max_bytes. Called inside the transaction of put(), which commits.
+        """
+        total_bytes = self.total_bytes()
+        if total_bytes <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        self.cursor.execute('SELECT key, size FROM response ORDER BY last_used')
+        stale = []
+        for key, size in self.cursor.fetchall():
+            if total_bytes <= target:
+                break
+            stale.append((key,))
+            total_bytes -= size
+        self.cursor.executemany('DELETE FROM response WHERE key = ?', stale)
+
+    def close(self):
+        if self.connection:
+            self.flush()
+            self.connection.close()
+            self.connection = None
+
     def __del__(self):
         """
-        Ensures the database connection is closed when the FuzzResultDB object is deleted.
+        Ensures the database connection is closed when the ResponseCache object is deleted.
         """
         if hasattr(self, 'connection') and self.connection:
-            self.connection.close()
+            self.close()
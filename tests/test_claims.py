@@ -0,0 +1,77 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlite3db import DatasetDB, TestResultDB
+
+try:
+    import main
+except ImportError: # main.py needs the pipeline's dependencies (tqdm, clang, ...)
+    main = None
+
+
+class FakeSession:
+    """
+    Stands in for a build container: every patch builds and one sqlite test passes.
+    """
+
+    def build(self, diff_path, log_path, jobs=None, timeout=600):
+        with open(log_path, "w") as f:
+            f.write("make: Nothing to be done for 'all'.\n")
+        return 0
+
+    def test(self, log_path, jobs=32, timeout=150, tests=None):
+        with open(log_path, "w") as f:
+            f.write("### test/alter.test 12ms (done)\n")
+        return True
+
+
+class TestReleaseClaims(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        os.makedirs("./data/sqlite/model-seed0")
+        self.dataset_db = DatasetDB("./data/sqlite/model-seed0/dataset.db")
+        for iteration in (1, 2, 3):
+            self.dataset_db.insert_record("model-seed0", 73, f"{iteration},[{iteration}]", f"patches/{iteration}.diff", candidate=iteration)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def statuses(self):
+        return [row[0] for row in self.dataset_db.fetchall("SELECT status FROM dataset ORDER BY id")]
+
+    def test_tested_records_missing_from_test_db_are_released(self):
+        for id in (1, 2, 3):
+            self.dataset_db.claim_record(id)
+            self.dataset_db.mark_tested(id)
+        self.dataset_db.claim_record(3)
+        self.dataset_db.release_claims([1])
+        self.assertEqual(self.statuses(), ["tested", "ready", "ready"])
+
+    @unittest.skipIf(main is None, "main.py dependencies are not installed")
+    def test_rerun_after_deleting_test_db(self):
+        bench = main.OSSBench("model-seed0", "sqlite")
+        bench.test_iteration_num = 3
+        with mock.patch.object(main.OSSBench, "_session", return_value=FakeSession()):
+            bench.start_test()
+            self.assertEqual(self.statuses(), ["tested"] * 3)
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(f"./data/sqlite/model-seed0/test.db{suffix}"):
+                    os.remove(f"./data/sqlite/model-seed0/test.db{suffix}")
+            bench.start_test()
+        testdb = TestResultDB("./data/sqlite/model-seed0/test.db")
+        self.assertEqual(sorted(iteration for iteration, total in testdb.fetch_records()), [1, 2, 3])
+        self.assertEqual(self.statuses(), ["tested"] * 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlite3db import ResponseCache
+
+
+class TestSharedCache(unittest.TestCase):
+    """
+    Two runs sharing one cache file keep it under max_bytes together.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "cache.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_size_includes_other_runs(self):
+        first, second = ResponseCache(self.path, max_bytes=1000), ResponseCache(self.path, max_bytes=1000)
+        for k in range(8):
+            first.put(f"a{k}", "x" * 100)
+            second.put(f"b{k}", "y" * 100)
+        self.assertLessEqual(first.total_bytes(), 1000)
+        self.assertEqual(first.total_bytes(), second.total_bytes())
+        # the newest answers survive, wherever they were written
+        self.assertIsNotNone(first.get("b7"))
+        self.assertIsNotNone(second.get("a7"))
+        self.assertIsNone(first.get("a0"))
+        first.close()
+        second.close()
+
+    def test_hits_are_kept_over_older_puts(self):
+        cache = ResponseCache(self.path, max_bytes=1000)
+        for k in range(9):
+            cache.put(f"k{k}", "x" * 100)
+        self.assertIsNotNone(cache.get("k0"))
+        cache.put("k9", "x" * 200)
+        self.assertIsNotNone(cache.get("k0"))
+        self.assertIsNone(cache.get("k1"))
+        cache.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import score
+from sqlite3db import FunctionDB, DatasetDB, TestResultDB
+
+try:
+    import main
+except ImportError: # main.py needs the pipeline's dependencies (tqdm, clang, ...)
+    main = None
+
+
+class TestRecordShape(unittest.TestCase):
+    """
+    test.db records keep their 8 fields whatever columns `dataset` gains (e.g. `complete`).
+    """
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        os.makedirs("./data/sqlite/model-seed0")
+        FunctionDB("./data/sqlite/model-seed0/function.db").close()
+        self.testdb = TestResultDB("./data/sqlite/model-seed0/test.db")
+        self.testdb.insert_record(1, 10, 8, 1, 1, 0, "testlog/1.log", [("test/a.test", "done", 0.1)], complete=True)
+        self.testdb.insert_record(2, 10, 5, 5, 0, 0, "testlog/2.log", [("test/a.test", "failed", 0.1)], complete=False)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def test_fetch_methods_return_eight_fields(self):
+        self.assertEqual(self.testdb.fetch_record_by_iteration(1), (1, 1, 10, 8, 1, 1, 0, "testlog/1.log"))
+        self.assertEqual(self.testdb.fetch_record_by_id(2), (2, 2, 10, 5, 5, 0, 0, "testlog/2.log"))
+        self.assertEqual([len(record) for record in self.testdb.fetch_records_by_id(1000)], [8, 8])
+
+    def test_marking_tests(self):
+        testjsondata, final_score = score.marking_tests("model-seed0", "sqlite")
+        self.assertEqual(testjsondata, [{'testid': 1, 'passrate': 8/9}, {'testid': 2, 'passrate': 0.5}])
+        self.assertEqual(final_score, round(13/19*100*2/1000, 2))
+
+    @unittest.skipIf(main is None, "main.py dependencies are not installed")
+    def test_fuzz_targets(self):
+        bench = main.OSSBench("model-seed0", "sqlite")
+        bench.dataset_db = DatasetDB("./data/sqlite/model-seed0/dataset.db")
+        for iteration in (1, 2):
+            bench.dataset_db.insert_record("model-seed0", 73, f"{iteration},[{iteration}]", f"patches/{iteration}.diff", candidate=iteration)
+        targets, untested = bench._fuzz_targets(self.testdb, 73)
+        self.assertEqual(targets, {1: ("patches/1.diff", 8/9), 2: ("patches/2.diff", 0.5)})
+        self.assertEqual(untested, 998)
+
+
+if __name__ == "__main__":
+    unittest.main()